@@ -1,15 +1,23 @@
 import csv
+import hashlib
+import io
 import json
 import os
-import tempfile
+import re
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from itertools import chain
 from os import path, makedirs
+from queue import Queue
 from sys import modules
+from threading import Thread
+from zipfile import ZipFile
 
-import pandas
 import shutil
 from django.conf import settings
+from django.db import connections
 from django.db.models import Count
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.encoding import smart_str
 from django.utils.text import slugify
@@ -21,9 +29,15 @@ from experiments.models import Experiment, Group, Participant, EEGData, \
     QuestionnaireResponse, Questionnaire, EEG, EMG, TMS, GoalkeeperGame, \
     Stimulus, EMGElectrodeSetting, EEGElectrodePosition, \
     EMGSurfacePlacement, EMGIntramuscularPlacement, EMGNeedlePlacement, \
-    QuestionnaireLanguage, QuestionnaireDefaultLanguage
+    QuestionnaireLanguage, QuestionnaireDefaultLanguage, File, \
+    EEGElectrodeLocalizationSystem
 
 DEFAULT_LANGUAGE = "pt-BR"
+COPY_CHUNK_SIZE = 1024 * 1024
+EXPORT_MANIFEST_FILENAME = "export_manifest.json"
+# Change it when the files created by export change, so the files of
+# previous exports are not reused.
+EXPORT_MANIFEST_VERSION = 2
 
 input_data_keys = [
     "base_directory",
@@ -48,6 +62,63 @@ classification_of_disease_fields = [
     },
 ]
 
+# Values read as missing by pandas.read_csv, used before to sort questionnaire
+# metadata. Metadata is normalized the same way to keep the files unchanged.
+CSV_NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', 'N/A', 'NA', 'NULL', 'NaN', 'nan'
+}
+CSV_BOOL_VALUES = {
+    'True': 'True', 'TRUE': 'True', 'true': 'True',
+    'False': 'False', 'FALSE': 'False', 'false': 'False'
+}
+CSV_INT_PATTERN = re.compile(r'[+-]?\d+')
+CSV_FLOAT_PATTERN = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+participant_fields = [
+    {"field": 'code', "header": 'participant_code',
+     "description": _("Participant code")},
+    {"field": 'age', "header": 'age_(years)', "description": _("Age")},
+    {"field": 'gender_id', "header": 'gender', "description": _("Gender")},
+]
+
+
+def normalize_csv_columns(rows):
+    """Write csv values as pandas does after reading them: missing values
+    are emptied, integer columns lose leading zeros (and become float if
+    there is any value missing), float columns are written as Python floats
+    and boolean columns are capitalized.
+    :param rows: list of rows with the same length, changed in place
+    :return: list with the kind of each column: 'int', 'float' or 'str'
+    """
+    kinds = []
+    for column in range(len(rows[0]) if rows else 0):
+        values = [row[column] for row in rows]
+        present = [value for value in values if value not in CSV_NA_VALUES]
+        if present and all(CSV_INT_PATTERN.fullmatch(value)
+                           for value in present):
+            kind = 'int' if len(present) == len(values) else 'float'
+        elif present and all(CSV_FLOAT_PATTERN.fullmatch(value)
+                             for value in present):
+            kind = 'float'
+        else:
+            kind = 'str'
+        is_bool = present and all(value in CSV_BOOL_VALUES
+                                  for value in present)
+        for row in rows:
+            value = row[column]
+            if value in CSV_NA_VALUES:
+                row[column] = ''
+            elif kind == 'int':
+                row[column] = str(int(value))
+            elif kind == 'float':
+                row[column] = repr(float(value))
+            elif is_bool:
+                row[column] = CSV_BOOL_VALUES[value]
+        kinds.append(kind)
+
+    return kinds
+
 
 def save_to_csv(complete_filename, rows_to_be_saved):
     """
@@ -94,6 +165,130 @@ def create_directory(basedir, path_to_create):
     return "", complete_path
 
 
+def place_file(source, destination):
+    """
+    Place a file (usually an uploaded data file) in the export directory
+    without loading it in memory. The file is hard linked when source and
+    destination are in the same filesystem, otherwise it's copied in chunks.
+
+    :param source: complete filename of the file to be placed
+    :param destination: complete filename in export directory
+    """
+    # an existing destination may be a link to other file, so don't
+    # overwrite its content
+    if path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        copy_file(source, destination)
+
+
+def copy_file(source, destination):
+    """
+    Copy a file in chunks, with os.sendfile when the platform supports it.
+
+    :param source: complete filename of the file to be copied
+    :param destination: complete filename of the copy
+    """
+    with open(source, 'rb') as source_file, \
+            open(destination, 'wb') as destination_file:
+        offset = 0
+        try:
+            while True:
+                sent = os.sendfile(
+                    destination_file.fileno(), source_file.fileno(), offset,
+                    COPY_CHUNK_SIZE
+                )
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            # no sendfile for these files: copy the rest of them
+            source_file.seek(offset)
+            destination_file.seek(offset)
+            destination_file.truncate()
+            shutil.copyfileobj(source_file, destination_file, COPY_CHUNK_SIZE)
+
+
+class ZipFileWriter(Thread):
+    """Thread that writes to a zip file the files put in its queue, so the
+    compressed file is written while the other export files are still being
+    created. The queue is bounded to keep export threads from running too
+    far ahead of the zip file.
+    """
+
+    def __init__(self, zip_filename, queue_size=100):
+        super(ZipFileWriter, self).__init__()
+        self.zip_filename = zip_filename
+        self.queue = Queue(queue_size)
+        self.error = None
+
+    def put(self, files_to_zip_list):
+        """
+        :param files_to_zip_list: list of [filename, directory inside zip
+        file]
+        """
+        for file_to_zip in files_to_zip_list:
+            self.queue.put(file_to_zip)
+
+    def close(self):
+        """Wait for all files put in queue to be written and close the zip
+        file. Raises the exception that stopped writing the zip file, if
+        any.
+        """
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        # the zip file is created with the first file, so no zip file is
+        # created if there are no files to zip
+        zip_file = None
+        try:
+            for filename, directory in iter(self.queue.get, None):
+                if zip_file is None:
+                    zip_file = ZipFile(self.zip_filename, 'w')
+                fdir, fname = path.split(filename)
+                zip_file.write(
+                    filename.encode('utf-8'), path.join(directory, fname)
+                )
+            if zip_file:
+                zip_file.close()
+        except Exception as e:
+            self.error = e
+            # consume the rest of the queue so producers are not blocked
+            for file_to_zip in iter(self.queue.get, None):
+                pass
+            if zip_file:
+                zip_file.close()
+                os.remove(self.zip_filename)
+
+
+def _run_in_thread(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # each thread has its own database connection
+        connections.close_all()
+
+
+def _without_ids(data):
+    """Return data without the ids of objects (keys id and *_id), that
+    change from a version of the experiment to other
+    """
+    if isinstance(data, dict):
+        return {
+            key: _without_ids(value) for key, value in data.items()
+            if not (key == 'id' or str(key).endswith('_id'))
+        }
+    if isinstance(data, (list, tuple)):
+        return [_without_ids(value) for value in data]
+
+    return data
+
+
 class ExportExecution:
     def get_username(self, request):
         self.user_name = None
@@ -131,6 +326,7 @@ class ExportExecution:
         self.participants_filtered_data = []
         self.questionnaire_code_and_id = {}
         self.per_group_data = {}
+        self.manifest = {}
 
     def read_configuration_data(self, json_file, update_input_data=True):
         json_data = open(json_file)
@@ -367,11 +563,7 @@ class ExportExecution:
                         settings.MEDIA_ROOT,
                         experimental_protocol_image_filename
                     )
-                    with open(image_protocol, 'rb') as f:
-                        data = f.read()
-
-                    with open(complete_protocol_image_filename, 'wb') as f:
-                        f.write(data)
+                    place_file(image_protocol, complete_protocol_image_filename)
 
                 # By each step of the Experimental protocol -
                 # export default setting
@@ -620,10 +812,10 @@ class ExportExecution:
                                     context_tree_filename
                                 )
 
-                                with open(read_filename_context_tree, "rb") as f:
-                                    data = f.read()
-                                with open(complete_context_tree_filename, "wb") as f:
-                                    f.write(data)
+                                place_file(
+                                    read_filename_context_tree,
+                                    complete_context_tree_filename
+                                )
 
                                 self.files_to_zip_list.append(
                                     [complete_context_tree_filename,
@@ -672,10 +864,7 @@ class ExportExecution:
                             settings.MEDIA_ROOT, stimulus.media_file.name
                         )
 
-                        with open(read_stimulus_filename, "rb") as f:
-                            data = f.read()
-                        with open(complete_stimulus_filename, "wb") as f:
-                            f.write(data)
+                        place_file(read_stimulus_filename, complete_stimulus_filename)
 
                         self.files_to_zip_list.append(
                             [complete_stimulus_filename,
@@ -765,10 +954,7 @@ class ExportExecution:
             )
             read_additional_filename = path.join(settings.MEDIA_ROOT, file_name)
 
-            with open(read_additional_filename, "rb") as f:
-                data = f.read()
-            with open(complete_additional_filename, "wb") as f:
-                f.write(data)
+            place_file(read_additional_filename, complete_additional_filename)
 
             self.files_to_zip_list.append(
                 [complete_additional_filename,
@@ -806,14 +992,7 @@ class ExportExecution:
         return headers, fields
 
     def process_participant_data(self, participants_list):
-        patient_fields = [
-            {"field": 'code', "header": 'participant_code',
-             "description": _("Participant code")},
-            {"field": 'age', "header": 'age_(years)', "description": _("Age")},
-            {"field": 'gender_id', "header": 'gender',
-             "description": _("Gender")},
-        ]
-        headers, fields = self.get_headers_and_fields(patient_fields)
+        headers, fields = self.get_headers_and_fields(participant_fields)
         model_to_export = getattr(modules['experiments.models'], 'Participant')
         db_data = model_to_export.objects.filter(
             id__in=participants_list
@@ -837,6 +1016,33 @@ class ExportExecution:
 
         return export_rows_participants
 
+    def get_participant_data(self, participant):
+        """Same as process_participant_data([participant.id]), from the
+        participant instance already fetched.
+        :return: list with headers and participant fields
+        """
+        headers, fields = self.get_headers_and_fields(participant_fields)
+        row = [
+            self.handle_exported_field(getattr(participant, field))
+            for field in fields
+        ]
+        if row[1] == '':
+            del headers[1]
+            del row[1]
+
+        return [headers, row]
+
+    @staticmethod
+    def group_by(objects, key):
+        """Group objects in lists, keeping their order, in a dict keyed by
+        key(object).
+        """
+        grouped = {}
+        for obj in objects:
+            grouped.setdefault(key(obj), []).append(obj)
+
+        return grouped
+
     def process_group_inclusion_disease(self, inclusion_criteria_list):
         export_rows_classification_of_disease = []
         if inclusion_criteria_list:
@@ -854,28 +1060,81 @@ class ExportExecution:
 
     @staticmethod
     def _sort_metadata(q_metadata):
-        temp_dir = tempfile.mkdtemp()
-        csv_metadata = os.path.join(temp_dir, 'metadata.csv')
-        csv_metadata_sorted = os.path.join(temp_dir, 'metadata_sorted.csv')
-        with open(csv_metadata, 'w') as f:
-            f.write(q_metadata)
-        df = pandas.read_csv(csv_metadata)
-        df = df.sort_values('question_order')  # csv has column question_order
-        df.to_csv(csv_metadata_sorted, index=False)
-        # group new sorted csv file lines in a list
-        with open(csv_metadata_sorted) as f:
-            lines = [line.split(',', 2) for line in f.readlines()]
-            text = [', '.join(line) for line in lines]
-        # make list a string
-        text = ''.join(text)
-
-        shutil.rmtree(temp_dir)
-        return text
+        """Sort the questionnaire metadata csv rows by question_order
+        (stable, rows without it go last) and join the first three fields
+        of each line with ', '.
+        """
+        reader = csv.reader(io.StringIO(q_metadata))
+        header = next(reader)
+        order = header.index('question_order')  # csv has column question_order
+        # blank lines are skipped and short rows filled with empty fields
+        rows = [
+            row + [''] * (len(header) - len(row)) for row in reader if row
+        ]
+        kinds = normalize_csv_columns(rows)
+        if kinds and kinds[order] != 'str':
+            rows.sort(key=lambda row: (
+                row[order] == '', float(row[order] or 0)
+            ))
+        else:
+            rows.sort(key=lambda row: (row[order] == '', row[order]))
+
+        sorted_metadata = io.StringIO()
+        writer = csv.writer(sorted_metadata, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+        # group new sorted csv lines in a list (as read from a file)
+        lines = io.StringIO(sorted_metadata.getvalue(), newline=None)
+
+        return ''.join(', '.join(line.split(',', 2)) for line in lines)
 
     def include_data_from_group(self, experiment_id):
         error_msg = ""
         experiment = get_object_or_404(Experiment, pk=experiment_id)
         group_list = Group.objects.filter(experiment=experiment)
+
+        # Fetch all the experiment data in a fixed number of queries, grouped
+        # by group, step or questionnaire.
+        participants_per_group = self.group_by(
+            Participant.objects.filter(group__experiment=experiment),
+            lambda participant: participant.group_id
+        )
+        questionnaires_per_group = self.group_by(
+            Questionnaire.objects.filter(
+                group__experiment=experiment, type=Step.QUESTIONNAIRE
+            ),
+            lambda questionnaire: questionnaire.group_id
+        )
+        responses_per_step = self.group_by(
+            QuestionnaireResponse.objects.filter(
+                step__group__experiment=experiment
+            ).select_related('participant'),
+            lambda response: response.step_id
+        )
+        default_language_per_questionnaire = {
+            default_language.questionnaire_id: default_language
+            for default_language in
+            QuestionnaireDefaultLanguage.objects.filter(
+                questionnaire__group__experiment=experiment
+            ).select_related('questionnaire_language')
+        }
+        languages_per_questionnaire = self.group_by(
+            QuestionnaireLanguage.objects.filter(
+                questionnaire__group__experiment=experiment
+            ),
+            lambda questionnaire_language:
+            questionnaire_language.questionnaire_id
+        )
+        data_collections_per_group = {}
+        for model in [EEGData, EMGData, TMSData, AdditionalData,
+                      GenericDataCollectionData, GoalkeeperGameData]:
+            data_collections_per_group[model] = self.group_by(
+                model.objects.filter(
+                    participant__group__experiment=experiment
+                ).select_related('participant', 'step'),
+                lambda data_collection: data_collection.participant.group_id
+            )
+
         for group in group_list:
             group_id = group.id
             if group.id not in self.per_group_data:
@@ -904,7 +1163,7 @@ class ExportExecution:
             self.per_group_data[group_id]['data_per_participant'] = {}
             self.per_group_data[group_id]['questionnaires_per_group'] = {}
 
-            participant_group_list = Participant.objects.filter(group=group)
+            participant_group_list = participants_per_group.get(group_id, [])
             self.per_group_data[group_id]['participant_list'] = []
             for participant in participant_group_list:
                 self.per_group_data[group_id]['participant_list'].append(participant)
@@ -918,15 +1177,19 @@ class ExportExecution:
             )
 
             # questionnaire data
-            step_list = Step.objects.filter(group=group, type='questionnaire')
+            step_list = questionnaires_per_group.get(group_id, [])
             if step_list:
                 if 'questionnaire_metadata' not in self.per_group_data[group_id]:
                     self.per_group_data[group_id]['questionnaire_metadata'] = {}
                 if 'questionnaire_data' not in self.per_group_data[group_id]:
                     self.per_group_data[group_id]['questionnaire_data'] = {}
+            # Each response is kept once, as a tuple in the response_list of
+            # its questionnaire, sharing the questionnaire header. The per
+            # participant data refers to it by its index in response_list.
+            participant_data_per_id = {}
             for step_questionnaire in step_list:
-                questionnaire_list = QuestionnaireResponse.objects.filter(
-                    step_id=step_questionnaire.id
+                questionnaire_list = responses_per_step.get(
+                    step_questionnaire.id, []
                 )
                 for questionnaire in questionnaire_list:
                     participant_code = questionnaire.participant.code
@@ -934,25 +1197,30 @@ class ExportExecution:
                     questionnaire_response_fields = json.loads(
                         questionnaire.limesurvey_response
                     )
-                    questionnaire_response_list = \
-                        questionnaire_response_fields['answers']
                     # add participant data to the questionnaire fields data
-                    participant_data_list = self.process_participant_data(
-                        [questionnaire.participant.id]
-                    )
-                    questionnaire_response_fields_list = participant_data_list[1]
-                    questionnaire_response_fields_list.extend(
-                        questionnaire_response_list
-                    )
-                    survey = get_object_or_404(
-                        Questionnaire, pk=step_questionnaire.id
-                    )
-                    questionnaire_code = survey.code
-                    # questionnaire title
-                    questionnaire_default_language = get_object_or_404(
-                            QuestionnaireDefaultLanguage,
-                            questionnaire_id=step_questionnaire.id
+                    if questionnaire.participant_id not in \
+                            participant_data_per_id:
+                        participant_data_per_id[
+                            questionnaire.participant_id
+                        ] = self.get_participant_data(
+                            questionnaire.participant
                         )
+                    participant_data_list = participant_data_per_id[
+                        questionnaire.participant_id
+                    ]
+                    questionnaire_response_fields_list = tuple(chain(
+                        participant_data_list[1],
+                        questionnaire_response_fields['answers']
+                    ))
+                    questionnaire_code = step_questionnaire.code
+                    # questionnaire title
+                    if step_questionnaire.id not in \
+                            default_language_per_questionnaire:
+                        raise Http404
+                    questionnaire_default_language = \
+                        default_language_per_questionnaire[
+                            step_questionnaire.id
+                        ]
                     questionnaire_title = \
                         "%s_%s" % (str(questionnaire_code), slugify(
                              questionnaire_default_language.questionnaire_language.survey_name
@@ -960,8 +1228,8 @@ class ExportExecution:
 
                     # questionnaire language
                     questionnaire_language_list = \
-                        QuestionnaireLanguage.objects.filter(
-                            questionnaire_id=step_questionnaire.id
+                        languages_per_questionnaire.get(
+                            step_questionnaire.id, []
                         )
 
                     # questionnaire_title in english
@@ -976,13 +1244,10 @@ class ExportExecution:
                     # data per questionnaire_response
                     if questionnaire_code not in \
                             self.per_group_data[group_id]['questionnaire_data']:
-                        questionnaire_header_response_list = \
+                        questionnaire_header_fields_list = tuple(chain(
+                            participant_data_list[0],
                             questionnaire_response_fields['questions']
-                        questionnaire_header_fields_list = \
-                            participant_data_list[0]
-                        questionnaire_header_fields_list.extend(
-                            questionnaire_header_response_list
-                        )
+                        ))
                         self.per_group_data[group_id]['questionnaire_data'][
                             questionnaire_code
                         ] = {
@@ -994,10 +1259,10 @@ class ExportExecution:
                             'response_list': []
                         }
 
-                    self.per_group_data[group_id]['questionnaire_data'][
-                        questionnaire_code
-                    ]['response_list'].append(
-                        questionnaire_response_fields_list)
+                    response_list = self.per_group_data[group_id][
+                        'questionnaire_data'
+                    ][questionnaire_code]['response_list']
+                    response_list.append(questionnaire_response_fields_list)
 
                     # questionnaire data per participant
                     directory_step_name = \
@@ -1037,9 +1302,8 @@ class ExportExecution:
                     ]['questionnaire_data'].append({
                             'step_identification':
                             step_questionnaire.identification,
-                            'questionnaire_response_list':
-                            [questionnaire_header_fields_list,
-                             questionnaire_response_fields_list],
+                            'questionnaire_code': questionnaire_code,
+                            'response_index': len(response_list) - 1,
                             'questionnaire_filename':
                             "%s.csv" % questionnaire_title,
                             'directory_step_name': directory_step_name,
@@ -1061,10 +1325,6 @@ class ExportExecution:
                         self.per_group_data[group_id][
                             'questionnaire_metadata'
                         ][questionnaire_code] = {}
-                        questionnaire_language_list = \
-                            QuestionnaireLanguage.objects.filter(
-                                questionnaire_id=step_questionnaire.id
-                            )
                         for questionnaire_language in \
                                 questionnaire_language_list:
                             survey_metadata = self._sort_metadata(
@@ -1091,9 +1351,9 @@ class ExportExecution:
                                     }
 
             # participant with data collection
-            eeg_participant_list = EEGData.objects.filter(
-                participant__in=participant_group_list
-            )
+            eeg_participant_list = data_collections_per_group[
+                EEGData
+            ].get(group_id, [])
             for eeg_participant in eeg_participant_list:
                 participant_code = eeg_participant.participant.code
                 directory_step_name = \
@@ -1130,9 +1390,9 @@ class ExportExecution:
                     ),
                 })
 
-            emg_participant_list = EMGData.objects.filter(
-                participant__in=participant_group_list
-            )
+            emg_participant_list = data_collections_per_group[
+                EMGData
+            ].get(group_id, [])
             for emg_participant in emg_participant_list:
                 participant_code = emg_participant.participant.code
                 participant_code_directory_name = \
@@ -1170,9 +1430,9 @@ class ExportExecution:
                     ),
                 })
 
-            tms_participant_list = TMSData.objects.filter(
-                participant__in=participant_group_list
-            )
+            tms_participant_list = data_collections_per_group[
+                TMSData
+            ].get(group_id, [])
             for tms_participant in tms_participant_list:
                 participant_code = tms_participant.participant.code
                 participant_code_directory_name = \
@@ -1204,9 +1464,9 @@ class ExportExecution:
                     ),
                 })
 
-            additional_data_list = AdditionalData.objects.filter(
-                participant__in=participant_group_list
-            )
+            additional_data_list = data_collections_per_group[
+                AdditionalData
+            ].get(group_id, [])
             whole_additional_data = 0
             for additional_data in additional_data_list:
                 participant_code = additional_data.participant.code
@@ -1284,9 +1544,9 @@ class ExportExecution:
                     }
                 )
 
-            generic_data_list = GenericDataCollectionData.objects.filter(
-                participant__in=participant_group_list
-            )
+            generic_data_list = data_collections_per_group[
+                GenericDataCollectionData
+            ].get(group_id, [])
             for generic_data in generic_data_list:
                 participant_code = generic_data.participant.code
                 participant_code_directory_name = \
@@ -1323,9 +1583,9 @@ class ExportExecution:
                     ),
                 })
 
-            goalkeeper_data_list = GoalkeeperGameData.objects.filter(
-                participant__in=participant_group_list
-            )
+            goalkeeper_data_list = data_collections_per_group[
+                GoalkeeperGameData
+            ].get(group_id, [])
             for goalkeeper_data in goalkeeper_data_list:
                 participant_code = goalkeeper_data.participant.code
                 participant_code_directory_name = \
@@ -1368,697 +1628,1010 @@ class ExportExecution:
 
         return error_msg
 
-    def download_data_per_participant(self):
-        error_msg = ""
-        per_participant_data = self.input_data['participant_data_directory']
-        for group_id in self.per_group_data:
-            if self.per_group_data[group_id]['data_per_participant']:
-                group_directory = self.per_group_data[group_id]['group']['directory']
-
-                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Per_participant_data
-                error_msg, group_participants_directory = create_directory(
-                    group_directory, per_participant_data
+    def read_manifest(self, directory_base=None):
+        """Read the manifest of the previous export of the experiment, with
+        the hash of the data each group was exported from and the files
+        created from it, relative to the export directory base.
+        :param directory_base: directory base of the export to read the
+        manifest from (default: the one of this export)
+        """
+        try:
+            with open(path.join(
+                    directory_base or self.get_directory_base(),
+                    EXPORT_MANIFEST_FILENAME
+            )) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get('version') != EXPORT_MANIFEST_VERSION:
+            manifest = {}
+
+        return manifest.get('units', {})
+
+    def save_manifest(self):
+        with open(path.join(
+                self.get_directory_base(), EXPORT_MANIFEST_FILENAME
+        ), 'w') as manifest_file:
+            json.dump(
+                {'version': EXPORT_MANIFEST_VERSION, 'units': self.manifest},
+                manifest_file
+            )
+
+    @staticmethod
+    def get_group_files_state(group_id):
+        """Return name, size and modification time of the data files of the
+        group participants and of the sensor position images of their EEG
+        settings.
+        """
+        file_names = []
+        for related_name in [
+            'eeg_data_list', 'emg_data_list', 'goalkeeper_game_data_list',
+            'generic_data_collection_data_list', 'additional_data_list'
+        ]:
+            file_names += File.objects.filter(**{
+                related_name + '__participant__group_id': group_id
+            }).distinct().order_by('id').values_list('file', flat=True)
+        file_names += [
+            file_name for file_name in
+            EEGElectrodeLocalizationSystem.objects.filter(
+                eeg_setting__eegdata__participant__group_id=group_id
+            ).distinct().order_by('pk').values_list(
+                'map_image_file', flat=True
+            ) if file_name
+        ]
+
+        files_state = []
+        for file_name in file_names:
+            try:
+                stat = os.stat(path.join(settings.MEDIA_ROOT, file_name))
+                files_state.append([file_name, stat.st_size, stat.st_mtime])
+            except OSError:
+                files_state.append([file_name, None, None])
+
+        return files_state
+
+    @staticmethod
+    def get_group_descriptions(group_id):
+        """Return the descriptions of the EEG and EMG settings and of the TMS
+        data of the group participants, written in the per participant
+        files.
+        """
+        descriptions = []
+        for eeg_setting_id in EEGData.objects.filter(
+                participant__group_id=group_id
+        ).order_by('eeg_setting_id').values_list(
+            'eeg_setting_id', flat=True
+        ).distinct():
+            descriptions.append(get_eeg_setting_description(eeg_setting_id))
+        for emg_setting_id in EMGData.objects.filter(
+                participant__group_id=group_id
+        ).order_by('emg_setting_id').values_list(
+            'emg_setting_id', flat=True
+        ).distinct():
+            descriptions.append(get_emg_setting_description(emg_setting_id))
+        for tms_data_id in TMSData.objects.filter(
+                participant__group_id=group_id
+        ).order_by('id').values_list('id', flat=True):
+            descriptions.append(get_tms_data_description(tms_data_id))
+
+        return descriptions
+
+    def get_group_data_hash(self, function, group_id):
+        """Hash of the data a group is exported from by function: the group
+        data loaded by include_data_from_group and, for per participant
+        files, the data files of the group participants and the descriptions
+        of their settings. The hash doesn't depend on the object ids nor on
+        the export directory, so it's the same for the same data in other
+        versions of the experiment.
+        """
+        group_data = self.per_group_data[group_id]
+        data = [
+            function.__name__, self.input_data, group_data['group'],
+            group_data.get('questionnaire_data'),
+            group_data.get('questionnaire_metadata')
+        ]
+        if function == self.download_group_data_per_participant:
+            data += [
+                group_data['data_per_participant'],
+                self.get_group_files_state(group_id),
+                self.get_group_descriptions(group_id)
+            ]
+        content = json.dumps(_without_ids(data), sort_keys=True, default=str)
+        content = content.replace(self.get_directory_base(), '')
+
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _files_exist(directory_base, files_list):
+        for filename, directory, size in files_list:
+            try:
+                if os.stat(path.join(directory_base, filename)).st_size != size:
+                    return False
+            except OSError:
+                return False
+
+        return True
+
+    def _download_unchanged_group_data(self, previous_files):
+        """Take the files of a group from the previous export. Files of
+        the export of other version of the experiment are placed in the
+        export directory: data files (already linked by other exports) are
+        linked, the files written by export are copied, so exporting one
+        version again doesn't change the files of the other.
+        :param previous_files: directory base of the previous export, list
+        of [filename, directory, size] of the files, filenames relative to
+        the directory base
+        """
+        directory_base, files_list = previous_files
+        files_to_zip_list = []
+        for filename, directory, size in files_list:
+            destination = path.join(self.get_directory_base(), filename)
+            if directory_base != self.get_directory_base():
+                source = path.join(directory_base, filename)
+                if not path.exists(path.dirname(destination)):
+                    makedirs(path.dirname(destination), exist_ok=True)
+                if os.stat(source).st_nlink > 1:
+                    place_file(source, destination)
+                else:
+                    if path.lexists(destination):
+                        os.remove(destination)
+                    copy_file(source, destination)
+            files_to_zip_list.append([destination, directory])
+
+        return '', files_to_zip_list
+
+    def download_data_per_group(self, zip_writer, workers=1,
+                                progress_callback=None,
+                                previous_directory_base=None):
+        """Create the per participant and per questionnaire files of all
+        groups in the worker threads: the per participant files a
+        participant at a time in each thread, the per questionnaire files a
+        group at a time. The files are put in zip_writer as soon as each
+        participant or group is done. Groups whose data didn't change since
+        the previous export (see read_manifest) keep the files created
+        before.
+        :param zip_writer: ZipFileWriter instance
+        :param workers: number of worker threads
+        :param progress_callback: function called with number of units done
+        and total number of units each time a unit is done
+        :param previous_directory_base: directory base of the export of the
+        previous version of the experiment, whose files are reused when the
+        experiment wasn't exported yet
+        :return: error message ("" if none)
+        """
+        error_msg = ''
+        directory_base = self.get_directory_base()
+        previous_manifest = self.read_manifest()
+        if not previous_manifest and previous_directory_base:
+            directory_base = previous_directory_base
+            previous_manifest = self.read_manifest(directory_base)
+        # units are the groups files, kept in the manifest, each one done by
+        # one or more tasks (function, arguments)
+        units = []
+        tasks = []
+        for function in [self.download_group_data_per_participant,
+                         self.download_group_data_per_questionnaire]:
+            for group_id in self.per_group_data:
+                # groups are identified by their directories, the same in
+                # all versions of the experiment
+                key = '%s_%s' % (
+                    function.__name__,
+                    self.per_group_data[group_id]['group']['export_directory']
                 )
+                data_hash = self.get_group_data_hash(function, group_id)
+                previous = previous_manifest.get(key, {})
+                if previous.get('hash') == data_hash and \
+                        self._files_exist(directory_base, previous['files']):
+                    unit_tasks = [(
+                        self._download_unchanged_group_data,
+                        ((directory_base, previous['files']),)
+                    )]
+                elif function == self.download_group_data_per_participant:
+                    error_msg = \
+                        self.create_group_participants_directory(group_id)[0]
+                    if error_msg != '':
+                        return error_msg
+                    unit_tasks = [
+                        (self.download_participant_data,
+                         (group_id, participant_code))
+                        for participant_code in self.per_group_data[
+                            group_id]['data_per_participant']
+                    ]
+                else:
+                    unit_tasks = [(function, (group_id,))]
+                unit = {
+                    'key': key, 'hash': data_hash,
+                    'pending_tasks': len(unit_tasks), 'files': []
+                }
+                units.append(unit)
+                tasks += [(unit, task) for task in unit_tasks]
+
+        # units without tasks (groups without data per participant) are
+        # already done
+        for unit in units:
+            if not unit['pending_tasks']:
+                self.manifest[unit['key']] = {
+                    'hash': unit['hash'], 'files': []
+                }
+
+        executor = None
+        if workers > 1:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            results = executor.map(
+                lambda task: _run_in_thread(task[1][0], *task[1][1]), tasks
+            )
+        else:
+            results = (task[1][0](*task[1][1]) for task in tasks)
+        try:
+            for (unit, task), (error_msg, files_to_zip_list) in \
+                    zip(tasks, results):
+                self.files_to_zip_list.extend(files_to_zip_list)
+                zip_writer.put(files_to_zip_list)
                 if error_msg != '':
-                    return error_msg
+                    break
+                unit['files'].extend(files_to_zip_list)
+                unit['pending_tasks'] -= 1
+                if unit['pending_tasks']:
+                    continue
+                self.manifest[unit['key']] = {
+                    'hash': unit['hash'],
+                    'files': [
+                        [
+                            path.relpath(filename, self.get_directory_base()),
+                            directory, os.stat(filename).st_size
+                        ]
+                        for filename, directory in unit['files']
+                    ]
+                }
+                if progress_callback:
+                    progress_callback(len(self.manifest), len(units))
+        finally:
+            if executor:
+                executor.shutdown()
 
-                for participant_code in self.per_group_data[group_id]['data_per_participant']:
-                    participant_code_directory_name = "Participant_" + participant_code
-                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXXX
-                    participant_directory = path.join(
-                        group_participants_directory, participant_code_directory_name
-                    )
-                    if not path.exists(participant_directory):
-                        error_msg, participant_directory = create_directory(
-                            group_participants_directory,
-                            participant_code_directory_name
+        return error_msg
+
+    def remove_stale_files(self, keep_directories=()):
+        """Remove the files of the export directory that are not in this
+        export, as the files of participants and groups changed or removed
+        since the previous export, and the directories left empty.
+        :param keep_directories: directories of the directory base whose files
+        are kept
+        """
+        directory_base = self.get_directory_base()
+        keep = {
+            path.normpath(filename)
+            for filename, directory in self.files_to_zip_list
+        }
+        keep.add(path.join(directory_base, EXPORT_MANIFEST_FILENAME))
+        keep.add(path.join(
+            directory_base, self.get_input_data('export_filename')
+        ))
+        for root, dirs, files in os.walk(directory_base, topdown=False):
+            if any(path.relpath(root, directory_base).split(os.sep)[0] ==
+                   directory for directory in keep_directories):
+                continue
+            for name in files:
+                filename = path.join(root, name)
+                if filename not in keep:
+                    os.remove(filename)
+            if root != directory_base and not os.listdir(root):
+                os.rmdir(root)
+
+    def download_group_data_per_participant(self, group_id):
+        """Create the per participant files of a group. Doesn't change the
+        export state, so groups can be processed at the same time.
+        :param group_id: group id
+        :return: error message ("" if none), list of [filename, directory]
+        of the files created, to be included in compressed file
+        """
+        files_to_zip_list = []
+        error_msg, group_participants_directory = \
+            self.create_group_participants_directory(group_id)
+        if error_msg != '' or not group_participants_directory:
+            return error_msg, files_to_zip_list
+
+        for participant_code in \
+                self.per_group_data[group_id]['data_per_participant']:
+            error_msg, participant_files_to_zip_list = \
+                self.download_participant_data(group_id, participant_code)
+            files_to_zip_list.extend(participant_files_to_zip_list)
+            if error_msg != '':
+                break
+
+        return error_msg, files_to_zip_list
+
+    def create_group_participants_directory(self, group_id):
+        """Create the directory of the per participant files of a group, if
+        the group has data per participant.
+        :param group_id: group id
+        :return: error message ("" if none), the directory ("" if not
+        created)
+        """
+        if not self.per_group_data[group_id]['data_per_participant']:
+            return '', ''
+
+        # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Per_participant_data
+        return create_directory(
+            self.per_group_data[group_id]['group']['directory'],
+            self.input_data['participant_data_directory']
+        )
+
+    def download_participant_data(self, group_id, participant_code):
+        """Create the files of a participant of a group. The directory of the
+        per participant files of the group must exist (see
+        create_group_participants_directory). Doesn't change the export
+        state, so participants can be processed at the same time.
+        :param group_id: group id
+        :param participant_code: participant code
+        :return: error message ("" if none), list of [filename, directory]
+        of the files created, to be included in compressed file
+        """
+        error_msg = ''
+        files_to_zip_list = []
+        group_participants_directory = path.join(
+            self.per_group_data[group_id]['group']['directory'],
+            self.input_data['participant_data_directory']
+        )
+
+        participant_code_directory_name = "Participant_" + participant_code
+        # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXXX
+        participant_directory = path.join(
+            group_participants_directory, participant_code_directory_name
+        )
+        if not path.exists(participant_directory):
+            error_msg, participant_directory = create_directory(
+                group_participants_directory,
+                participant_code_directory_name
+            )
+            if error_msg != '':
+                return error_msg, files_to_zip_list
+
+        # data from questionnaire
+        if 'questionnaire_data' in \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            questionnaire_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['questionnaire_data']
+            for questionnaire_data in questionnaire_list:
+                questionnaire_directory = \
+                    questionnaire_data['directory_step']
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_Questionnaire
+                if not path.exists(questionnaire_directory):
+                    error_msg, questionnaire_directory = \
+                        create_directory(
+                            participant_directory,
+                            questionnaire_data['directory_step_name']
                         )
-                        if error_msg != '':
-                            return error_msg
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_Questionnaire
+                export_questionnaire_directory = \
+                    questionnaire_data['export_directory_step']
+                filename_questionnaire = \
+                    questionnaire_data['questionnaire_filename']
+                complete_filename_questionnaire = path.join(
+                    questionnaire_directory, filename_questionnaire
+                )
 
-                    # data from questionnaire
-                    if 'questionnaire_data' in \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        questionnaire_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['questionnaire_data']
-                        for questionnaire_data in questionnaire_list:
-                            questionnaire_directory = \
-                                questionnaire_data['directory_step']
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_Questionnaire
-                            if not path.exists(questionnaire_directory):
-                                error_msg, questionnaire_directory = \
-                                    create_directory(
-                                        participant_directory,
-                                        questionnaire_data['directory_step_name']
-                                    )
-                                if error_msg != '':
-                                    return error_msg
-
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_Questionnaire
-                            export_questionnaire_directory = \
-                                questionnaire_data['export_directory_step']
-                            filename_questionnaire = \
-                                questionnaire_data['questionnaire_filename']
-                            complete_filename_questionnaire = path.join(
-                                questionnaire_directory, filename_questionnaire
-                            )
+                questionnaire_responses = \
+                    self.per_group_data[group_id][
+                        'questionnaire_data'
+                    ][questionnaire_data['questionnaire_code']]
 
-                            questionnaire_description_fields = \
-                                questionnaire_data['questionnaire_response_list']
+                save_to_csv(
+                    complete_filename_questionnaire,
+                    [questionnaire_responses['header'],
+                     questionnaire_responses['response_list'][
+                         questionnaire_data['response_index']
+                     ]]
+                )
 
-                            save_to_csv(
-                                complete_filename_questionnaire,
-                                questionnaire_description_fields
-                            )
+                files_to_zip_list.append(
+                    [complete_filename_questionnaire,
+                     export_questionnaire_directory]
+                )
 
-                            self.files_to_zip_list.append(
-                                [complete_filename_questionnaire,
-                                 export_questionnaire_directory]
-                            )
+        if 'eeg_data_list' in self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            eeg_data_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['eeg_data_list']
+            for eeg_data in eeg_data_list:
+                eeg_directory = eeg_data['directory_step']
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG
+                if not path.exists(eeg_directory):
+                    error_msg, eeg_directory = create_directory(
+                        participant_directory,
+                        eeg_data['directory_step_name']
+                    )
+                    if error_msg != "":
+                        return error_msg, files_to_zip_list
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG
+                export_eeg_directory = eeg_data['export_directory_step']
+
+                # to create EEGData directory
+                directory_data_name = \
+                    eeg_data['eeg_data_directory_name']
+                path_per_eeg_data = path.join(
+                    eeg_directory, directory_data_name
+                )
+                if not path.exists(path_per_eeg_data):
+                    # NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EEGData_index
+                    error_msg, path_per_eeg_data = create_directory(
+                        eeg_directory, directory_data_name
+                    )
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+                # ex. /NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EEGData_index
+                export_eeg_data_directory = path.join(
+                    export_eeg_directory, directory_data_name
+                )
 
-                    if 'eeg_data_list' in self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        eeg_data_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['eeg_data_list']
-                        for eeg_data in eeg_data_list:
-                            eeg_directory = eeg_data['directory_step']
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG
-                            if not path.exists(eeg_directory):
-                                error_msg, eeg_directory = create_directory(
-                                    participant_directory,
-                                    eeg_data['directory_step_name']
-                                )
-                                if error_msg != "":
-                                    return error_msg
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG
-                            export_eeg_directory = eeg_data['export_directory_step']
-
-                            # to create EEGData directory
-                            directory_data_name = \
-                                eeg_data['eeg_data_directory_name']
-                            path_per_eeg_data = path.join(
-                                eeg_directory, directory_data_name
-                            )
-                            if not path.exists(path_per_eeg_data):
-                                # NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EEGData_index
-                                error_msg, path_per_eeg_data = create_directory(
-                                    eeg_directory, directory_data_name
-                                )
-                                if error_msg != '':
-                                    return error_msg
-                            # ex. /NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EEGData_index
-                            export_eeg_data_directory = path.join(
-                                export_eeg_directory, directory_data_name
-                            )
+                eeg_data = get_object_or_404(
+                    EEGData, pk=eeg_data['data_id']
+                )
 
-                            eeg_data = get_object_or_404(
-                                EEGData, pk=eeg_data['data_id']
-                            )
+                for file in eeg_data.files.all():
 
-                            for file in eeg_data.files.all():
+                    # download eeg raw data file
+                    eeg_data_filename = \
+                        file.file.name.split('/')[-1]
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG/EEGData_index/eeg.raw
+                    complete_eeg_data_filename = path.join(
+                        path_per_eeg_data, eeg_data_filename
+                    )
+                    eeg_raw_data_file = path.join(
+                        settings.MEDIA_ROOT, file.file.name
+                    )
 
-                                # download eeg raw data file
-                                eeg_data_filename = \
-                                    file.file.name.split('/')[-1]
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG/EEGData_index/eeg.raw
-                                complete_eeg_data_filename = path.join(
-                                    path_per_eeg_data, eeg_data_filename
-                                )
-                                eeg_raw_data_file = path.join(
-                                    path.join(settings.BASE_DIR, "media/"),
-                                    file.file.name
-                                )
+                    place_file(eeg_raw_data_file, complete_eeg_data_filename)
 
-                                with open(eeg_raw_data_file, 'rb') as f:
-                                    data = f.read()
+                    files_to_zip_list.append(
+                        [complete_eeg_data_filename,
+                         export_eeg_data_directory]
+                    )
 
-                                with open(complete_eeg_data_filename, 'wb') as f:
-                                    f.write(data)
+                    # create eeg_setting_description
+                    eeg_setting_description = \
+                        get_eeg_setting_description(eeg_data.eeg_setting_id)
+                    if eeg_setting_description:
+                        eeg_setting_filename = \
+                            '%s_%s.json' % \
+                            (eeg_data_filename.split(".")[0],
+                             "setting_description")
+
+                        # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG/eeg_rawfilename_setting_description.json
+                        complete_setting_filename = path.join(
+                            path_per_eeg_data, eeg_setting_filename
+                        )
 
-                                self.files_to_zip_list.append(
-                                    [complete_eeg_data_filename,
-                                     export_eeg_data_directory]
-                                )
+                        files_to_zip_list.append(
+                            [complete_setting_filename,
+                             export_eeg_data_directory]
+                        )
 
-                                # create eeg_setting_description
-                                eeg_setting_description = \
-                                    get_eeg_setting_description(eeg_data.eeg_setting_id)
-                                if eeg_setting_description:
-                                    eeg_setting_filename = \
-                                        '%s_%s.json' % \
-                                        (eeg_data_filename.split(".")[0],
-                                         "setting_description")
-
-                                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EEG/eeg_rawfilename_setting_description.json
-                                    complete_setting_filename = path.join(
-                                        path_per_eeg_data, eeg_setting_filename
-                                    )
-
-                                    self.files_to_zip_list.append(
-                                        [complete_setting_filename,
-                                         export_eeg_data_directory]
-                                    )
-
-                                    with open(
-                                            complete_setting_filename.encode('utf-8'),
-                                            'w', newline='', encoding='UTF-8'
-                                    ) as outfile:
-                                        json.dump(
-                                            eeg_setting_description, outfile,
-                                            indent=4
-                                        )
-
-                            # if sensor position image exist
-                            if hasattr(
-                                    eeg_data.eeg_setting,
-                                    'eeg_electrode_localization_system'
-                            ):
-                                eeg_electrode_localization_system = \
-                                    eeg_data.eeg_setting.eeg_electrode_localization_system
-                                if hasattr(
-                                        eeg_electrode_localization_system,
-                                        'map_image_file'
-                                ):
-                                    sensor_position_filename = \
-                                        '%s.png' % 'sensor_position'
-                                    map_filename = \
-                                        eeg_electrode_localization_system.map_image_file.name
-                                    sensors_positions_image = \
-                                        settings.BASE_DIR + \
-                                        settings.MEDIA_URL + map_filename
-
-                                    complete_sensor_position_filename = path.join(
-                                        path_per_eeg_data,
-                                        sensor_position_filename
-                                    )
-
-                                    with open(sensors_positions_image, 'rb') as f:
-                                        data = f.read()
-
-                                    with open(complete_sensor_position_filename, 'wb') as f:
-                                        f.write(data)
-
-                                    self.files_to_zip_list.append(
-                                        [complete_sensor_position_filename,
-                                         export_eeg_data_directory]
-                                    )
-
-                    if 'emg_data_list' in self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        emg_data_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['emg_data_list']
-                        for emg_data in emg_data_list:
-                            emg_directory = emg_data['directory_step']
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG
-                            if not path.exists(emg_directory):
-                                error_msg, emg_directory = create_directory(
-                                    participant_directory,
-                                    emg_data['directory_step_name']
-                                )
-                                if error_msg != '':
-                                    return error_msg
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG
-                            export_emg_directory = \
-                                emg_data['export_directory_step']
-
-                            # to create EMGData directory
-                            directory_data_name = \
-                                emg_data['emg_data_directory_name']
-                            path_per_emg_data = path.join(
-                                emg_directory, directory_data_name
-                            )
-                            if not path.exists(path_per_emg_data):
-                                # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EMGData_index
-                                error_msg, path_per_emg_data = create_directory(
-                                    emg_directory, directory_data_name
-                                )
-                                if error_msg != '':
-                                    return error_msg
-                            # ex. /NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EMGData_index
-                            export_emg_data_directory = path.join(
-                                export_emg_directory, directory_data_name
+                        with open(
+                                complete_setting_filename.encode('utf-8'),
+                                'w', newline='', encoding='UTF-8'
+                        ) as outfile:
+                            json.dump(
+                                eeg_setting_description, outfile,
+                                indent=4
                             )
 
-                            emg_data = get_object_or_404(
-                                EMGData, pk=emg_data['data_id']
-                            )
+                # if sensor position image exist
+                if hasattr(
+                        eeg_data.eeg_setting,
+                        'eeg_electrode_localization_system'
+                ):
+                    eeg_electrode_localization_system = \
+                        eeg_data.eeg_setting.eeg_electrode_localization_system
+                    if hasattr(
+                            eeg_electrode_localization_system,
+                            'map_image_file'
+                    ):
+                        sensor_position_filename = \
+                            '%s.png' % 'sensor_position'
+                        map_filename = \
+                            eeg_electrode_localization_system.map_image_file.name
+                        sensors_positions_image = path.join(
+                            settings.MEDIA_ROOT, map_filename
+                        )
 
-                            for file in emg_data.files.all():
+                        complete_sensor_position_filename = path.join(
+                            path_per_eeg_data,
+                            sensor_position_filename
+                        )
 
-                                # download emg raw data file
-                                emg_data_filename = file.file.name.split('/')[-1]
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG/EMGData_index/emg.raw
-                                complete_emg_data_filename = path.join(
-                                    path_per_emg_data, emg_data_filename
-                                )
-                                emg_raw_data_file = path.join(
-                                    settings.BASE_DIR, 'media', file.file.name
-                                )
+                        place_file(
+                            sensors_positions_image,
+                            complete_sensor_position_filename
+                        )
 
-                                with open(emg_raw_data_file, 'rb') as f:
-                                    data = f.read()
+                        files_to_zip_list.append(
+                            [complete_sensor_position_filename,
+                             export_eeg_data_directory]
+                        )
 
-                                with open(complete_emg_data_filename, 'wb') as f:
-                                    f.write(data)
+        if 'emg_data_list' in self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            emg_data_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['emg_data_list']
+            for emg_data in emg_data_list:
+                emg_directory = emg_data['directory_step']
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG
+                if not path.exists(emg_directory):
+                    error_msg, emg_directory = create_directory(
+                        participant_directory,
+                        emg_data['directory_step_name']
+                    )
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG
+                export_emg_directory = \
+                    emg_data['export_directory_step']
+
+                # to create EMGData directory
+                directory_data_name = \
+                    emg_data['emg_data_directory_name']
+                path_per_emg_data = path.join(
+                    emg_directory, directory_data_name
+                )
+                if not path.exists(path_per_emg_data):
+                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EMGData_index
+                    error_msg, path_per_emg_data = create_directory(
+                        emg_directory, directory_data_name
+                    )
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+                # ex. /NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/EMGData_index
+                export_emg_data_directory = path.join(
+                    export_emg_directory, directory_data_name
+                )
 
-                                self.files_to_zip_list.append(
-                                    [complete_emg_data_filename,
-                                     export_emg_data_directory]
-                                )
+                emg_data = get_object_or_404(
+                    EMGData, pk=emg_data['data_id']
+                )
 
-                                # download emg_setting_description
-                                emg_setting_description = \
-                                    get_emg_setting_description(emg_data.emg_setting_id)
-                                if emg_setting_description:
-                                    emg_setting_filename = \
-                                        '%s_%s.json' % \
-                                        (emg_data_filename.split(".")[0],
-                                         "setting_description")
-
-                                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG
-                                    # /EMGData_index/emg_rawfilename_setting_description.json
-                                    complete_setting_filename = path.join(
-                                        path_per_emg_data, emg_setting_filename
-                                    )
-
-                                    self.files_to_zip_list.append(
-                                        [complete_setting_filename,
-                                         export_emg_data_directory]
-                                    )
-
-                                    with open(
-                                            complete_setting_filename.encode('utf-8'),
-                                            'w', newline='', encoding='UTF-8'
-                                    ) as outfile:
-                                        json.dump(
-                                            emg_setting_description, outfile,
-                                            indent=4
-                                        )
-
-                    if 'tms_data' in \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        tms_data_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['tms_data']
-                        for tms_data in tms_data_list:
-                            tms_directory = tms_data['directory_step']
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS
-                            if not path.exists(tms_directory):
-                                error_msg, tms_directory = create_directory(
-                                    participant_directory,
-                                    tms_data['directory_step_name']
-                                )
-                                if error_msg != '':
-                                    return error_msg
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS
-                            export_tms_directory = \
-                                tms_data['export_directory_step']
-
-                            tms_data_description = get_tms_data_description(
-                                tms_data['data_id']
-                            )
-                            if tms_data_description:
-                                tms_data_filename = \
-                                    '%s.json' % 'tms_data_description'
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS/tms_data_description.json
-                                complete_data_filename = path.join(
-                                    tms_directory, tms_data_filename
-                                )
+                for file in emg_data.files.all():
 
-                                self.files_to_zip_list.append(
-                                    [complete_data_filename,
-                                     export_tms_directory]
-                                )
+                    # download emg raw data file
+                    emg_data_filename = file.file.name.split('/')[-1]
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG/EMGData_index/emg.raw
+                    complete_emg_data_filename = path.join(
+                        path_per_emg_data, emg_data_filename
+                    )
+                    emg_raw_data_file = path.join(
+                        settings.MEDIA_ROOT, file.file.name
+                    )
 
-                                with open(
-                                        complete_data_filename.encode('utf-8'),
-                                        'w', newline='', encoding='UTF-8'
-                                ) as outfile:
-                                    json.dump(
-                                        tms_data_description, outfile,
-                                        indent=4
-                                    )
-
-                            # TMS hotspot position image file
-                            tms_data = get_object_or_404(
-                                TMSData, pk=tms_data['data_id']
-                            )
+                    place_file(emg_raw_data_file, complete_emg_data_filename)
 
-                            if tms_data.localization_system_image:
-                                hotspot_image = tms_data.hot_spot_map.name
-                                if hotspot_image:
-                                    hotspot_map_filename = \
-                                        hotspot_image.split("/")[-1]
-                                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS/hotspot_image.png
-                                    complete_hotspot_filename = path.join(
-                                        tms_directory, hotspot_map_filename
-                                    )
-                                    path_hot_spot_image = path.join(
-                                        settings.BASE_DIR, "media"
-                                    ) + "/" + hotspot_image
-                                    with open(path_hot_spot_image, 'rb') as f:
-                                        data = f.read()
-
-                                    with open(complete_hotspot_filename, 'wb') as f:
-                                        f.write(data)
-
-                                    self.files_to_zip_list.append(
-                                        [complete_hotspot_filename,
-                                         export_tms_directory]
-                                    )
-
-                    if 'additional_data_list' in \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        additional_data_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['additional_data_list']
-                        for additional_data in additional_data_list:
-                            additional_data_directory = \
-                                additional_data['directory_step']
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
-                            if not path.exists(additional_data_directory):
-                                error_msg, additional_data_directory = \
-                                    create_directory(
-                                    participant_directory,
-                                        additional_data['directory_step_name']
-                                    )
-                                if error_msg != '':
-                                    return error_msg
-                            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
-                            export_data_directory = \
-                                additional_data['export_directory_step']
-
-                            # to create AdditionalData directory
-                            directory_data_name = \
-                                additional_data['additional_data_directory_name']
-                            path_per_additional_data = path.join(
-                                additional_data_directory, directory_data_name
-                            )
-                            if not path.exists(path_per_additional_data):
-                                # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/AdditionalData_index
-                                error_msg, path_per_additional_data = \
-                                    create_directory(
-                                        additional_data_directory,
-                                        directory_data_name
-                                    )
-                                if error_msg != '':
-                                    return error_msg
-                            # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/AdditionalData_index
-                            export_additional_data_directory = path.join(
-                                export_data_directory, directory_data_name
-                            )
+                    files_to_zip_list.append(
+                        [complete_emg_data_filename,
+                         export_emg_data_directory]
+                    )
 
-                            data_file = get_object_or_404(
-                                AdditionalData, pk=additional_data['data_id']
-                            )
+                    # download emg_setting_description
+                    emg_setting_description = \
+                        get_emg_setting_description(emg_data.emg_setting_id)
+                    if emg_setting_description:
+                        emg_setting_filename = \
+                            '%s_%s.json' % \
+                            (emg_data_filename.split(".")[0],
+                             "setting_description")
+
+                        # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_EMG
+                        # /EMGData_index/emg_rawfilename_setting_description.json
+                        complete_setting_filename = path.join(
+                            path_per_emg_data, emg_setting_filename
+                        )
 
-                            for file in data_file.files.all():
-                                file_name = file.file.name.split('/')[-1]
-                                # read file from repository
-                                additional_data_filename = path.join(
-                                    settings.BASE_DIR, 'media'
-                                ) + '/' + file.file.name
+                        files_to_zip_list.append(
+                            [complete_setting_filename,
+                             export_emg_data_directory]
+                        )
 
-                                # ex. NES_EXPORT/Experiment_data/Group_XXX/Participants/PXXXX/Step_XX_step_TYPE/file_name.format_type
-                                complete_additional_data_filename = path.join(
-                                    path_per_additional_data, file_name
-                                )
-                                with open(additional_data_filename, 'rb') as f:
-                                    data = f.read()
+                        with open(
+                                complete_setting_filename.encode('utf-8'),
+                                'w', newline='', encoding='UTF-8'
+                        ) as outfile:
+                            json.dump(
+                                emg_setting_description, outfile,
+                                indent=4
+                            )
 
-                                with open(
-                                        complete_additional_data_filename, 'wb'
-                                ) as f:
-                                    f.write(data)
+        if 'tms_data' in \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            tms_data_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['tms_data']
+            for tms_data in tms_data_list:
+                tms_directory = tms_data['directory_step']
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS
+                if not path.exists(tms_directory):
+                    error_msg, tms_directory = create_directory(
+                        participant_directory,
+                        tms_data['directory_step_name']
+                    )
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS
+                export_tms_directory = \
+                    tms_data['export_directory_step']
 
-                                self.files_to_zip_list.append(
-                                    [complete_additional_data_filename,
-                                     export_additional_data_directory]
-                                )
+                tms_data_description = get_tms_data_description(
+                    tms_data['data_id']
+                )
+                if tms_data_description:
+                    tms_data_filename = \
+                        '%s.json' % 'tms_data_description'
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS/tms_data_description.json
+                    complete_data_filename = path.join(
+                        tms_directory, tms_data_filename
+                    )
 
-                    if 'goalkeeper_data_list' in \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        goalkeeper_data_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['goalkeeper_data_list']
-
-                        for goalkeeper_data in goalkeeper_data_list:
-                            goalkeeper_game_directory = \
-                                goalkeeper_data['directory_step_name']
-                            if not path.exists(goalkeeper_game_directory):
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
-                                error_msg, goalkeeper_step_directory = \
-                                    create_directory(
-                                        participant_directory,
-                                        goalkeeper_data['directory_step_name']
-                                    )
-                                if error_msg != '':
-                                    return error_msg
-
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
-                                export_data_directory = \
-                                    goalkeeper_data['export_directory_step']
-
-                                # to create GoalkeeperData directory
-                                directory_data_name = \
-                                    goalkeeper_data['goalkeeper_data_directory_name']
-                                path_per_goalkeeper_data = path.join(
-                                    goalkeeper_step_directory,
-                                    directory_data_name
-                                )
-                                if not path.exists(path_per_goalkeeper_data):
-                                    # NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GoalkeeperData_index
-                                    error_msg, path_per_goalkeeper_data = \
-                                        create_directory(
-                                            goalkeeper_step_directory,
-                                            directory_data_name
-                                        )
-                                    if error_msg != '':
-                                        return error_msg
-                                # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GoalkeeperData_index
-                                export_goalkeeper_data_directory = path.join(
-                                    export_data_directory, directory_data_name
-                                )
-                                # GoalkeeperGameData query
-                                data_file = get_object_or_404(
-                                    GoalkeeperGameData,
-                                    pk=goalkeeper_data['data_id']
-                                )
+                    files_to_zip_list.append(
+                        [complete_data_filename,
+                         export_tms_directory]
+                    )
 
-                                for context_tree_file in data_file.files.all():
-                                    file_name = \
-                                        context_tree_file.file.name.split('/')[-1]
-                                    # read file from repository
-                                    context_tree_filename = path.join(
-                                        settings.BASE_DIR, 'media'
-                                    ) + '/' + context_tree_file.file.name
-
-                                    # ex. /NES_EXPORT/Experiment_data/Group_XXX/Participants/PXXXX/
-                                    # Step_XX_step_TYPE/GoalkeeperData_index/file_name.format_type
-                                    complete_context_tree_filename = path.join(
-                                        path_per_goalkeeper_data, file_name
-                                    )
-                                    with open(context_tree_filename, 'rb') as f:
-                                        data = f.read()
-
-                                    with open(
-                                            complete_context_tree_filename, 'wb'
-                                    ) as f:
-                                        f.write(data)
-
-                                    self.files_to_zip_list.append(
-                                        [complete_context_tree_filename,
-                                         export_goalkeeper_data_directory]
-                                    )
-
-                    if 'generic_data_list' in \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]:
-                        generic_data_list = \
-                            self.per_group_data[group_id]['data_per_participant'][participant_code]['generic_data_list']
-
-                        for generic_data in generic_data_list:
-                            generic_data_directory = \
-                                generic_data['directory_step_name']
-                            if not path.exists(generic_data_directory):
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
-                                error_msg, generic_step_directory = \
-                                    create_directory(
-                                        participant_directory,
-                                        generic_data['directory_step_name']
-                                    )
-                                if error_msg != '':
-                                    return error_msg
-
-                                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
-                                export_data_directory = \
-                                    generic_data['export_directory_step']
-
-                                # to create GoalkeeperData directory
-                                directory_data_name = \
-                                    generic_data['generic_data_directory_name']
-                                path_per_generic_data = path.join(
-                                    generic_step_directory, directory_data_name
-                                )
-                                if not path.exists(path_per_generic_data):
-                                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GenericData_index
-                                    error_msg, path_per_generic_data = \
-                                        create_directory(
-                                            generic_step_directory,
-                                            directory_data_name
-                                        )
-                                    if error_msg != "":
-                                        return error_msg
-                                # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GenericData_index
-                                export_generic_data_directory = path.join(
-                                    export_data_directory, directory_data_name
-                                )
-                                # GenericData query
-                                data_file = get_object_or_404(
-                                    GenericDataCollectionData,
-                                    pk=generic_data['data_id']
-                                )
+                    with open(
+                            complete_data_filename.encode('utf-8'),
+                            'w', newline='', encoding='UTF-8'
+                    ) as outfile:
+                        json.dump(
+                            tms_data_description, outfile,
+                            indent=4
+                        )
 
-                                for generic_file in data_file.files.all():
-                                    generic_file_name = \
-                                        generic_file.file.name.split('/')[-1]
-                                    # read file from repository
-                                    path_generic_file = path.join(
-                                        settings.BASE_DIR, 'media'
-                                    ) + '/' + generic_file.file.name
-
-                                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Participants/PXXXX/
-                                    # Step_XX_step_TYPE/GenericData_index/file_name.format_type
-                                    complete_generic_filename = path.join(
-                                        path_per_generic_data,
-                                        generic_file_name
-                                    )
-                                    with open(path_generic_file, 'rb') as f:
-                                        data = f.read()
-
-                                    with open(complete_generic_filename, 'wb') as f:
-                                        f.write(data)
-
-                                    self.files_to_zip_list.append(
-                                        [complete_generic_filename,
-                                         export_generic_data_directory]
-                                    )
+                # TMS hotspot position image file
+                tms_data = get_object_or_404(
+                    TMSData, pk=tms_data['data_id']
+                )
 
-        return error_msg
+                if tms_data.localization_system_image:
+                    hotspot_image = tms_data.hot_spot_map.name
+                    if hotspot_image:
+                        hotspot_map_filename = \
+                            hotspot_image.split("/")[-1]
+                        # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_TMS/hotspot_image.png
+                        complete_hotspot_filename = path.join(
+                            tms_directory, hotspot_map_filename
+                        )
+                        path_hot_spot_image = path.join(
+                            settings.MEDIA_ROOT, hotspot_image
+                        )
+                        place_file(path_hot_spot_image, complete_hotspot_filename)
 
-    def download_data_per_questionnaire(self):
-        error_msg = ''
-        per_questionnaire_data = self.input_data['per_questionnaire_directory']
-        per_questionnaire_metadata = \
-            self.input_data['questionnaire_metadata_directory']
-        for group_id in self.per_group_data:
-            # ex. EXPERIMENT_DOWNLOAD/Group_group.title
-            group_directory = \
-                self.per_group_data[group_id]['group']['directory']
-            # ex. EXPERIMENT_DOWNLOAD/Group_group.title/
-            export_directory_group = \
-                self.per_group_data[group_id]['group']['export_directory']
-            if 'questionnaire_data' in self.per_group_data[group_id]:
-                questionnaire_list = \
-                    self.per_group_data[group_id]['questionnaire_data']
-                # create 'Per_questionnaire' directory
-                error_msg, group_questionnaire_directory = create_directory(
-                    group_directory, per_questionnaire_data
-                )
-                if error_msg != '':
-                    return error_msg
-                export_group_questionnaire_directory = path.join(
-                    export_directory_group, per_questionnaire_data
-                )
+                        files_to_zip_list.append(
+                            [complete_hotspot_filename,
+                             export_tms_directory]
+                        )
 
-                # create 'questionnaire_metadata' directory
-                questionnaire_metadata_directory = path.join(
-                    group_directory, per_questionnaire_metadata
+        if 'additional_data_list' in \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            additional_data_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['additional_data_list']
+            for additional_data in additional_data_list:
+                additional_data_directory = \
+                    additional_data['directory_step']
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
+                if not path.exists(additional_data_directory):
+                    error_msg, additional_data_directory = \
+                        create_directory(
+                        participant_directory,
+                            additional_data['directory_step_name']
+                        )
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+                # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
+                export_data_directory = \
+                    additional_data['export_directory_step']
+
+                # to create AdditionalData directory
+                directory_data_name = \
+                    additional_data['additional_data_directory_name']
+                path_per_additional_data = path.join(
+                    additional_data_directory, directory_data_name
                 )
-                if not path.exists(questionnaire_metadata_directory):
-                    error_msg, questionnaire_metadata_directory = \
+                if not path.exists(path_per_additional_data):
+                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/AdditionalData_index
+                    error_msg, path_per_additional_data = \
                         create_directory(
-                            group_directory, per_questionnaire_metadata
+                            additional_data_directory,
+                            directory_data_name
                         )
                     if error_msg != '':
-                        return error_msg
-                # questionnaire metadata directory export
-                export_questionnaire_metadata_directory = path.join(
-                    export_directory_group,
-                    per_questionnaire_metadata
+                        return error_msg, files_to_zip_list
+                # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/AdditionalData_index
+                export_additional_data_directory = path.join(
+                    export_data_directory, directory_data_name
+                )
+
+                data_file = get_object_or_404(
+                    AdditionalData, pk=additional_data['data_id']
                 )
 
-                for questionnaire_code in questionnaire_list:
-                    questionnaire_description_fields = \
-                        questionnaire_list[questionnaire_code]['response_list']
-                    questionnaire_description_fields.insert(
-                        0, questionnaire_list[questionnaire_code]['header']
+                for file in data_file.files.all():
+                    file_name = file.file.name.split('/')[-1]
+                    # read file from repository
+                    additional_data_filename = path.join(
+                        settings.MEDIA_ROOT, file.file.name
                     )
-                    questionnaire_title = \
-                        questionnaire_list[questionnaire_code]['questionnaire_title']
-                    # create questionnaire_title directory
-                    error_msg, questionnaire_directory = create_directory(
-                        group_questionnaire_directory,
-                        questionnaire_title
+
+                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Participants/PXXXX/Step_XX_step_TYPE/file_name.format_type
+                    complete_additional_data_filename = path.join(
+                        path_per_additional_data, file_name
                     )
-                    if error_msg != '':
-                        return error_msg
-                    export_questionnaire_directory = path.join(
-                        export_group_questionnaire_directory,
-                        questionnaire_title
+                    place_file(additional_data_filename, complete_additional_data_filename)
+
+                    files_to_zip_list.append(
+                        [complete_additional_data_filename,
+                         export_additional_data_directory]
                     )
 
-                    # create directory metadata by each questionnaire
-                    error_msg, questionnaire_metadata_directory_name = \
+        if 'goalkeeper_data_list' in \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            goalkeeper_data_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['goalkeeper_data_list']
+
+            for goalkeeper_data in goalkeeper_data_list:
+                goalkeeper_game_directory = \
+                    goalkeeper_data['directory_step_name']
+                if not path.exists(goalkeeper_game_directory):
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
+                    error_msg, goalkeeper_step_directory = \
                         create_directory(
-                            questionnaire_metadata_directory,
-                            questionnaire_title
+                            participant_directory,
+                            goalkeeper_data['directory_step_name']
                         )
                     if error_msg != '':
-                        return error_msg
-                    export_questionnaire_metadata_directory_name = path.join(
-                        export_questionnaire_metadata_directory,
-                        questionnaire_title
+                        return error_msg, files_to_zip_list
+
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
+                    export_data_directory = \
+                        goalkeeper_data['export_directory_step']
+
+                    # to create GoalkeeperData directory
+                    directory_data_name = \
+                        goalkeeper_data['goalkeeper_data_directory_name']
+                    path_per_goalkeeper_data = path.join(
+                        goalkeeper_step_directory,
+                        directory_data_name
+                    )
+                    if not path.exists(path_per_goalkeeper_data):
+                        # NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GoalkeeperData_index
+                        error_msg, path_per_goalkeeper_data = \
+                            create_directory(
+                                goalkeeper_step_directory,
+                                directory_data_name
+                            )
+                        if error_msg != '':
+                            return error_msg, files_to_zip_list
+                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GoalkeeperData_index
+                    export_goalkeeper_data_directory = path.join(
+                        export_data_directory, directory_data_name
+                    )
+                    # GoalkeeperGameData query
+                    data_file = get_object_or_404(
+                        GoalkeeperGameData,
+                        pk=goalkeeper_data['data_id']
                     )
 
-                    # fill questionnaires responses
-                    questionnaire_filename = \
-                        questionnaire_list[questionnaire_code]['questionnaire_filename']
-                    complete_filename_questionnaire = path.join(
-                        questionnaire_directory, questionnaire_filename
+                    for context_tree_file in data_file.files.all():
+                        file_name = \
+                            context_tree_file.file.name.split('/')[-1]
+                        # read file from repository
+                        context_tree_filename = path.join(
+                            settings.MEDIA_ROOT,
+                            context_tree_file.file.name
+                        )
+
+                        # ex. /NES_EXPORT/Experiment_data/Group_XXX/Participants/PXXXX/
+                        # Step_XX_step_TYPE/GoalkeeperData_index/file_name.format_type
+                        complete_context_tree_filename = path.join(
+                            path_per_goalkeeper_data, file_name
+                        )
+                        place_file(context_tree_filename, complete_context_tree_filename)
+
+                        files_to_zip_list.append(
+                            [complete_context_tree_filename,
+                             export_goalkeeper_data_directory]
+                        )
+
+        if 'generic_data_list' in \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]:
+            generic_data_list = \
+                self.per_group_data[group_id]['data_per_participant'][participant_code]['generic_data_list']
+
+            for generic_data in generic_data_list:
+                generic_data_directory = \
+                    generic_data['directory_step_name']
+                if not path.exists(generic_data_directory):
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
+                    error_msg, generic_step_directory = \
+                        create_directory(
+                            participant_directory,
+                            generic_data['directory_step_name']
+                        )
+                    if error_msg != '':
+                        return error_msg, files_to_zip_list
+
+                    # ex. EXPERIMENT_DOWNLOAD/Group_group.title/Participants/PXXXX/Step_XX_step_TYPE
+                    export_data_directory = \
+                        generic_data['export_directory_step']
+
+                    # to create GoalkeeperData directory
+                    directory_data_name = \
+                        generic_data['generic_data_directory_name']
+                    path_per_generic_data = path.join(
+                        generic_step_directory, directory_data_name
+                    )
+                    if not path.exists(path_per_generic_data):
+                        # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GenericData_index
+                        error_msg, path_per_generic_data = \
+                            create_directory(
+                                generic_step_directory,
+                                directory_data_name
+                            )
+                        if error_msg != "":
+                            return error_msg, files_to_zip_list
+                    # ex. NES_EXPORT/Experiment_data/Group_XXX/Per_participant/Participant_123/Step_X_aaa/GenericData_index
+                    export_generic_data_directory = path.join(
+                        export_data_directory, directory_data_name
+                    )
+                    # GenericData query
+                    data_file = get_object_or_404(
+                        GenericDataCollectionData,
+                        pk=generic_data['data_id']
                     )
 
-                    save_to_csv(
-                        complete_filename_questionnaire,
-                        questionnaire_description_fields
+                    for generic_file in data_file.files.all():
+                        generic_file_name = \
+                            generic_file.file.name.split('/')[-1]
+                        # read file from repository
+                        path_generic_file = path.join(
+                            settings.MEDIA_ROOT, generic_file.file.name
+                        )
+
+                        # ex. NES_EXPORT/Experiment_data/Group_XXX/Participants/PXXXX/
+                        # Step_XX_step_TYPE/GenericData_index/file_name.format_type
+                        complete_generic_filename = path.join(
+                            path_per_generic_data,
+                            generic_file_name
+                        )
+                        place_file(path_generic_file, complete_generic_filename)
+
+                        files_to_zip_list.append(
+                            [complete_generic_filename,
+                             export_generic_data_directory]
+                        )
+
+        return error_msg, files_to_zip_list
+
+    def download_group_data_per_questionnaire(self, group_id):
+        """Create the per questionnaire files and questionnaire metadata of
+        a group. Doesn't change the export state, so groups can be processed
+        at the same time.
+        :param group_id: group id
+        :return: error message ("" if none), list of [filename, directory]
+        of the files created, to be included in compressed file
+        """
+        error_msg = ''
+        per_questionnaire_data = self.input_data['per_questionnaire_directory']
+        per_questionnaire_metadata = \
+            self.input_data['questionnaire_metadata_directory']
+        files_to_zip_list = []
+        # ex. EXPERIMENT_DOWNLOAD/Group_group.title
+        group_directory = \
+            self.per_group_data[group_id]['group']['directory']
+        # ex. EXPERIMENT_DOWNLOAD/Group_group.title/
+        export_directory_group = \
+            self.per_group_data[group_id]['group']['export_directory']
+        if 'questionnaire_data' in self.per_group_data[group_id]:
+            questionnaire_list = \
+                self.per_group_data[group_id]['questionnaire_data']
+            # create 'Per_questionnaire' directory
+            error_msg, group_questionnaire_directory = create_directory(
+                group_directory, per_questionnaire_data
+            )
+            if error_msg != '':
+                return error_msg, files_to_zip_list
+            export_group_questionnaire_directory = path.join(
+                export_directory_group, per_questionnaire_data
+            )
+
+            # create 'questionnaire_metadata' directory
+            questionnaire_metadata_directory = path.join(
+                group_directory, per_questionnaire_metadata
+            )
+            if not path.exists(questionnaire_metadata_directory):
+                error_msg, questionnaire_metadata_directory = \
+                    create_directory(
+                        group_directory, per_questionnaire_metadata
                     )
+                if error_msg != '':
+                    return error_msg, files_to_zip_list
+            # questionnaire metadata directory export
+            export_questionnaire_metadata_directory = path.join(
+                export_directory_group,
+                per_questionnaire_metadata
+            )
 
-                    self.files_to_zip_list.append(
-                        [complete_filename_questionnaire,
-                         export_questionnaire_directory]
+            for questionnaire_code in questionnaire_list:
+                questionnaire_description_fields = chain(
+                    [questionnaire_list[questionnaire_code]['header']],
+                    questionnaire_list[questionnaire_code]['response_list']
+                )
+                questionnaire_title = \
+                    questionnaire_list[questionnaire_code]['questionnaire_title']
+                # create questionnaire_title directory
+                error_msg, questionnaire_directory = create_directory(
+                    group_questionnaire_directory,
+                    questionnaire_title
+                )
+                if error_msg != '':
+                    return error_msg, files_to_zip_list
+                export_questionnaire_directory = path.join(
+                    export_group_questionnaire_directory,
+                    questionnaire_title
+                )
+
+                # create directory metadata by each questionnaire
+                error_msg, questionnaire_metadata_directory_name = \
+                    create_directory(
+                        questionnaire_metadata_directory,
+                        questionnaire_title
                     )
+                if error_msg != '':
+                    return error_msg, files_to_zip_list
+                export_questionnaire_metadata_directory_name = path.join(
+                    export_questionnaire_metadata_directory,
+                    questionnaire_title
+                )
 
-                    # to build questionnaire metadata directory
-                    if 'questionnaire_metadata' in self.per_group_data[group_id]:
-                        questionnaire_metadata_list = \
-                            self.per_group_data[group_id]['questionnaire_metadata'][questionnaire_code]
-
-                        for questionnaire_language in questionnaire_metadata_list:
-                            questionnaire_metadata_fields = \
-                                questionnaire_metadata_list[questionnaire_language]['metadata_fields']
-                            filename_questionnaire_metadata = \
-                                questionnaire_metadata_list[questionnaire_language]['filename']
-                            complete_filename_questionnaire_metadata = \
-                                path.join(
-                                    questionnaire_metadata_directory_name,
-                                    filename_questionnaire_metadata
-                                )
+                # fill questionnaires responses
+                questionnaire_filename = \
+                    questionnaire_list[questionnaire_code]['questionnaire_filename']
+                complete_filename_questionnaire = path.join(
+                    questionnaire_directory, questionnaire_filename
+                )
 
-                            with open(
-                                    complete_filename_questionnaire_metadata, 'w'
-                            ) as f:
-                                f.write(questionnaire_metadata_fields)
+                save_to_csv(
+                    complete_filename_questionnaire,
+                    questionnaire_description_fields
+                )
 
-                            self.files_to_zip_list.append(
-                                [complete_filename_questionnaire_metadata,
-                                 export_questionnaire_metadata_directory_name]
+                files_to_zip_list.append(
+                    [complete_filename_questionnaire,
+                     export_questionnaire_directory]
+                )
+
+                # to build questionnaire metadata directory
+                if 'questionnaire_metadata' in self.per_group_data[group_id]:
+                    questionnaire_metadata_list = \
+                        self.per_group_data[group_id]['questionnaire_metadata'][questionnaire_code]
+
+                    for questionnaire_language in questionnaire_metadata_list:
+                        questionnaire_metadata_fields = \
+                            questionnaire_metadata_list[questionnaire_language]['metadata_fields']
+                        filename_questionnaire_metadata = \
+                            questionnaire_metadata_list[questionnaire_language]['filename']
+                        complete_filename_questionnaire_metadata = \
+                            path.join(
+                                questionnaire_metadata_directory_name,
+                                filename_questionnaire_metadata
                             )
 
-        return error_msg
+                        with open(
+                                complete_filename_questionnaire_metadata, 'w'
+                        ) as f:
+                            f.write(questionnaire_metadata_fields)
+
+                        files_to_zip_list.append(
+                            [complete_filename_questionnaire_metadata,
+                             export_questionnaire_metadata_directory_name]
+                        )
+
+        return error_msg, files_to_zip_list
 
 
 def get_eeg_setting_description(eeg_setting_id):
@@ -0,0 +1,272 @@
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+
+from downloads import views
+from downloads.export import ExportExecution
+from experiments.models import Experiment, Gender, File, Step, TMSData
+from experiments.fixtures import create_owner, \
+    create_experiment, create_study, create_genders, create_group, \
+    create_participant, create_experimental_protocol, create_step, \
+    create_eeg_setting, create_eeg_step, create_eeg_data, \
+    create_emg_setting, create_emg_step, create_emg_data, \
+    create_tms_setting, create_tms_data, \
+    create_questionnaire, create_questionnaire_language, \
+    create_questionnaire_responses
+
+# download_create steps timed separately
+EXPORT_STAGES = [
+    'include_data_from_group', 'process_experiment_data',
+    'download_data_per_group'
+]
+
+
+@contextmanager
+def measure(results, name, memory=False):
+    """Record in results[name] the elapsed time, the number of queries and,
+    if memory is True, the peak of memory allocated (bytes) by the code run
+    in the context.
+    """
+    queries = len(connection.queries_log)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        results[name] = {
+            'seconds': time.perf_counter() - start,
+            'queries': len(connection.queries_log) - queries
+        }
+        if memory:
+            results[name]['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def list_of(objects):
+    # fixtures functions return a single object when creating one
+    return objects if isinstance(objects, list) else [objects]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the build of download files of a synthetic experiment ' \
+           'and the download and experiment detail views. Runs in a test ' \
+           'database and a temporary MEDIA_ROOT, and outputs the results ' \
+           'in JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=2)
+        parser.add_argument(
+            '--participants', type=int, default=10,
+            help='Number of participants per group'
+        )
+        parser.add_argument(
+            '--eeg', type=int, default=1,
+            help='Number of EEG data per participant'
+        )
+        parser.add_argument(
+            '--emg', type=int, default=1,
+            help='Number of EMG data per participant'
+        )
+        parser.add_argument(
+            '--tms', type=int, default=1,
+            help='Number of TMS data per participant'
+        )
+        parser.add_argument(
+            '--questionnaire-responses', type=int, default=1,
+            help='Number of questionnaire responses per participant'
+        )
+        parser.add_argument(
+            '--file-size', type=int, default=1024 * 1024,
+            help='Size in bytes of each EEG/EMG raw data file'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Threads building the download files. Queries made by '
+                 'worker threads are not counted.'
+        )
+        parser.add_argument(
+            '--output', help='JSON file for the results (default: stdout)'
+        )
+
+    def create_raw_file(self, size):
+        filename = os.path.join(
+            'uploads', 'benchmark', '%d.raw' % File.objects.count()
+        )
+        complete_filename = os.path.join(settings.MEDIA_ROOT, filename)
+        os.makedirs(os.path.dirname(complete_filename), exist_ok=True)
+        with open(complete_filename, 'wb') as f:
+            for i in range(0, size, 1024 * 1024):
+                f.write(os.urandom(min(1024 * 1024, size - i)))
+
+        return File.objects.create(file=filename)
+
+    def populate(self, options):
+        experiment = create_experiment(
+            1, create_owner('benchmark'), Experiment.APPROVED
+        )
+        create_study(1, experiment)
+        create_genders()
+        gender = Gender.objects.first()
+        eeg_setting = create_eeg_setting(1, experiment)
+        emg_setting = create_emg_setting(experiment)
+        tms_setting = create_tms_setting(1, experiment)
+
+        for group in list_of(create_group(options['groups'], experiment)):
+            create_experimental_protocol(group)
+            eeg_step = create_eeg_step(group, eeg_setting)
+            emg_step = create_emg_step(group, emg_setting)
+            tms_step = create_step(1, group, Step.TMS)
+            questionnaire = create_questionnaire(1, 'Q5489', group)
+            create_questionnaire_language(
+                questionnaire,
+                settings.BASE_DIR + '/experiments/tests/questionnaire7.csv',
+                'en'
+            )
+            for participant in list_of(
+                    create_participant(options['participants'], group, gender)
+            ):
+                for i in range(options['eeg']):
+                    create_eeg_data(
+                        eeg_setting, eeg_step, participant
+                    ).files.add(self.create_raw_file(options['file_size']))
+                for i in range(options['emg']):
+                    create_emg_data(
+                        emg_setting, emg_step, participant
+                    ).files.add(self.create_raw_file(options['file_size']))
+                if options['tms']:
+                    create_tms_data(options['tms'], tms_setting, participant)
+                    TMSData.objects.filter(participant=participant).update(
+                        step=tms_step
+                    )
+                for i in range(options['questionnaire_responses']):
+                    create_questionnaire_responses(
+                        questionnaire, participant,
+                        settings.BASE_DIR +
+                        '/experiments/tests/response_questionnaire7.json'
+                    )
+
+        return experiment
+
+    def benchmark_download_create(self, experiment, results):
+        stages = {}
+
+        def timed(name, function):
+            def wrapper(*args, **kwargs):
+                with measure(stages, name):
+                    return function(*args, **kwargs)
+            return wrapper
+
+        patches = [patch.object(
+            views, 'build_complete_export_structure',
+            timed('build_complete_export_structure',
+                  views.build_complete_export_structure)
+        )] + [
+            patch.object(ExportExecution, name, timed(
+                name, getattr(ExportExecution, name)
+            )) for name in EXPORT_STAGES
+        ]
+        for stage_patch in patches:
+            stage_patch.start()
+        try:
+            with measure(results, 'download_create', memory=True):
+                error_msg = views.download_create(experiment.id, '')
+        finally:
+            for stage_patch in patches:
+                stage_patch.stop()
+        results['download_create']['stages'] = stages
+        results['download_create']['error'] = error_msg
+
+    def benchmark_views(self, experiment, results):
+        client = Client()
+
+        with measure(results, 'experiment_detail', memory=True):
+            client.get(
+                reverse('experiment-detail', kwargs={'slug': experiment.slug})
+            )
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        with measure(results, 'download_view_get', memory=True):
+            client.get(url)
+
+        selected = []
+        for group in experiment.groups.all():
+            selected += [
+                'experimental_protocol_g%d' % group.id,
+                'questionnaires_g%d' % group.id
+            ] + [
+                'participant_p%d_g%d' % (participant.id, group.id)
+                for participant in group.participants.all()
+            ]
+        # second time the compressed file is in cache
+        for name in ['download_view_post', 'download_view_post_cached']:
+            with measure(results, name, memory=True):
+                response = client.post(url, {'download_selected': selected})
+                if response.streaming:
+                    for chunk in response.streaming_content:
+                        pass
+
+    def handle(self, *args, **options):
+        scale = {
+            key: options[key] for key in [
+                'groups', 'participants', 'eeg', 'emg', 'tms',
+                'questionnaire_responses', 'file_size', 'workers'
+            ]
+        }
+        results = {'date': datetime.utcnow().isoformat(), 'scale': scale}
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        media_root = tempfile.mkdtemp()
+        # count all queries, not only the last 9000 logged by default, and
+        # keep the log between the requests made by the test client
+        connection.force_debug_cursor = True
+        connection.queries_log = deque()
+        request_started.disconnect(reset_queries)
+        try:
+            with override_settings(
+                    MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*'],
+                    EXPORT_WORKERS=options['workers']
+            ):
+                os.makedirs(os.path.join(media_root, 'download'))
+                with open(os.path.join(
+                        media_root, 'download', 'LICENSE.txt'
+                ), 'w') as f:
+                    f.write('license')
+
+                with measure(results, 'populate'):
+                    experiment = self.populate(options)
+                self.benchmark_download_create(experiment, results)
+                self.benchmark_views(experiment, results)
+        finally:
+            request_started.connect(reset_queries)
+            connection.force_debug_cursor = False
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(media_root)
+
+        # kilobytes in Linux, bytes in macOS
+        results['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=4)
+            self.stdout.write(self.style.SUCCESS(
+                'Results saved in %s' % options['output']
+            ))
+        else:
+            self.stdout.write(json.dumps(results, indent=4))
@@ -1,4 +1,7 @@
 from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from experiments.models import Experiment
 
 
 def get_export_dir(instance, filename):
@@ -8,6 +11,17 @@ def get_export_dir(instance, filename):
 
 
 class Export(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_OPTIONS = (
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
     date = models.DateTimeField(null=False, auto_now_add=True)
     input_file = models.FileField(
         upload_to=get_export_dir, null=False, max_length=1000
@@ -15,7 +29,22 @@ class Export(models.Model):
     output_export = models.FileField(
         upload_to=get_export_dir, null=False, max_length=1000
     )
+    experiment = models.ForeignKey(
+        Experiment, null=True, blank=True, related_name='exports'
+    )
+    status = models.CharField(
+        max_length=10, choices=STATUS_OPTIONS, default=QUEUED
+    )
+    # percent done
+    progress = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    updated = models.DateTimeField(auto_now=True)
 
     def delete(self, *args, **kwargs):
         self.content.delete()
         super(Export, self).delete(*args, **kwargs)
+
+    def set_progress(self, progress, status=RUNNING):
+        self.progress = progress
+        self.status = status
+        self.save(update_fields=['progress', 'status', 'updated'])
@@ -0,0 +1,35 @@
+import json
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+
+class BenchmarkExportCommandTest(TestCase):
+
+    # the command runs in the test database
+    @patch('downloads.management.commands.benchmark_export.teardown_databases')
+    @patch('downloads.management.commands.benchmark_export.setup_databases')
+    def test_benchmark_export_outputs_results_in_json(self, *mocks):
+        out = StringIO()
+        call_command(
+            'benchmark_export', groups=1, participants=2, file_size=1024,
+            stdout=out
+        )
+
+        results = json.loads(out.getvalue())
+        self.assertEqual(1, results['scale']['groups'])
+        self.assertEqual(2, results['scale']['participants'])
+        self.assertEqual('', results['download_create']['error'])
+        self.assertEqual(
+            ['build_complete_export_structure', 'download_data_per_group',
+             'include_data_from_group', 'process_experiment_data'],
+            sorted(results['download_create']['stages'])
+        )
+        for name in ['populate', 'download_create', 'experiment_detail',
+                     'download_view_get', 'download_view_post',
+                     'download_view_post_cached']:
+            self.assertGreaterEqual(results[name]['seconds'], 0)
+            self.assertGreater(results[name]['queries'], 0, name)
+        self.assertIn('max_rss', results)
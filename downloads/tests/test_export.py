@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from downloads.export import copy_file, place_file, ExportExecution, \
+    ZipFileWriter
+from experiments.models import Experiment, Gender
+from experiments.tests.tests_helper import create_experiment, create_group, \
+    create_participant, create_genders, create_questionnaire, \
+    create_questionnaire_language, create_questionnaire_responses, \
+    create_eeg_setting, create_eeg_step, create_eeg_data
+
+
+class PlaceFileTest(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, 'eeg.raw')
+        with open(self.source, 'wb') as file:
+            file.write(os.urandom(3 * 1024 * 1024 + 7))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read(self, filename):
+        with open(filename, 'rb') as file:
+            return file.read()
+
+    def test_place_file_hard_links_file_in_same_filesystem(self):
+        destination = os.path.join(self.temp_dir, 'export_eeg.raw')
+        place_file(self.source, destination)
+
+        self.assertTrue(os.path.samefile(self.source, destination))
+
+    def test_place_file_does_not_overwrite_file_linked_to_destination(self):
+        destination = os.path.join(self.temp_dir, 'export_eeg.raw')
+        place_file(self.source, destination)
+        content = self.read(self.source)
+
+        other_source = os.path.join(self.temp_dir, 'other_eeg.raw')
+        with open(other_source, 'wb') as file:
+            file.write(b'other data')
+        place_file(other_source, destination)
+
+        self.assertEqual(content, self.read(self.source))
+        self.assertEqual(b'other data', self.read(destination))
+
+    def test_place_file_copies_file_when_it_cannot_be_linked(self):
+        destination = os.path.join(self.temp_dir, 'export_eeg.raw')
+        with patch('downloads.export.os.link', side_effect=OSError):
+            place_file(self.source, destination)
+
+        self.assertFalse(os.path.samefile(self.source, destination))
+        self.assertEqual(self.read(self.source), self.read(destination))
+
+    def test_copy_file_without_sendfile_copies_file_in_chunks(self):
+        destination = os.path.join(self.temp_dir, 'export_eeg.raw')
+        with patch('downloads.export.os.sendfile', side_effect=OSError):
+            copy_file(self.source, destination)
+
+        self.assertEqual(self.read(self.source), self.read(destination))
+
+
+class ZipFileWriterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.zip_filename = os.path.join(self.temp_dir, 'download.zip')
+        self.source = os.path.join(self.temp_dir, 'Experiment.csv')
+        with open(self.source, 'w') as file:
+            file.write('title,description')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_zip_file_writer_writes_files_put(self):
+        zip_writer = ZipFileWriter(self.zip_filename)
+        zip_writer.start()
+        zip_writer.put([[self.source, 'EXPERIMENT_DOWNLOAD']])
+        zip_writer.close()
+
+        with zipfile.ZipFile(self.zip_filename) as zip_file:
+            self.assertEqual(
+                ['EXPERIMENT_DOWNLOAD/Experiment.csv'], zip_file.namelist()
+            )
+
+    def test_zip_file_writer_without_files_does_not_create_zip_file(self):
+        zip_writer = ZipFileWriter(self.zip_filename)
+        zip_writer.start()
+        zip_writer.close()
+
+        self.assertFalse(os.path.exists(self.zip_filename))
+
+    def test_zip_file_writer_stops_on_any_error(self):
+        zip_writer = ZipFileWriter(self.zip_filename, queue_size=1)
+        zip_writer.start()
+        with patch('downloads.export.ZipFile.write', side_effect=ValueError):
+            # more files than the queue size don't block
+            zip_writer.put([[self.source, 'EXPERIMENT_DOWNLOAD']] * 3)
+            with self.assertRaises(ValueError):
+                zip_writer.close()
+
+        self.assertFalse(zip_writer.is_alive())
+        self.assertFalse(os.path.exists(self.zip_filename))
+
+
+class IncludeDataFromGroupTest(TestCase):
+
+    def setUp(self):
+        create_genders()
+        owner = User.objects.create_user(username='lab1', password='nep-lab1')
+        self.experiment = create_experiment(1, owner, Experiment.APPROVED)
+        self.eeg_setting = create_eeg_setting(1, self.experiment)
+
+    def create_group_data(self, participants_qtty):
+        group = create_group(1, self.experiment)
+        eeg_step = create_eeg_step(group, self.eeg_setting)
+        questionnaire = create_questionnaire(1, 'Q5489', group)
+        create_questionnaire_language(
+            questionnaire,
+            settings.BASE_DIR + '/experiments/tests/questionnaire7.csv',
+            'en'
+        )
+        # participant codes are sequential, so they don't repeat in group
+        participants = create_participant(
+            participants_qtty, group, Gender.objects.get(name='male')
+        )
+        for participant in participants:
+            create_questionnaire_responses(
+                questionnaire, participant,
+                settings.BASE_DIR +
+                '/experiments/tests/response_questionnaire7.json'
+            )
+            create_eeg_data(self.eeg_setting, eeg_step, participant)
+
+        return group
+
+    def include_data_from_group(self):
+        export = ExportExecution(self.experiment.id)
+        export.input_data = {
+            'base_directory': 'NES_EXPORT',
+            'participant_data_directory': 'Participant_data'
+        }
+        with CaptureQueriesContext(connection) as context:
+            export.include_data_from_group(self.experiment.id)
+
+        return export, len(context.captured_queries)
+
+    def test_include_data_from_group_runs_same_number_of_queries_for_any_data_size(self):
+        self.create_group_data(2)
+        export, queries_small = self.include_data_from_group()
+
+        for i in range(2):
+            self.create_group_data(5)
+        export, queries_large = self.include_data_from_group()
+
+        self.assertEqual(queries_small, queries_large)
+        for group_data in export.per_group_data.values():
+            self.assertEqual(
+                len(group_data['participant_list']),
+                len(group_data['data_per_participant'])
+            )
+            for participant_data in group_data['data_per_participant'].values():
+                self.assertEqual(1, len(participant_data['eeg_data_list']))
+                self.assertEqual(
+                    1, len(participant_data['questionnaire_data'])
+                )
+
+
+class SortMetadataTest(SimpleTestCase):
+
+    def test_sort_metadata_sorts_rows_by_question_order_keeping_ties_order(self):
+        metadata = \
+            'questionnaire_code,questionnaire_title,question_group,' \
+            'question_order,question_code\n' \
+            '957421,Title,Group 1,2,q3\n' \
+            '957421,Title,Group 1,1,q1\n' \
+            '957421,"Title, with comma",Group 2,2,q4\n' \
+            '957421,Title,Group 1,1,q2\n'
+
+        self.assertEqual(
+            'questionnaire_code, questionnaire_title, question_group,'
+            'question_order,question_code\n'
+            '957421, Title, Group 1,1,q1\n'
+            '957421, Title, Group 1,1,q2\n'
+            '957421, Title, Group 1,2,q3\n'
+            '957421, "Title,  with comma",Group 2,2,q4\n',
+            ExportExecution._sort_metadata(metadata)
+        )
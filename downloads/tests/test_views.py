@@ -1,27 +1,38 @@
+import glob
 import io
+import json
 import os
 import random
 import re
 import tempfile
+import threading
 
 import shutil
 import zipfile
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import override_settings, TestCase
+from django.db import connection
+from django.test import override_settings, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.encoding import smart_str
 from django.utils.text import slugify
 
-from downloads.views import download_create
+from downloads.export import ExportExecution
+from downloads.models import Export
+from downloads.views import download_create, get_partial_download_filename
 from experiments.models import Experiment, Gender, Questionnaire, \
-    QuestionnaireLanguage, Step, Group
+    QuestionnaireLanguage, Step, Group, Participant, QuestionnaireResponse
 from experiments.tests.tests_helper import create_experiment, create_study, \
     create_participant, create_group, create_questionnaire, \
     create_questionnaire_language, create_questionnaire_responses, \
     create_researcher, create_experiment_researcher, create_genders, \
-    create_experimental_protocol, create_step, remove_selected_subdir
+    create_experimental_protocol, create_step, remove_selected_subdir, \
+    create_trustee_user, create_next_version_experiment, PASSWORD, \
+    create_eeg_setting, create_eeg_electrode_localization_system, \
+    create_eeg_step, create_eeg_data
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 
@@ -527,7 +538,7 @@ class DownloadCreateViewTest(TestCase):
         )
 
         # get the zipped file to test against its content
-        file = io.BytesIO(response.content)
+        file = io.BytesIO(b''.join(response.streaming_content))
         zipped_file = zipfile.ZipFile(file, 'r')
         self.assertIsNone(zipped_file.testzip())
 
@@ -627,3 +638,691 @@ class DownloadCreateViewTest(TestCase):
             response,
             reverse('experiment-detail', kwargs={'slug': experiment.slug})
         )
+
+    def test_POSTing_same_option_twice_streams_each_file_once(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        download_create(experiment.id, '')
+
+        selected = 'participant_p' + str(p1.id) + '_g' + str(g1.id)
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        response = self.client.post(
+            url, {'download_selected': [selected, selected]}
+        )
+
+        self.assertTrue(response.streaming)
+        file = io.BytesIO(b''.join(response.streaming_content))
+        zipped_file = zipfile.ZipFile(file, 'r')
+        self.assertIsNone(zipped_file.testzip())
+        self.assertEqual(
+            len(zipped_file.namelist()), len(set(zipped_file.namelist()))
+        )
+        self.assertTrue(
+            any('Group_' + slugify(g1.title) + '/Per_participant_data/' +
+                'Participant_' + str(p1.code) in element
+                for element in zipped_file.namelist()),
+            str(zipped_file.namelist())
+        )
+
+    def test_POSTing_same_options_again_serves_cached_compressed_file(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        download_create(experiment.id, '')
+
+        selected = [
+            'participant_p' + str(p1.id) + '_g' + str(g1.id),
+            'questionnaires_g' + str(g1.id)
+        ]
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        response = self.client.post(url, {'download_selected': selected})
+        content = b''.join(response.streaming_content)
+
+        cached_file = get_partial_download_filename(
+            experiment, reversed(selected)
+        )
+        self.assertTrue(os.path.exists(cached_file))
+
+        # selected items in other order get the same cached file
+        response = self.client.post(
+            url, {'download_selected': list(reversed(selected))}
+        )
+        self.assertFalse(response.streaming)
+        self.assertEqual(content, response.content)
+        self.assertEquals(
+            response.get('Content-Disposition'),
+            'attachment; filename=%s' % smart_str('download.zip')
+        )
+        experiment = Experiment.objects.get(pk=experiment.id)
+        self.assertEqual(experiment.downloads, 2)
+
+    def test_download_create_writes_questionnaire_responses_csv_files(self):
+        # files as written before responses shared the questionnaire header
+        header = '"participant_code","age_(years)","gender",' \
+                 '"acquisitiondate","opcTabela1ombro","opcTabela2cotovel"\r\n'
+        rows = {
+            'P1': '"P1",20.0000,"male","2018-03-07 00:00:00","A1",'
+                  '"say ""yes"", twice"\r\n',
+            'P2': '"P2",31.5000,"male","2018-03-08 00:00:00","",'
+                  '"a\u00e7\u00e3o"\r\n',
+            # participant without age has no age column
+            'P3': '"P3","male","2018-03-09 00:00:00","A2","N/A"\r\n',
+        }
+        experiment = self.create_basic_experiment_data()
+        group = Group.objects.create(
+            title='Group A', description='Group A', experiment=experiment
+        )
+        questionnaire = create_questionnaire(1, 'Q5489', group)
+        questionnaire.numeration = '1'
+        questionnaire.save()
+        create_questionnaire_language(
+            questionnaire,
+            settings.BASE_DIR + '/experiments/tests/questionnaire7.csv', 'en'
+        )
+        for code, age, answers in [
+            ('P1', 20, ['2018-03-07 00:00:00', 'A1', 'say "yes", twice']),
+            ('P2', 31.5, ['2018-03-08 00:00:00', '', 'a\u00e7\u00e3o']),
+            ('P3', None, ['2018-03-09 00:00:00', 'A2', 'N/A']),
+        ]:
+            participant = Participant.objects.create(
+                group=group, code=code, age=age,
+                gender=Gender.objects.get(name='male')
+            )
+            QuestionnaireResponse.objects.create(
+                step=questionnaire, participant=participant,
+                date='2018-03-07', limesurvey_response=json.dumps({
+                    'questions': ['acquisitiondate', 'opcTabela1ombro',
+                                  'opcTabela2cotovel'],
+                    'answers': answers
+                })
+            )
+
+        download_create(experiment.id, '')
+
+        group_dir = os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id), 'Group_group-a'
+        )
+        filename = os.path.join(
+            group_dir, 'Per_questionnaire_data',
+            'Q5489_narakas-and-waikakul', 'Responses_Q5489.csv'
+        )
+        with open(filename, 'rb') as file:
+            self.assertEqual(
+                (header + rows['P1'] + rows['P2'] + rows['P3']).encode(),
+                file.read()
+            )
+        for code, row in rows.items():
+            filename = os.path.join(
+                group_dir, 'Per_participant_data', 'Participant_' + code,
+                'STEP_1_QUESTIONNAIRE', 'Q5489_narakas-and-waikakul.csv'
+            )
+            with open(filename, 'rb') as file:
+                self.assertEqual((header + row).encode(), file.read())
+
+    def test_download_create_stops_zip_file_writer_when_export_fails(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        threads = threading.active_count()
+        with patch(
+                'downloads.views.ExportExecution.download_data_per_group',
+                side_effect=KeyError('group')
+        ):
+            error_msg = download_create(experiment.id, '')
+
+        export = Export.objects.get(experiment=experiment)
+        self.assertEqual(export.status, Export.FAILED)
+        self.assertEqual(export.error, error_msg)
+        self.assertEqual("'group'", error_msg)
+        self.assertEqual(threads, threading.active_count())
+        self.assertEqual([], glob.glob(os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id), '*.part'
+        )))
+
+    def test_download_does_not_invalidate_experiment_detail_cache(self):
+        experiment, group = self.create_download_subdirs()
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        with patch(
+                'experiments.models.invalidate_experiment_detail_cache'
+        ) as invalidate:
+            self.client.get(url)
+
+        invalidate.assert_not_called()
+        experiment.refresh_from_db()
+        self.assertEqual(1, experiment.downloads)
+
+    def test_download_create_again_does_not_serve_previous_cached_files(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        download_create(experiment.id, '')
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        selection = ['questionnaires_g' + str(g1.id)]
+        response = self.client.post(url, {'download_selected': selection})
+        b''.join(response.streaming_content)
+        cached_file = get_partial_download_filename(experiment, selection)
+
+        download_create(experiment.id, '')
+
+        self.assertFalse(os.path.exists(cached_file))
+        self.assertNotEqual(
+            cached_file, get_partial_download_filename(experiment, selection)
+        )
+        response = self.client.post(url, {'download_selected': selection})
+        self.assertTrue(response.streaming)
+
+    def test_partial_downloads_cache_evicts_least_recently_used_files(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        download_create(experiment.id, '')
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        first_selection = ['questionnaires_g' + str(g1.id)]
+        response = self.client.post(
+            url, {'download_selected': first_selection}
+        )
+        b''.join(response.streaming_content)
+        first_file = get_partial_download_filename(
+            experiment, first_selection
+        )
+        # make first cached file older than the next one
+        os.utime(first_file, (0, 0))
+
+        second_selection = [
+            'participant_p' + str(p1.id) + '_g' + str(g1.id)
+        ]
+        with self.settings(
+                PARTIAL_DOWNLOAD_CACHE_SIZE=os.path.getsize(first_file)
+        ):
+            response = self.client.post(
+                url, {'download_selected': second_selection}
+            )
+            b''.join(response.streaming_content)
+
+        self.assertFalse(os.path.exists(first_file))
+        self.assertTrue(os.path.exists(
+            get_partial_download_filename(experiment, second_selection)
+        ))
+
+    def test_partial_downloads_cache_keeps_file_larger_than_cache(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        download_create(experiment.id, '')
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        selection = ['questionnaires_g' + str(g1.id)]
+        with self.settings(PARTIAL_DOWNLOAD_CACHE_SIZE=1):
+            response = self.client.post(url, {'download_selected': selection})
+            b''.join(response.streaming_content)
+
+        self.assertTrue(os.path.exists(
+            get_partial_download_filename(experiment, selection)
+        ))
+
+    def test_partial_downloads_cache_evicts_files_when_download_is_aborted(
+            self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+
+        download_create(experiment.id, '')
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        first_selection = ['questionnaires_g' + str(g1.id)]
+        response = self.client.post(
+            url, {'download_selected': first_selection}
+        )
+        b''.join(response.streaming_content)
+        first_file = get_partial_download_filename(
+            experiment, first_selection
+        )
+
+        with self.settings(PARTIAL_DOWNLOAD_CACHE_SIZE=0):
+            response = self.client.post(url, {
+                'download_selected': [
+                    'participant_p' + str(p1.id) + '_g' + str(g1.id)
+                ]
+            })
+            # client aborts after the first chunk
+            next(iter(response.streaming_content))
+            response.close()
+
+        self.assertFalse(os.path.exists(first_file))
+
+    def test_POSTing_options_runs_same_number_of_queries_for_any_selection(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        participants = [
+            create_participant(1, g1, Gender.objects.get(name='male'))
+            for i in range(3)
+        ]
+        for participant in participants:
+            self.create_questionnaire_stuff(g1, participant)
+
+        download_create(experiment.id, '')
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        queries = []
+        for selected_participants in [participants[:1], participants]:
+            selected = [
+                'participant_p' + str(participant.id) + '_g' + str(g1.id)
+                for participant in selected_participants
+            ]
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(
+                    url, {'download_selected': selected}
+                )
+                b''.join(response.streaming_content)
+            queries.append(len(context.captured_queries))
+
+        self.assertEqual(queries[0], queries[1])
+
+    def test_POSTing_participant_from_other_experiment_redirects_to_experiment_detail_view(self):
+        experiment = self.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        self.create_questionnaire_stuff(g1, p1)
+        other_experiment = create_experiment(
+            1, experiment.owner, Experiment.APPROVED
+        )
+        other_group = create_group(1, other_experiment)
+        other_participant = create_participant(
+            1, other_group, Gender.objects.get(name='male')
+        )
+
+        download_create(experiment.id, '')
+
+        url = reverse('download-view', kwargs={'experiment_id': experiment.id})
+        response = self.client.post(url, {'download_selected': [
+            'participant_p' + str(other_participant.id) + '_g' + str(g1.id)
+        ]})
+
+        self.assertRedirects(
+            response,
+            reverse('experiment-detail', kwargs={'slug': experiment.slug})
+        )
+
+    def test_GETing_download_status_returns_last_build_status(self):
+        experiment = self.create_basic_experiment_data()
+        download_create(experiment.id, '')
+
+        url = reverse(
+            'download-status', kwargs={'experiment_id': experiment.id}
+        )
+        # experiment owner
+        self.client.login(username='lab1', password='nep-lab1')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Export.DONE)
+        self.assertEqual(response.data['progress'], 100)
+        self.client.logout()
+
+        # trustee
+        trustee = create_trustee_user()
+        self.client.login(username=trustee.username, password=PASSWORD)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.client.logout()
+
+    def test_GETing_download_status_without_permission_returns_403(self):
+        experiment = self.create_basic_experiment_data()
+        download_create(experiment.id, '')
+
+        url = reverse(
+            'download-status', kwargs={'experiment_id': experiment.id}
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        User.objects.create_user(username='lab2', password='nep-lab2')
+        self.client.login(username='lab2', password='nep-lab2')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_download_create_with_error_records_failed_build(self):
+        experiment = self.create_basic_experiment_data()
+        os.remove(os.path.join(TEMP_MEDIA_ROOT, 'download', 'LICENSE.txt'))
+
+        error_msg = download_create(experiment.id, '')
+
+        export = Export.objects.get(experiment=experiment)
+        self.assertEqual(export.status, Export.FAILED)
+        self.assertEqual(export.error, error_msg)
+        self.assertNotEqual(error_msg, '')
+        # no zip file left behind
+        self.assertFalse(any(
+            filename.startswith('download.zip') for filename in os.listdir(
+                os.path.join(TEMP_MEDIA_ROOT, 'download', str(experiment.id))
+            )
+        ))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, EXPORT_WORKERS=4)
+class DownloadCreateWorkersTest(TransactionTestCase):
+
+    def setUp(self):
+        create_genders()
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'download'))
+        license_file = os.path.join(TEMP_MEDIA_ROOT, 'download', 'LICENSE.txt')
+        with open(license_file, 'w') as file:
+            file.write('license')
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT)
+
+    def test_download_create_with_worker_threads_has_all_groups_data(self):
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        groups = [create_group(1, experiment) for i in range(3)]
+        for group in groups:
+            participant = create_participant(
+                1, group, Gender.objects.get(name='male')
+            )
+            DownloadCreateViewTest.create_questionnaire_stuff(
+                group, participant
+            )
+
+        download_create(experiment.id, '')
+
+        zip_file = os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id), 'download.zip'
+        )
+        zipped_file = zipfile.ZipFile(zip_file, 'r')
+        self.assertIsNone(zipped_file.testzip())
+        for group in groups:
+            for subdir in ['Per_participant_data', 'Per_questionnaire_data',
+                           'Questionnaire_metadata']:
+                self.assertTrue(
+                    any('Group_' + slugify(group.title) + '/' + subdir
+                        in element for element in zipped_file.namelist()),
+                    subdir + ' not in ' + str(zipped_file.namelist())
+                )
+
+
+    def test_download_create_with_worker_threads_has_all_participants_data(
+            self):
+        # the participants of a group are exported in different threads
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        group = create_group(1, experiment)
+        participants = create_participant(
+            3, group, Gender.objects.get(name='male')
+        )
+        questionnaire = DownloadCreateViewTest.create_questionnaire_stuff(
+            group, participants[0]
+        )
+        for participant in participants[1:]:
+            create_questionnaire_responses(
+                questionnaire, participant,
+                settings.BASE_DIR +
+                '/experiments/tests/response_questionnaire7.json'
+            )
+
+        download_create(experiment.id, '')
+
+        zipped_file = zipfile.ZipFile(os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id), 'download.zip'
+        ), 'r')
+        for participant in participants:
+            self.assertTrue(
+                any('Per_participant_data/Participant_' + participant.code
+                    in element for element in zipped_file.namelist()),
+                participant.code + ' not in ' + str(zipped_file.namelist())
+            )
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class DownloadCreateIncrementalTest(TestCase):
+
+    def setUp(self):
+        if not Gender.objects.all():
+            create_genders()
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'download'))
+        license_file = os.path.join(TEMP_MEDIA_ROOT, 'download', 'LICENSE.txt')
+        with open(license_file, 'w') as file:
+            file.write('license')
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT)
+
+    @staticmethod
+    def per_questionnaire_files(experiment, group):
+        per_questionnaire_dir = os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id),
+            'Group_' + slugify(group.title), 'Per_questionnaire_data'
+        )
+        return [
+            os.path.join(root, name)
+            for root, dirs, files in os.walk(per_questionnaire_dir)
+            for name in files
+        ]
+
+    def test_download_create_again_keeps_files_of_unchanged_groups(self):
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        DownloadCreateViewTest.create_questionnaire_stuff(g1, p1)
+        g2 = create_group(1, experiment)
+        p2 = create_participant(1, g2, Gender.objects.get(name='male'))
+        DownloadCreateViewTest.create_questionnaire_stuff(g2, p2)
+
+        download_create(experiment.id, '')
+
+        # mark files with content of the same size, to tell if they were
+        # created again
+        for group in [g1, g2]:
+            for filename in self.per_questionnaire_files(experiment, group):
+                size = os.path.getsize(filename)
+                with open(filename, 'wb') as file:
+                    file.write(b'x' * size)
+
+        # change group 2 data only
+        p3 = create_participant(1, g2, Gender.objects.get(name='female'))
+        create_questionnaire_responses(
+            Questionnaire.objects.get(group=g2), p3,
+            settings.BASE_DIR +
+            '/experiments/tests/response_questionnaire7.json'
+        )
+
+        download_create(experiment.id, '')
+
+        for filename in self.per_questionnaire_files(experiment, g1):
+            with open(filename, 'rb') as file:
+                self.assertEqual(set(file.read()), {ord('x')})
+        for filename in self.per_questionnaire_files(experiment, g2):
+            with open(filename, 'rb') as file:
+                self.assertNotEqual(set(file.read()), {ord('x')})
+
+        # kept files go to the compressed file too
+        zipped_file = zipfile.ZipFile(os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id), 'download.zip'
+        ), 'r')
+        self.assertTrue(
+            any('Group_' + slugify(g1.title) + '/Per_questionnaire_data'
+                in element for element in zipped_file.namelist()),
+            str(zipped_file.namelist())
+        )
+
+    @staticmethod
+    def copy_group(group, experiment):
+        """Create in experiment a group with the same data of group, as sent
+        to a new version of the experiment
+        """
+        new_group = Group.objects.create(
+            title=group.title, description=group.description,
+            experiment=experiment
+        )
+        questionnaire = Questionnaire.objects.get(group=group)
+        new_questionnaire = \
+            DownloadCreateViewTest.create_questionnaire_stuff(
+                new_group, create_participant(
+                    1, new_group, Gender.objects.get(name='male')
+                )
+            )
+        new_questionnaire.order = questionnaire.order
+        new_questionnaire.numeration = questionnaire.numeration
+        new_questionnaire.save()
+        for new_participant, participant in zip(
+                new_group.participants.all(), group.participants.all()
+        ):
+            new_participant.code = participant.code
+            new_participant.age = participant.age
+            new_participant.save()
+
+        return new_group
+
+    def test_download_create_of_new_version_keeps_files_of_unchanged_groups(self):
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        group = create_group(1, experiment)
+        participant = create_participant(
+            1, group, Gender.objects.get(name='male')
+        )
+        DownloadCreateViewTest.create_questionnaire_stuff(group, participant)
+        download_create(experiment.id, '')
+        for filename in self.per_questionnaire_files(experiment, group):
+            size = os.path.getsize(filename)
+            with open(filename, 'wb') as file:
+                file.write(b'x' * size)
+
+        new_experiment = create_next_version_experiment(experiment)
+        create_study(1, new_experiment)
+        new_group = self.copy_group(group, new_experiment)
+        download_create(new_experiment.id, '')
+
+        new_files = self.per_questionnaire_files(new_experiment, new_group)
+        self.assertEqual(
+            len(self.per_questionnaire_files(experiment, group)),
+            len(new_files)
+        )
+        for filename in new_files:
+            with open(filename, 'rb') as file:
+                self.assertEqual(set(file.read()), {ord('x')})
+        # files are copied: exporting the new version again doesn't change
+        # the files of the previous one
+        for filename in new_files:
+            with open(filename, 'wb') as file:
+                file.write(b'y')
+        for filename in self.per_questionnaire_files(experiment, group):
+            with open(filename, 'rb') as file:
+                self.assertEqual(set(file.read()), {ord('x')})
+
+    def test_download_create_removes_files_of_removed_groups_and_participants(self):
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        g1 = create_group(1, experiment)
+        p1 = create_participant(1, g1, Gender.objects.get(name='male'))
+        questionnaire = DownloadCreateViewTest.create_questionnaire_stuff(
+            g1, p1
+        )
+        p2 = create_participant(1, g1, Gender.objects.get(name='female'))
+        create_questionnaire_responses(
+            questionnaire, p2,
+            settings.BASE_DIR +
+            '/experiments/tests/response_questionnaire7.json'
+        )
+        g2 = create_group(1, experiment)
+        p3 = create_participant(1, g2, Gender.objects.get(name='male'))
+        DownloadCreateViewTest.create_questionnaire_stuff(g2, p3)
+        download_create(experiment.id, '')
+        experiment_dir = os.path.join(
+            TEMP_MEDIA_ROOT, 'download', str(experiment.id)
+        )
+        group_dir = os.path.join(
+            experiment_dir, 'Group_' + slugify(g1.title)
+        )
+        p2_dir = os.path.join(
+            group_dir, 'Per_participant_data', 'Participant_' + str(p2.code)
+        )
+        g2_dir = os.path.join(
+            experiment_dir, 'Group_' + slugify(g2.title)
+        )
+        self.assertTrue(os.path.exists(p2_dir))
+        self.assertTrue(os.path.exists(g2_dir))
+
+        p2.delete()
+        g2.delete()
+        download_create(experiment.id, '')
+
+        self.assertFalse(os.path.exists(p2_dir))
+        self.assertFalse(os.path.exists(g2_dir))
+        self.assertTrue(os.path.exists(os.path.join(
+            group_dir, 'Per_participant_data', 'Participant_' + str(p1.code)
+        )))
+        self.assertTrue(
+            os.path.exists(os.path.join(experiment_dir, 'download.zip'))
+        )
+
+    @staticmethod
+    def create_eeg_group(experiment, eeg_setting):
+        group = create_group(1, experiment)
+        participant = create_participant(
+            1, group, Gender.objects.get(name='male')
+        )
+        create_eeg_data(
+            eeg_setting, create_eeg_step(group, eeg_setting), participant
+        )
+        return group
+
+    @staticmethod
+    def include_data_from_group(experiment):
+        export = ExportExecution(experiment.id)
+        export.input_data = {
+            'base_directory': 'NES_EXPORT',
+            'participant_data_directory': 'Participant_data'
+        }
+        export.include_data_from_group(experiment.id)
+        return export
+
+    def test_group_data_hash_changes_when_eeg_setting_description_changes(self):
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        eeg_setting = create_eeg_setting(1, experiment)
+        group = self.create_eeg_group(experiment, eeg_setting)
+        export = self.include_data_from_group(experiment)
+        function = export.download_group_data_per_participant
+        data_hash = export.get_group_data_hash(function, group.id)
+
+        eeg_setting.description = 'changed description'
+        eeg_setting.save()
+
+        self.assertNotEqual(
+            data_hash, export.get_group_data_hash(function, group.id)
+        )
+
+    def test_group_data_hash_changes_when_sensor_position_image_is_replaced(
+            self):
+        experiment = DownloadCreateViewTest.create_basic_experiment_data()
+        eeg_setting = create_eeg_setting(1, experiment)
+        localization_system = create_eeg_electrode_localization_system(
+            eeg_setting
+        )
+        localization_system.map_image_file = 'uploads/map.png'
+        localization_system.save()
+        image = os.path.join(TEMP_MEDIA_ROOT, 'uploads', 'map.png')
+        os.makedirs(os.path.dirname(image))
+        with open(image, 'wb') as file:
+            file.write(b'map')
+        group = self.create_eeg_group(experiment, eeg_setting)
+        export = self.include_data_from_group(experiment)
+        function = export.download_group_data_per_participant
+        data_hash = export.get_group_data_hash(function, group.id)
+
+        with open(image, 'wb') as file:
+            file.write(b'other map')
+
+        self.assertNotEqual(
+            data_hash, export.get_group_data_hash(function, group.id)
+        )
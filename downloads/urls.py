@@ -4,6 +4,8 @@ from . import views
 
 urlpatterns = [
     url(r'(?P<experiment_id>[0-9]+)/$', views.download_view,
-        name='download-view')
+        name='download-view'),
+    url(r'(?P<experiment_id>[0-9]+)/status/$', views.download_status,
+        name='download-status')
 ]
 
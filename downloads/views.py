@@ -1,26 +1,39 @@
+import glob
+import hashlib
+import json
+import logging
 import os
 import re
-import tempfile
-import shutil
+import uuid
 
+from collections import OrderedDict
 from os import path
 from shutil import rmtree
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
 
 import sys
 from django.urls import reverse
 from django.conf import settings
 from django.contrib import messages
+from django.db.models import F
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, \
+    StreamingHttpResponse
 from django.utils.encoding import smart_str
 from django.utils.text import slugify
 from django.utils.translation import ugettext as _
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
 
-from .export import create_directory, ExportExecution
+from .export import create_directory, ExportExecution, ZipFileWriter, \
+    EXPORT_MANIFEST_FILENAME
 from .input_export import build_complete_export_structure
 from .models import Export
-from experiments.models import Experiment, Group, Step, Participant
+from experiments.models import Experiment, Step, Participant
+from experiments.permissions import is_trustee
+
+logger = logging.getLogger(__name__)
 
 JSON_FILENAME = "json_export.json"
 JSON_EXPERIMENT_FILENAME = "json_experiment_export.json"
@@ -28,13 +41,19 @@ EXPORT_DIRECTORY = "temp"
 DOWNLOAD_DIRECTORY = "download"
 EXPORT_FILENAME = "download.zip"
 EXPORT_EXPERIMENT_FILENAME = "download_experiment.zip"
+PARTIAL_DOWNLOAD_DIRECTORY = "partial_downloads"
+# Options values in templates has group and/or participants id's as
+# substrings, so use regex to determine if they were selected.
+PATTERN_EXP_PROTOCOL = re.compile("experimental_protocol_g([0-9]+)$")
+PATTERN_QUESTIONNAIRES = re.compile("questionnaires_g([0-9]+)$")
+PATTERN_PARTICIPANT = re.compile("participant_p([0-9]+)_g([0-9]+)$")
 DOWNLOAD_ERROR_MESSAGE = _('There was a problem downloading your experiment '
                            'data')
 
 
 # Create your views here.
-def create_export_instance():
-    export_instance = Export()
+def create_export_instance(experiment_id=None):
+    export_instance = Export(experiment_id=experiment_id)
     export_instance.save()
 
     return export_instance
@@ -50,32 +69,14 @@ def download_view(request, experiment_id):
             settings.MEDIA_ROOT, 'download', str(experiment.id), 'download.zip'
         )
         try:
-            file = open(compressed_file, 'rb')
+            response = serve_compressed_file(compressed_file)
         except FileNotFoundError:
             messages.error(request, DOWNLOAD_ERROR_MESSAGE)
             return HttpResponseRedirect(
                 reverse('experiment-detail', kwargs={'slug': experiment.slug})
             )
 
-        # Workaround to test serving compressed file. We are using Apache
-        # module to serve file imediatally by Apache instead of streaming it
-        # through Django.
-        if 'test' in sys.argv or 'runserver' in sys.argv:
-            response = HttpResponse(file, content_type='application/zip')
-            response['Content-Length'] = path.getsize(compressed_file)
-        else:
-            response = HttpResponse(content_type='application/force-download')
-            response['X-Sendfile'] = smart_str(compressed_file)
-            response['Content-Length'] = path.getsize(compressed_file)
-            response['Set-Cookie'] = 'fileDownload=true; path=/'
-
-        response['Content-Disposition'] = \
-            'attachment; filename=%s' % smart_str('download.zip')
-
-        file.close()
-
-        experiment.downloads += 1
-        experiment.save()
+        _count_download(experiment)
 
         return response
 
@@ -88,43 +89,35 @@ def download_view(request, experiment_id):
         )
 
     ##
-    # Create compressed file with elements chosen by user
+    # Stream compressed file with elements chosen by user
     # ---------------------------------------------------
+    # The compressed file is assembled straight from the files already
+    # exported to settings.MEDIA_ROOT/download/<experiment.id>, so nothing is
+    # copied to a temporary location before being sent to the client.
     # TODO: if experiment has no groups return response with only
     # TODO: Experiments.csv
-    # Create temporary dir to aggregate subdirs/files for further
-    # incorporate in compacted file.
-    temp_dir = tempfile.mkdtemp()
-    # Experiment.csv always will be in compressed file
-    try:
-        shutil.copyfile(os.path.join(
-            settings.MEDIA_ROOT, 'download', str(experiment.id),
-            'Experiment.csv'
-        ), os.path.join(temp_dir, 'Experiment.csv')
-        )
-    except FileNotFoundError:
-        messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-        return HttpResponseRedirect(
-            reverse('experiment-detail', kwargs={'slug': experiment.slug})
-        )
+    experiment_dir = os.path.join(
+        settings.MEDIA_ROOT, DOWNLOAD_DIRECTORY, str(experiment.id)
+    )
+    selected_items = request.POST.getlist('download_selected')
 
-    # License.txt always will be in compressed file
+    # The same selection may have been requested before: serve the compressed
+    # file kept in cache just like the file with all experiment data.
+    cached_file = get_partial_download_filename(experiment, selected_items)
     try:
-        shutil.copyfile(os.path.join(
-            settings.MEDIA_ROOT, 'download', 'LICENSE.txt'
-        ), os.path.join(temp_dir, 'LICENSE.txt')
-        )
+        response = serve_compressed_file(cached_file)
     except FileNotFoundError:
-        messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-        return HttpResponseRedirect(
-            reverse('experiment-detail', kwargs={'slug': experiment.slug})
-        )
+        pass
+    else:
+        # touch file so it's the last to be evicted from cache
+        os.utime(cached_file)
+        _count_download(experiment)
+
+        return response
 
-    # CITATION.txt always will be in compressed file
     try:
-        shutil.copyfile(os.path.join(
-            settings.MEDIA_ROOT, 'download', str(experiment.id), 'CITATION.txt'
-        ), os.path.join(temp_dir, 'CITATION.txt')
+        zip_entries = _get_selected_zip_entries(
+            experiment, experiment_dir, selected_items
         )
     except FileNotFoundError:
         messages.error(request, DOWNLOAD_ERROR_MESSAGE)
@@ -132,121 +125,40 @@ def download_view(request, experiment_id):
             reverse('experiment-detail', kwargs={'slug': experiment.slug})
         )
 
-    # Copy experiment data from settings.MEDIA_ROOT/download/<experiment.id>,
-    # based on user selection, to a temp dir.
-    for item in request.POST.getlist('download_selected'):
-        # take the group title to copy subdirs/files to temp location
-        group_str = re.search("g[0-9]+", item)
-        group_id = int(group_str.group(0)[1:])
-        group = Group.objects.get(pk=group_id)
-        group_title_slugifyed = slugify(group.title)
-        # Options values in templates has group and/or participants id's as
-        # substrings, so use regex to determine if they were selected.
-        pattern_exp_protocol = re.compile("experimental_protocol_g[0-9]+$")
-        pattern_questionnaires = re.compile("questionnaires_g[0-9]+$")
-        pattern_participant = re.compile("participant_p[0-9]+_g[0-9]+$")
-        if pattern_exp_protocol.match(item):
-            # Add Experimental_protocol subdir for the specific group in temp
-            # dir
-            try:
-                shutil.copytree(os.path.join(
-                    settings.MEDIA_ROOT, 'download', str(experiment.id),
-                    'Group_' + group_title_slugifyed, 'Experimental_protocol'
-                ), os.path.join(temp_dir, 'Group_' + group_title_slugifyed,
-                                'Experimental_protocol')
-                )
-            except FileNotFoundError:
-                messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-                return HttpResponseRedirect(
-                    reverse('experiment-detail',
-                            kwargs={'slug': experiment.slug})
-                )
-        if pattern_questionnaires.match(item):
-            # Add Per_questionnaire_data subdir for the specific group in temp
-            # dir
-            try:
-                shutil.copytree(os.path.join(
-                    settings.MEDIA_ROOT, 'download', str(experiment.id),
-                    'Group_' + group_title_slugifyed, 'Per_questionnaire_data'
-                ), os.path.join(temp_dir, 'Group_' + group_title_slugifyed,
-                                'Per_questionnaire_data')
-                )
-            except FileNotFoundError:
-                messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-                return HttpResponseRedirect(
-                    reverse('experiment-detail',
-                            kwargs={'slug': experiment.slug})
-                )
-            # add Participants.csv file for the specific group in temp dir
-            try:
-                shutil.copyfile(os.path.join(
-                    settings.MEDIA_ROOT, 'download', str(experiment.id),
-                    'Group_' + group_title_slugifyed, 'Participants.csv'
-                ), os.path.join(temp_dir, 'Group_' + group_title_slugifyed,
-                                'Participants.csv')
-                )
-            except FileNotFoundError:
-                messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-                return HttpResponseRedirect(
-                    reverse('experiment-detail',
-                            kwargs={'slug': experiment.slug})
-                )
-        if pattern_participant.match(item):
-            # Add Per_participant_data subdir for the specific group in temp
-            # dir.
-            participant_str = re.search("p[0-9]+", item)
-            participant_id = int(participant_str.group(0)[1:])
-            participant = Participant.objects.get(pk=participant_id)
-            # If g1 == g2 in test_views, this subtree may already has been
-            # created.
-            # TODO: fix test. Probably chosing participants from
-            # TODO: diferent groups, as it's the case when selecting
-            # TODO: participants to download in UI.
-            try:
-                shutil.copytree(os.path.join(
-                    settings.MEDIA_ROOT, 'download', str(experiment.id),
-                    'Group_' + group_title_slugifyed, 'Per_participant_data',
-                    'Participant_' + participant.code
-                ), os.path.join(temp_dir, 'Group_' + group_title_slugifyed,
-                                'Per_participant_data', 'Participant_' +
-                                participant.code)
-                )
-            except FileNotFoundError:
-                messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-                return HttpResponseRedirect(
-                    reverse('experiment-detail',
-                            kwargs={'slug': experiment.slug})
-                )
-
-    # Put Questionnaire_metadata subdir in temp dir for all groups that have
-    # questionnaires.
-    for group in experiment.groups.all():
-        if group.steps.filter(type=Step.QUESTIONNAIRE).count() > 0:
-            group_title_slugifyed = slugify(group.title)
-            try:
-                shutil.copytree(os.path.join(
-                    settings.MEDIA_ROOT, 'download', str(experiment.id),
-                    'Group_' + group_title_slugifyed, 'Questionnaire_metadata'
-                ), os.path.join(temp_dir, 'Group_' + group_title_slugifyed,
-                                'Questionnaire_metadata')
-                )
-            except FileNotFoundError:
-                messages.error(request, DOWNLOAD_ERROR_MESSAGE)
-                return HttpResponseRedirect(
-                    reverse('experiment-detail',
-                            kwargs={'slug': experiment.slug})
-                )
-
-    # make compressed file and return response to client
-    compressed_file = shutil.make_archive(os.path.join(
-        tempfile.mkdtemp(), 'download'), 'zip', temp_dir
+    response = StreamingHttpResponse(
+        cache_stream(stream_zip(zip_entries), cached_file),
+        content_type='application/zip'
+    )
+    response['Content-Disposition'] = \
+        'attachment; filename=%s' % smart_str(EXPORT_FILENAME)
+    if not ('test' in sys.argv or 'runserver' in sys.argv):
+        response['Set-Cookie'] = 'fileDownload=true; path=/'
+
+    _count_download(experiment)
+
+    return response
+
+
+def _count_download(experiment):
+    # update() doesn't send post_save, that would remove the cached detail
+    # page of the experiment, which doesn't display the downloads
+    Experiment.objects.filter(pk=experiment.pk).update(
+        downloads=F('downloads') + 1
     )
-    # workaround to unit test serving compressed file, besides jenkins
-    if 'test' in sys.argv or 'runserver' or 'jenkins' in sys.argv:
-        file = open(os.path.join(temp_dir, compressed_file), 'rb')
+
+
+def serve_compressed_file(compressed_file):
+    """Return response to serve compressed_file for download.
+    Raises FileNotFoundError if compressed_file does not exist.
+    """
+    file = open(compressed_file, 'rb')
+
+    # Workaround to test serving compressed file. We are using Apache
+    # module to serve file imediatally by Apache instead of streaming it
+    # through Django.
+    if 'test' in sys.argv or 'runserver' in sys.argv:
         response = HttpResponse(file, content_type='application/zip')
         response['Content-Length'] = path.getsize(compressed_file)
-        # TODO: close file
     else:
         response = HttpResponse(content_type='application/force-download')
         response['X-Sendfile'] = smart_str(compressed_file)
@@ -254,16 +166,302 @@ def download_view(request, experiment_id):
         response['Set-Cookie'] = 'fileDownload=true; path=/'
 
     response['Content-Disposition'] = \
-        'attachment; filename=%s' % smart_str('download.zip')
-
-    experiment.downloads += 1
-    experiment.save()
+        'attachment; filename=%s' % smart_str(EXPORT_FILENAME)
 
-    shutil.rmtree(temp_dir)
+    file.close()
 
     return response
 
 
+def get_partial_download_filename(experiment, selected_items):
+    """Return the name of the compressed file that keeps the items selected
+    by user in cache. The name is the hash of the experiment version, the
+    build of its download files and the sorted selected items, so the same
+    selection in any order gets the same file, and files cached from the
+    files of a previous build are not served.
+    """
+    experiment_dir = os.path.join(
+        settings.MEDIA_ROOT, DOWNLOAD_DIRECTORY, str(experiment.id)
+    )
+    # the manifest is saved at the end of each build
+    try:
+        build = os.stat(
+            path.join(experiment_dir, EXPORT_MANIFEST_FILENAME)
+        ).st_mtime_ns
+    except FileNotFoundError:
+        build = None
+    key = json.dumps(
+        [experiment.version, build, sorted(set(selected_items))]
+    )
+    return os.path.join(
+        experiment_dir, PARTIAL_DOWNLOAD_DIRECTORY,
+        hashlib.sha256(key.encode('utf-8')).hexdigest() + '.zip'
+    )
+
+
+def cache_stream(chunks, cached_file):
+    """Generator that yields chunks while saving them to cached_file.
+    The file is only made available when all chunks were consumed, so an
+    interrupted download doesn't leave an incomplete file in cache.
+    """
+    os.makedirs(path.dirname(cached_file), exist_ok=True)
+    temp_file = '%s.%s.part' % (cached_file, uuid.uuid4().hex)
+    try:
+        with open(temp_file, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+        os.replace(temp_file, cached_file)
+    finally:
+        # runs also when the client aborts the download (generator closed)
+        if path.exists(temp_file):
+            os.remove(temp_file)
+        evict_partial_downloads(keep=cached_file)
+
+
+def evict_partial_downloads(max_size=None, keep=None):
+    """Remove least recently used partial download files, of all
+    experiments, until their total size fits in
+    settings.PARTIAL_DOWNLOAD_CACHE_SIZE.
+    :param keep: file not removed, even if it alone doesn't fit in cache
+    (the file just cached, that may still be served)
+    """
+    if max_size is None:
+        max_size = settings.PARTIAL_DOWNLOAD_CACHE_SIZE
+    cached_files = []
+    for cached_file in glob.glob(os.path.join(
+            settings.MEDIA_ROOT, DOWNLOAD_DIRECTORY, '*',
+            PARTIAL_DOWNLOAD_DIRECTORY, '*.zip'
+    )):
+        try:
+            stat = os.stat(cached_file)
+        except FileNotFoundError:
+            continue
+        cached_files.append((stat.st_mtime, stat.st_size, cached_file))
+
+    total_size = sum(size for mtime, size, cached_file in cached_files)
+    for mtime, size, cached_file in sorted(cached_files):
+        if total_size <= max_size:
+            break
+        if keep and path.abspath(cached_file) == path.abspath(keep):
+            continue
+        try:
+            os.remove(cached_file)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+class ZipStreamBuffer(object):
+    """Write only file-like object that holds the bytes written by ZipFile
+    until they are handed over to the response.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(zip_entries, chunk_size=64 * 1024):
+    """Generator that yields a zip file, chunk by chunk, with the files listed
+    in zip_entries.
+    :param zip_entries: list of (source path, name inside zip file) tuples.
+    Directories are included as empty directory entries.
+    :param chunk_size: size of the chunks read from source files
+    """
+    buffer = ZipStreamBuffer()
+    with ZipFile(buffer, 'w', ZIP_DEFLATED) as zip_file:
+        for source, arcname in zip_entries:
+            if os.path.isdir(source):
+                zip_file.write(source, arcname)
+            else:
+                zip_info = ZipInfo.from_file(source, arcname)
+                zip_info.compress_type = ZIP_DEFLATED
+                with open(source, 'rb') as source_file, \
+                        zip_file.open(zip_info, 'w') as zipped_file:
+                    for chunk in iter(lambda: source_file.read(chunk_size),
+                                      b''):
+                        zipped_file.write(chunk)
+                        yield buffer.pop()
+            yield buffer.pop()
+    # central directory is written when zip file is closed
+    yield buffer.pop()
+
+
+def _add_zip_entry(zip_entries, source, arcname):
+    """Add source file or directory tree to zip_entries, an OrderedDict
+    mapping names inside zip file to source paths.
+    Raises FileNotFoundError if source does not exist.
+    """
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    zip_entries[arcname] = source
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            root_arcname = os.path.join(
+                arcname, os.path.relpath(root, source)
+            )
+            for name in dirs + sorted(files):
+                zip_entries[os.path.normpath(
+                    os.path.join(root_arcname, name)
+                )] = os.path.join(root, name)
+
+
+def parse_selected_items(selected_items):
+    """Parse the options values selected by user in experiment detail
+    template into the ids of groups and participants they refer to.
+    :param selected_items: list of strings like 'experimental_protocol_g<id>',
+    'questionnaires_g<id>' or 'participant_p<id>_g<id>'
+    :return: dict with the lists of group ids selected for
+    'experimental_protocol' and 'questionnaires', and the list of
+    (participant id, group id) selected for 'participants'
+    """
+    selection = {
+        'experimental_protocol': [], 'questionnaires': [], 'participants': []
+    }
+    for item in selected_items:
+        match = PATTERN_EXP_PROTOCOL.match(item)
+        if match:
+            selection['experimental_protocol'].append(int(match.group(1)))
+            continue
+        match = PATTERN_QUESTIONNAIRES.match(item)
+        if match:
+            selection['questionnaires'].append(int(match.group(1)))
+            continue
+        match = PATTERN_PARTICIPANT.match(item)
+        if match:
+            selection['participants'].append(
+                (int(match.group(1)), int(match.group(2)))
+            )
+
+    return selection
+
+
+def _get_selected_zip_entries(experiment, experiment_dir, selected_items):
+    """Return the list of (source path, name inside zip file) of the files
+    that go to the compressed file, based on user selection.
+    Raises FileNotFoundError if any selected item does not belong to
+    experiment or has no correspondent file or subdir in experiment_dir.
+    """
+    zip_entries = OrderedDict()
+    # Experiment.csv, LICENSE.txt and CITATION.txt always will be in
+    # compressed file
+    _add_zip_entry(
+        zip_entries, os.path.join(experiment_dir, 'Experiment.csv'),
+        'Experiment.csv'
+    )
+    _add_zip_entry(
+        zip_entries, os.path.join(
+            settings.MEDIA_ROOT, DOWNLOAD_DIRECTORY, 'LICENSE.txt'
+        ), 'LICENSE.txt'
+    )
+    _add_zip_entry(
+        zip_entries, os.path.join(experiment_dir, 'CITATION.txt'),
+        'CITATION.txt'
+    )
+
+    selection = parse_selected_items(selected_items)
+    group_ids = set(selection['experimental_protocol']) | \
+        set(selection['questionnaires']) | \
+        set(group_id for participant_id, group_id in selection['participants'])
+    groups = experiment.groups.in_bulk(group_ids)
+    participant_ids = set(
+        participant_id for participant_id, group_id
+        in selection['participants']
+    )
+    participants = Participant.objects.filter(
+        group__experiment=experiment
+    ).in_bulk(participant_ids)
+    # selected items must belong to the experiment
+    if len(groups) != len(group_ids) or \
+            len(participants) != len(participant_ids):
+        raise FileNotFoundError('Selected group or participant not found')
+    # take the group titles to find subdirs/files to be compressed
+    group_dirs = {
+        group_id: 'Group_' + slugify(group.title)
+        for group_id, group in groups.items()
+    }
+
+    for group_id in selection['experimental_protocol']:
+        # Add Experimental_protocol subdir for the specific group
+        subdir = os.path.join(group_dirs[group_id], 'Experimental_protocol')
+        _add_zip_entry(
+            zip_entries, os.path.join(experiment_dir, subdir), subdir
+        )
+    for group_id in selection['questionnaires']:
+        # Add Per_questionnaire_data subdir and Participants.csv file for the
+        # specific group
+        subdir = os.path.join(group_dirs[group_id], 'Per_questionnaire_data')
+        _add_zip_entry(
+            zip_entries, os.path.join(experiment_dir, subdir), subdir
+        )
+        participants_file = os.path.join(
+            group_dirs[group_id], 'Participants.csv'
+        )
+        _add_zip_entry(
+            zip_entries, os.path.join(experiment_dir, participants_file),
+            participants_file
+        )
+    for participant_id, group_id in selection['participants']:
+        # Add Per_participant_data subdir for the specific participant
+        subdir = os.path.join(
+            group_dirs[group_id], 'Per_participant_data',
+            'Participant_' + participants[participant_id].code
+        )
+        _add_zip_entry(
+            zip_entries, os.path.join(experiment_dir, subdir), subdir
+        )
+
+    # Put Questionnaire_metadata subdir for all groups that have
+    # questionnaires.
+    for group in experiment.groups.filter(
+            steps__type=Step.QUESTIONNAIRE
+    ).distinct():
+        subdir = os.path.join(
+            'Group_' + slugify(group.title), 'Questionnaire_metadata'
+        )
+        _add_zip_entry(
+            zip_entries, os.path.join(experiment_dir, subdir), subdir
+        )
+
+    return [(source, arcname) for arcname, source in zip_entries.items()]
+
+
+@api_view(['GET'])
+@permission_classes((permissions.IsAuthenticated,))
+def download_status(request, experiment_id):
+    """Status of the last build of the experiment download files, to be
+    polled by the experiment owner (NES) and trustees.
+    """
+    experiment = get_object_or_404(Experiment, pk=experiment_id)
+    if request.user != experiment.owner and not is_trustee(request.user):
+        return Response(status=status.HTTP_403_FORBIDDEN)
+
+    export_instance = experiment.exports.order_by('-id').first()
+    if export_instance is None:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        'status': export_instance.status,
+        'progress': export_instance.progress,
+        'error': export_instance.error,
+        'date': export_instance.date,
+        'updated': export_instance.updated
+    })
+
+
 def get_export_instance(export_id):
     export_instance = Export.objects.get(id=export_id)
 
@@ -276,82 +474,164 @@ def update_export_instance(input_file, output_export, export_instance):
     export_instance.save()
 
 
-def download_create(experiment_id, template_name):
-    try:
-        export_instance = create_export_instance()
-        input_export_file = path.join(
-            EXPORT_DIRECTORY, str(export_instance.id), str(JSON_FILENAME)
-        )
-        input_filename = path.join(settings.MEDIA_ROOT, input_export_file)
-        create_directory(settings.MEDIA_ROOT, path.split(input_export_file)[0])
-        build_complete_export_structure(experiment_id, input_filename)
-        export = ExportExecution(experiment_id)
-
-        # set path of the directory base: ex. /media/temp/
-        base_directory, path_to_create = \
-            path.split(export.get_directory_base())
-        error_msg, base_directory_name = create_directory(
-            base_directory, path_to_create
-        )
-        if error_msg != "":
-            return error_msg
-
-        # prepare data to be processed
-        input_data = export.read_configuration_data(input_filename)
-
-        if not export.is_input_data_consistent() or not input_data:
-            error_msg = "Inconsistent data read from json file"
-        if error_msg != "":
-            return error_msg
-
-        # Load information of the data collection per participant in a
-        # dictionnary.
-        error_msg = export.include_data_from_group(experiment_id)
-        if error_msg != "":
-            return error_msg
-
-        # Create export files
-        # Create files of experimental protocol and diagnosis/participant
-        # csv file for each group.
-        error_msg = export.process_experiment_data(experiment_id)
-        if error_msg != "":
-            return error_msg
-
-        # process the data per participant
-        error_msg = export.download_data_per_participant()
-        if error_msg != "":
-            return error_msg
-
-        # process the data per questionnaire
-        error_msg = export.download_data_per_questionnaire()
-
-        # create zip file and include files
-        if export.files_to_zip_list:
-            # 'download.zip'
-            export_filename = export.get_input_data("export_filename")
-            export_complete_filename = path.join(
-                base_directory_name, export_filename
-            )
+def download_create(experiment_id, template_name, export_instance=None):
+    """Build the files for download of the experiment, recording status and
+    progress in export_instance.
+    :param experiment_id: experiment id
+    :param template_name: not used (it's "" for all callers)
+    :param export_instance: Export instance, created if None
+    :return: error message ("" if none)
+    """
+    if export_instance is None:
+        export_instance = create_export_instance(experiment_id)
+    export_instance.set_progress(0)
 
-            with ZipFile(export_complete_filename, 'w') as zip_file:
-                for filename, directory in export.files_to_zip_list:
-                    fdir, fname = path.split(filename)
-                    zip_file.write(
-                        filename.encode('utf-8'), path.join(directory, fname)
-                    )
-
-        export_instance_directory = settings.MEDIA_ROOT + '/'
-        temp_directory = path.join(
-            export_instance_directory,
-            path.join(EXPORT_DIRECTORY, str(export_instance.id))
+    try:
+        error_msg = _create_download_files(experiment_id, export_instance)
+    except Exception as e:
+        # any error fails the build, that may be retried
+        logger.exception(
+            'Building download files of experiment %s failed', experiment_id
         )
-        rmtree(temp_directory, ignore_errors=True)
+        error_msg = str(e) or e.__class__.__name__
+    # after the files were (re)written, even if the build failed
+    _remove_partial_downloads(experiment_id)
 
-        if template_name != "":
-            return error_msg
+    temp_directory = path.join(
+        settings.MEDIA_ROOT, EXPORT_DIRECTORY, str(export_instance.id)
+    )
+    rmtree(temp_directory, ignore_errors=True)
 
-    except OSError as e:
-        print(e)
-        error_msg = e
-        if template_name != "":
-            return error_msg
+    if error_msg != "":
+        export_instance.status = Export.FAILED
+        export_instance.error = error_msg
+        export_instance.save()
+    else:
+        export_instance.set_progress(100, Export.DONE)
+
+    return error_msg
+
+
+def _remove_partial_downloads(experiment_id):
+    """Remove the partial downloads cached of the experiment, built from the
+    previous files or from files being rewritten during the build. Saving the
+    manifest at the end of the build already changed their names (see
+    get_partial_download_filename), so files still being cached (*.part)
+    are not served either, and are left to be evicted from cache.
+    """
+    for cached_file in glob.glob(path.join(
+            settings.MEDIA_ROOT, DOWNLOAD_DIRECTORY, str(experiment_id),
+            PARTIAL_DOWNLOAD_DIRECTORY, '*.zip'
+    )):
+        try:
+            os.remove(cached_file)
+        except FileNotFoundError:
+            pass
+
+
+def _get_previous_version_directory_base(experiment_id, base_directory):
+    """Return the directory base of the export of the last previous version
+    of the experiment that was exported (None if none), whose files can be
+    reused by the export of the experiment.
+    """
+    experiment = Experiment.objects.get(pk=experiment_id)
+    previous_versions = Experiment.objects.filter(
+        owner_id=experiment.owner_id, nes_id=experiment.nes_id,
+        version__lt=experiment.version
+    ).order_by('-version').values_list('id', flat=True)
+    for previous_id in previous_versions:
+        directory_base = path.join(base_directory, str(previous_id))
+        if path.exists(path.join(directory_base, EXPORT_MANIFEST_FILENAME)):
+            return directory_base
+
+    return None
+
+
+def _create_download_files(experiment_id, export_instance):
+    input_export_file = path.join(
+        EXPORT_DIRECTORY, str(export_instance.id), str(JSON_FILENAME)
+    )
+    input_filename = path.join(settings.MEDIA_ROOT, input_export_file)
+    create_directory(settings.MEDIA_ROOT, path.split(input_export_file)[0])
+    build_complete_export_structure(experiment_id, input_filename)
+    export = ExportExecution(experiment_id)
+
+    # set path of the directory base: ex. /media/temp/
+    base_directory, path_to_create = \
+        path.split(export.get_directory_base())
+    error_msg, base_directory_name = create_directory(
+        base_directory, path_to_create
+    )
+    if error_msg != "":
+        return error_msg
+
+    # prepare data to be processed
+    input_data = export.read_configuration_data(input_filename)
+
+    if not export.is_input_data_consistent() or not input_data:
+        error_msg = "Inconsistent data read from json file"
+    if error_msg != "":
+        return error_msg
+
+    # Load information of the data collection per participant in a
+    # dictionnary.
+    error_msg = export.include_data_from_group(experiment_id)
+    if error_msg != "":
+        return error_msg
+    export_instance.set_progress(20)
+
+    # Create export files
+    # Create files of experimental protocol and diagnosis/participant
+    # csv file for each group.
+    error_msg = export.process_experiment_data(experiment_id)
+    if error_msg != "":
+        return error_msg
+    export_instance.set_progress(30)
+
+    # Process the data per participant and per questionnaire of each
+    # group while the files already created are written to zip file.
+    # The zip file is created with a temporary name so the previous one
+    # keeps being served until the new one is complete.
+    export_filename = export.get_input_data("export_filename")
+    export_complete_filename = path.join(
+        base_directory_name, export_filename
+    )
+    zip_filename = export_complete_filename + '.part'
+    zip_writer = ZipFileWriter(zip_filename)
+    zip_writer.start()
+    try:
+        zip_writer.put(export.files_to_zip_list)
+        error_msg = export.download_data_per_group(
+            zip_writer, settings.EXPORT_WORKERS,
+            lambda done, total: export_instance.set_progress(
+                30 + 65 * done // total
+            ),
+            _get_previous_version_directory_base(
+                experiment_id, base_directory
+            )
+        )
+    except Exception:
+        # stop the writer thread, the exception raised is the one of the
+        # export
+        try:
+            zip_writer.close()
+        except Exception:
+            pass
+        if path.exists(zip_filename):
+            os.remove(zip_filename)
+        raise
+    zip_writer.close()
+    if error_msg != "":
+        if path.exists(zip_filename):
+            os.remove(zip_filename)
+        return error_msg
+    # As before the zip file was written while exporting, download.zip is
+    # only created if there are files to zip
+    if path.exists(zip_filename):
+        os.replace(zip_filename, export_complete_filename)
+    # files of participants and groups changed or removed would be taken
+    # by partial downloads
+    export.remove_stale_files([PARTIAL_DOWNLOAD_DIRECTORY])
+    export.save_manifest()
+
+    return error_msg
@@ -3,7 +3,7 @@ from django.core.mail import send_mail
 from rest_framework import serializers, permissions, viewsets
 
 from experiments import appclasses
-from experiments.tasks import build_download_file
+from experiments.tasks import queue_build_download_file
 from experiments.models import Experiment, Study, User, \
     Group, ExperimentalProtocol, Researcher, Participant, \
     Keyword, ClassificationOfDiseases, \
@@ -1073,9 +1073,10 @@ class ExperimentViewSet(viewsets.ModelViewSet):
         # Ok by now, as the only situation where the experiment is
         # updated by NES API client is precisely when the NES change
         # status from "Receiving" to "To be analysed";
-        # 2) See wy celery delay is not working. Commented by now.
-        #build_download_file.delay(int(experiment['id']), template_name="")
-        build_download_file(int(experiment['id']), template_name="")
+        # 2) The build runs in Celery worker. A build already queued or
+        # running for the experiment is not queued again. Its progress can
+        # be polled in downloads/<experiment_id>/status/.
+        queue_build_download_file(int(experiment['id']))
 
 
 class StudyViewSet(viewsets.ModelViewSet):
@@ -1,6 +1,9 @@
 import shlex
+from collections import OrderedDict
 
+from django.core.paginator import Paginator
 from django.db.models import Max
+from haystack.query import SQ
 from haystack.utils import Highlighter
 
 from experiments import models
@@ -41,3 +44,71 @@ class NepHighlighter(Highlighter):
             shlex_quoted = shlex.split(shlex.quote(query))
         self.query_words = set([word.lower() for word in shlex_quoted
                                 if not word.startswith('-')])
+
+
+def group_by_experiment(hits):
+    """
+    Group search hits by experiment, in the order of the best hit of each
+    experiment. Hits without experiment (objects shared by experiments) are
+    kept alone.
+    :param hits: list of (experiment_id, id) of the hits, ordered by score,
+    id being the identifier of the document in the index
+    :return: list of lists of hits
+    """
+    groups = OrderedDict()
+    for experiment_id, identifier in hits:
+        key = ('result', identifier) if experiment_id is None \
+            else ('experiment', experiment_id)
+        groups.setdefault(key, []).append((experiment_id, identifier))
+
+    return list(groups.values())
+
+
+class ExperimentPaginator(Paginator):
+    """
+    Paginates search results by experiment: a page has the results of
+    per_page experiments, the results of each experiment together. Only the
+    experiment of all the hits is read from the index (see
+    ExperimentRelatedIndex), the results of a page are fetched when the
+    page is built.
+    """
+
+    def __init__(self, object_list, per_page, **kwargs):
+        self.search_queryset = object_list
+        hits = object_list.values_list('experiment_id', 'id')
+        super(ExperimentPaginator, self).__init__(
+            group_by_experiment(hits[:len(hits)]), per_page, **kwargs
+        )
+
+    def _get_page(self, groups, number, paginator):
+        identifiers = [
+            identifier for group in groups for _, identifier in group
+        ]
+        if not identifiers:
+            return super(ExperimentPaginator, self)._get_page(
+                [], number, paginator
+            )
+
+        experiment_ids = sorted(set(
+            group[0][0] for group in groups if group[0][0] is not None
+        ))
+        query = SQ(experiment_id__in=experiment_ids) \
+            if experiment_ids else None
+        for group in groups:
+            if group[0][0] is None:
+                django_ct, django_id = group[0][1].rsplit('.', 1)
+                result_query = SQ(django_ct__exact=django_ct,
+                                  django_id__exact=django_id)
+                query = result_query if query is None \
+                    else query | result_query
+
+        results = {
+            result.id: result for result in
+            self.search_queryset.filter(query)[:len(identifiers)]
+        }
+        # the index may have changed since the hits were read
+        return super(ExperimentPaginator, self)._get_page(
+            [results[identifier] for identifier in identifiers
+             if identifier in results],
+            number, paginator
+        )
@@ -0,0 +1,401 @@
+import random
+from datetime import datetime
+from random import randint, choice
+
+from django.contrib.auth.models import User
+from faker import Factory
+
+from experiments.helpers import generate_image_file
+from experiments.models import Experiment, Study, Group, Participant, \
+    Gender, ExperimentalProtocol, Step, TMSSetting, TMSData, EEGSetting, \
+    EEGData, EEG, EMG, EMGSetting, EMGData, Questionnaire, \
+    QuestionnaireLanguage, QuestionnaireDefaultLanguage, QuestionnaireResponse
+
+# the password of the users created
+PASSWORD = 'labX'
+
+
+def create_group(qtty, experiment):
+    # TODO: refactor to accept more than one experiment (insert qtty parameter)
+    """
+    :param qtty: Number of groups
+    :param experiment: Experiment model instance
+    """
+    fake = Factory.create()
+
+    groups = []
+    for i in range(qtty):
+        group = Group.objects.create(
+            title=fake.text(max_nb_chars=15),
+            description=fake.text(max_nb_chars=150),
+            experiment=experiment
+        )
+        groups.append(group)
+
+    if len(groups) == 1:
+        return groups[0]
+    return groups
+
+
+def create_study(qtty, experiment):
+    """
+    :param qtty: number of studies to be created
+    :param experiment: Experiment to be associated with Study
+    """
+    fake = Factory.create()
+
+    studies = []
+    for i in range(qtty):
+        study = Study.objects.create(
+            title=fake.text(max_nb_chars=15),
+            description=fake.text(max_nb_chars=200),
+            start_date=datetime.utcnow(), experiment=experiment
+        )
+        studies.append(study)
+
+    if len(studies) == 1:
+        return studies[0]
+    return studies
+
+
+def create_owner(username=None):
+    """
+    :param username: String
+    :return: auth.User model instance
+    """
+    fake = Factory.create()
+
+    if not username:
+        while True:
+            username = fake.word()
+            if not User.objects.filter(username=username):
+                break
+
+    return User.objects.create_user(username=username, password=PASSWORD)
+
+
+def create_experiment(qtty, owner=None, status=Experiment.TO_BE_ANALYSED,
+                      title=None):
+    """
+    :param qtty: number of experiments to be created
+    :param owner: owner of experiment - User instance model
+    :param status: experiment status
+    """
+    fake = Factory.create()
+
+    if not owner:
+        owner = create_owner()
+
+    experiments = []
+    for i in range(qtty):
+        experiment = Experiment.objects.create(
+            title=title if title else fake.text(max_nb_chars=15),
+            description=fake.text(max_nb_chars=200),
+            # TODO: guarantee that this won't
+            # TODO: genetates constraint violaton (nes_id, owner_id)!
+            nes_id=randint(1, 10000),
+            owner=owner, version=1,
+            sent_date=datetime.utcnow(),
+            status=status,
+            data_acquisition_done=choice([True, False]),
+        )
+        experiments.append(experiment)
+
+    if len(experiments) == 1:
+        return experiments[0]
+    return experiments
+
+
+def create_genders():
+    Gender.objects.create(name='male')
+    Gender.objects.create(name='female')
+
+
+def create_participant(qtty, group, gender):
+    """
+    :param qtty: number of objects to create
+    :param gender: Gender model instance
+    :param group: Group model instance
+    """
+    code = randint(1, 1000)
+
+    participants = []
+    for j in range(qtty):
+        participant = Participant.objects.create(
+            code=code, age=randint(18, 80),
+            gender=gender,
+            group=group
+        )
+        code += 1
+        participants.append(participant)
+
+    if len(participants) == 1:
+        return participants[0]
+    return participants
+
+
+def create_experimental_protocol(group):
+    """
+    :type group: Group model instance
+    """
+    fake = Factory.create()
+
+    exp_prot = ExperimentalProtocol.objects.create(
+        group=group,
+        textual_description=fake.text()
+    )
+
+    # create experimental protocol image
+    image_file = generate_image_file(
+        randint(100, 800), randint(300, 700), fake.word() + '.jpg'
+    )
+    exp_prot.image.save(image_file.name, image_file)
+    exp_prot.save()
+
+    return exp_prot
+
+
+def create_step(qtty, group, type):
+    """
+    :param qtty: number of Step model instances
+    :param group: Group model instance
+    :param type: Step type: eeg, emg, tms etc.
+    """
+    fake = Factory.create()
+
+    steps = []
+    for i in range(qtty):
+        step = Step.objects.create(
+            group=group,
+            identification=fake.word(), numeration=fake.ssn(),
+            type=type, order=randint(1, 20)
+        )
+        steps.append(step)
+
+    if len(steps) == 1:
+        return steps[0]
+    return steps
+
+
+def create_eeg_step(group, eeg_setting):
+    """
+    :param group: Group model instance
+    :param eeg_setting: EEGSetting model instance
+    """
+    faker = Factory.create()
+
+    return EEG.objects.create(
+        group=group, eeg_setting=eeg_setting,
+        identification=faker.word(), numeration=faker.ssn(),
+        type=Step.EEG, order=randint(1, 20)
+    )
+
+
+def create_emg_setting(experiment):
+    """
+    :param experiment: Experiment model instance
+    :return: EMGSetting model instance
+    """
+    faker = Factory.create()
+
+    return EMGSetting.objects.create(
+        experiment=experiment, name=faker.word(), description=faker.text(),
+        acquisition_software_version=faker.ssn()
+    )
+
+
+def create_emg_step(group, emg_setting):
+    """
+    :param group: Group model instance
+    :param emg_setting: EMGSetting model instance
+    """
+    faker = Factory.create()
+
+    return EMG.objects.create(
+        group=group, emg_setting=emg_setting,
+        identification=faker.word(), numeration=faker.ssn(),
+        type=Step.EMG, order=randint(1, 20)
+    )
+
+
+def create_emg_data(emg_setting, emg_step, participant):
+    """
+    :param emg_setting: EMGSetting model instance
+    :param emg_step: EMG(Step) model instance
+    :param participant: Participant model instance
+    """
+    return EMGData.objects.create(
+        emg_setting=emg_setting,
+        step=emg_step,
+        participant=participant,
+        date=datetime.utcnow()
+    )
+
+
+def create_tms_setting(qtty, experiment):
+    """
+    :param qtty: number of tmssetting settings
+    :param experiment: Experiment model instance
+    """
+    fake = Factory.create()
+
+    tms_settings = []
+    for i in range(qtty):
+        tms_setting = TMSSetting.objects.create(
+            experiment=experiment,
+            name=fake.word(),
+            description=fake.text()
+        )
+        tms_settings.append(tms_setting)
+
+    if len(tms_settings) == 1:
+        return tms_settings[0]
+    return tms_settings
+
+
+def create_tms_data(qtty, tmssetting, participant):
+    """
+    :param qtty: number of tms data objects to create
+    :param tmssetting: TMSSetting model instance
+    :param participant: Participant model instance
+    """
+    faker = Factory.create()
+
+    tms_data_list = []
+    for i in range(qtty):
+        tms_data = TMSData.objects.create(
+            participant=participant,
+            date=datetime.utcnow(),
+            tms_setting=tmssetting,
+            resting_motor_threshold=round(random.uniform(0, 10), 2),
+            test_pulse_intensity_of_simulation=round(random.uniform(0, 10), 2),
+            second_test_pulse_intensity=round(random.uniform(0, 10), 2),
+            interval_between_pulses=randint(0, 10),
+            interval_between_pulses_unit='s',
+            time_between_mep_trials=randint(0, 10),
+            description=faker.text(), hotspot_name=faker.word(),
+            localization_system_name=faker.word(),
+            localization_system_description=faker.text(),
+            brain_area_name=faker.word(),
+            brain_area_description=faker.text(),
+            brain_area_system_name=faker.word(),
+            brain_area_system_description=faker.text()
+        )
+        tms_data_list.append(tms_data)
+
+    if len(tms_data_list) == 1:
+        return tms_data_list[0]
+    return tms_data_list
+
+
+def create_eeg_setting(qtty, experiment):
+    """
+    :param qtty: number of eeg setting objects to create
+    :param experiment: Experiment model instance
+    """
+    faker = Factory.create()
+
+    eeg_settings = []
+    for i in range(qtty):
+        eeg_setting = EEGSetting.objects.create(
+            experiment=experiment, name=faker.word(), description=faker.text()
+        )
+        eeg_settings.append(eeg_setting)
+
+    if len(eeg_settings) == 1:
+        return eeg_settings[0]
+    return eeg_settings
+
+
+def create_eeg_data(eeg_setting, eeg_step, participant):
+    """
+    :param eeg_setting: EEGSetting model instance
+    :param eeg_step: EEG(Step) model instance
+    :param participant: Participant model instance
+    """
+    return EEGData.objects.create(
+        eeg_setting=eeg_setting,
+        step=eeg_step,
+        participant=participant,
+        date=datetime.utcnow()
+    )
+
+
+def create_questionnaire_language(questionnaire, source, language):
+    """
+    Get the data from source file containing questionnaire csv data,
+    and populates QuestionnaireLanguage object
+    :param questionnaire: Questionnaire model instance
+    :param source: file to read from
+    :param language: language of the questionnaire
+    :return: QuestionnaireLanguage model instance
+    """
+    file = open(source, 'r')
+    # skip first line with column titles
+    file.readline()
+    # gets the questionnaire title in second line second column
+    questionnaire_title = file.readline().split(',')[1]
+    file.close()
+    # open again to get all data
+    with open(source, 'r') as fp:
+        metadata = fp.read()
+
+    q_language = QuestionnaireLanguage.objects.create(
+        questionnaire=questionnaire,
+        language_code=language,
+        survey_name=questionnaire_title,
+        survey_metadata=metadata
+    )
+
+    # we consider that English language is always the default language
+    # for tests porposes
+    if language == 'en':
+        QuestionnaireDefaultLanguage.objects.create(
+            questionnaire=questionnaire,
+            questionnaire_language=QuestionnaireLanguage.objects.last()
+        )
+
+    return q_language
+
+
+def create_questionnaire(qtty, code, group):
+    """
+    Create qtty questionnaire(s) for a group
+    :param qtty: quantity of questionnaires to be created
+    :param code: code of the questionnaire (defined to ease questionnaire
+    testing)
+    :param group: Group model instance
+    """
+    faker = Factory.create()
+
+    q_list = []
+    for i in range(qtty):
+        q_list.append(Questionnaire.objects.create(
+            code=code,
+            group=group, order=randint(1, 10),
+            identification='questionnaire',
+            numeration=faker.ssn(),
+            type=Step.QUESTIONNAIRE,
+        ))
+
+    if len(q_list) > 1:
+        return q_list
+    else:
+        return q_list[0]
+
+
+def create_questionnaire_responses(questionnaire, participant, source):
+    """
+    Create QuestionnaireResponse object for one participant for a given
+    Questionnaire object
+    :param questionnaire: Questionnaire model instance
+    :param participant: Participant model instance
+    :param source: File with json text
+    """
+    with open(source, 'r') as fp:
+        responses = fp.read()
+
+    return QuestionnaireResponse.objects.create(
+        step=questionnaire, participant=participant, date=datetime.utcnow(),
+        limesurvey_response=responses
+    )
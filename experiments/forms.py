@@ -55,6 +55,12 @@ class NepSearchForm(SearchForm):
 
         sqs = self._parse_query(self.cleaned_data['q'])
 
+        # Filtering by step type returns only the objects of the experiments
+        # with steps of all the types chosen (step_types is stored in the
+        # documents of all objects of the experiments)
+        for step_type in self.cleaned_data['filter']:
+            sqs = sqs.filter_and(step_types__exact=step_type)
+
         if self.load_all:
             sqs = sqs.load_all()
 
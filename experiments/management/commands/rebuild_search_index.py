@@ -0,0 +1,36 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import BaseCommand, CommandError
+from haystack.constants import DEFAULT_ALIAS
+
+from experiments.search_rebuild import rebuild_index_blue_green
+
+
+class Command(BaseCommand):
+    help = 'Build the search index in a new version and replace the ' \
+           'current one with it, without interrupting the searches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--using', dest='using', default=DEFAULT_ALIAS,
+            help='Haystack connection of the index'
+        )
+        parser.add_argument(
+            '--keep', type=int, dest='keep', default=1,
+            help='Number of previous versions of the index to keep'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=1000,
+            help='Number of objects indexed at a time'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            version = rebuild_index_blue_green(
+                options['using'], options['keep'], options['batch_size']
+            )
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Search index rebuilt in version %s' % version
+        ))
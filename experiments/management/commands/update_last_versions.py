@@ -0,0 +1,59 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from experiments.models import Experiment, get_last_versions, \
+    reset_to_be_analysed_count
+
+
+class Command(BaseCommand):
+    help = 'Set is_latest and is_latest_approved of all experiments from ' \
+           'their versions, or just verify them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true', dest='verify', default=False,
+            help='Only report experiments with wrong flags'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            experiments = Experiment.objects.select_for_update().values_list(
+                'id', 'owner_id', 'nes_id', 'version', 'status',
+                'is_latest', 'is_latest_approved'
+            )
+            last_versions, last_approved_versions = get_last_versions(
+                experiment[:5] for experiment in experiments
+            )
+            wrong = [
+                experiment[0] for experiment in experiments
+                if experiment[5] != (experiment[0] in last_versions) or
+                experiment[6] != (experiment[0] in last_approved_versions)
+            ]
+
+            if options['verify']:
+                if wrong:
+                    raise CommandError(
+                        'Experiments with wrong last version flags: %s' %
+                        ', '.join(str(id_) for id_ in sorted(wrong))
+                    )
+                self.stdout.write(self.style.SUCCESS(
+                    'Last version flags of all experiments are right'
+                ))
+                return
+
+            Experiment.objects.filter(id__in=wrong).update(
+                is_latest=False, is_latest_approved=False
+            )
+            Experiment.objects.filter(
+                id__in=last_versions.intersection(wrong)
+            ).update(is_latest=True)
+            Experiment.objects.filter(
+                id__in=last_approved_versions.intersection(wrong)
+            ).update(is_latest_approved=True)
+            # update() doesn't call Experiment.save(), that resets the count
+            if wrong:
+                reset_to_be_analysed_count()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Last version flags of %d experiment(s) updated' % len(wrong)
+        ))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_last_versions(apps, schema_editor):
+    Experiment = apps.get_model('experiments', 'Experiment')
+    last_versions = {}
+    last_approved_versions = {}
+    for id_, owner_id, nes_id, version, status in \
+            Experiment.objects.values_list(
+                'id', 'owner_id', 'nes_id', 'version', 'status'
+            ):
+        key = (owner_id, nes_id)
+        if key not in last_versions or version > last_versions[key][1]:
+            last_versions[key] = (id_, version)
+        if status == 'approved' and (
+                key not in last_approved_versions or
+                version > last_approved_versions[key][1]
+        ):
+            last_approved_versions[key] = (id_, version)
+
+    Experiment.objects.filter(
+        id__in=[id_ for id_, version in last_versions.values()]
+    ).update(is_latest=True)
+    Experiment.objects.filter(
+        id__in=[id_ for id_, version in last_approved_versions.values()]
+    ).update(is_latest_approved=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0100_change_max_length_experiment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='is_latest',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='is_latest_approved',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.RunPython(set_last_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiments', '0101_experiment_is_latest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='experiment',
+            index=models.Index(fields=['status', 'is_latest'], name='experiments_status_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='step',
+            index=models.Index(fields=['group', 'type'], name='experiments_step_grp_type_idx'),
+        ),
+    ]
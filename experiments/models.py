@@ -1,9 +1,13 @@
 from os import path
 
-from django.db import models
-from django.db.models import Max, Q
+from django.conf import settings
+from django.core.cache import cache, caches, InvalidCacheBackendError
+from django.core.cache.utils import make_template_fragment_key
+from django.db import models, transaction
+from django.db.models import BooleanField, Case, Value, When
 from django.contrib.auth.models import User
-from django.db.models.signals import post_delete, pre_delete
+from django.db.models.signals import post_delete, pre_delete, post_save, \
+    m2m_changed
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 from django.utils.translation import ugettext_lazy as _
@@ -50,6 +54,56 @@ def _create_slug(experiment):
             experiment.slug = slugify(experiment.title)
 
 
+def get_last_versions(experiments):
+    """Return the ids of the last versions and of the last approved
+    versions of experiments, with the same owner and nes_id.
+    :param experiments: iterable of (id, owner_id, nes_id, version, status)
+    :return: set of last versions ids, set of last approved versions ids
+    """
+    last_versions = {}
+    last_approved_versions = {}
+    for id_, owner_id, nes_id, version, status in experiments:
+        key = (owner_id, nes_id)
+        if key not in last_versions or version > last_versions[key][1]:
+            last_versions[key] = (id_, version)
+        if status == Experiment.APPROVED and (
+                key not in last_approved_versions or
+                version > last_approved_versions[key][1]
+        ):
+            last_approved_versions[key] = (id_, version)
+
+    return {id_ for id_, version in last_versions.values()}, \
+        {id_ for id_, version in last_approved_versions.values()}
+
+
+# cache key of the number of experiments to be analysed
+TO_BE_ANALYSED_COUNT_KEY = 'to_be_analysed_count'
+
+
+def get_to_be_analysed_count():
+    """Return the number of last versions of experiments to be analysed,
+    displayed to the trustees in the page top badge. It's kept in cache
+    until the status of an experiment changes, so the cache must be shared
+    by all processes (see CACHES in local_settings_example.py) for them to
+    see the change.
+    """
+    count = cache.get(TO_BE_ANALYSED_COUNT_KEY)
+    if count is None:
+        count = Experiment.lastversion_objects.all().filter(
+            status=Experiment.TO_BE_ANALYSED
+        ).count()
+        cache.set(TO_BE_ANALYSED_COUNT_KEY, count, None)
+
+    return count
+
+
+def reset_to_be_analysed_count():
+    cache.delete(TO_BE_ANALYSED_COUNT_KEY)
+    # the count may be cached again by other requests before the end of the
+    # current transaction
+    transaction.on_commit(lambda: cache.delete(TO_BE_ANALYSED_COUNT_KEY))
+
+
 def get_data_file_dir(instance, filename):
     directory = "download"
     if isinstance(instance, Experiment):
@@ -61,35 +115,11 @@ def get_data_file_dir(instance, filename):
 # custom query sets
 class LastVersionExperimentQuerySet(models.QuerySet):
 
-    @staticmethod
-    def _q_statement(queryset):
-        q_statement = Q()
-        for experiment in queryset:
-            q_statement |= (
-                    Q(owner=experiment['owner']) &
-                    Q(nes_id=experiment['nes_id']) &
-                    Q(version=experiment['max_version'])
-            )
-        return q_statement
-
     def all(self):
-        max_version_set = \
-            Experiment.objects.values('owner', 'nes_id').annotate(
-                max_version=Max('version')
-            )
-        q_statement = self._q_statement(max_version_set)
-
-        return self.filter(q_statement)
+        return self.filter(is_latest=True)
 
     def approved(self):
-        max_version_set = \
-            Experiment.objects.filter(status=Experiment.APPROVED).values(
-                'owner', 'nes_id'
-            ).annotate(max_version=Max('version'))
-        if max_version_set:
-            return self.filter(self._q_statement(max_version_set))
-
-        return max_version_set
+        return self.filter(is_latest_approved=True)
 
     # Implement methods for other experiment statuses if necessary
 
@@ -155,20 +185,87 @@ class Experiment(models.Model):  # indexed for search
     #  regret when saving experiments with slug=''.
     slug = models.SlugField(max_length=255, unique=True)
     release_notes = models.TextField(blank=True, default='')
+    # Denormalized from the versions of the experiment (same owner and
+    # nes_id) when they are saved or deleted, so the last versions are
+    # selected by an indexed filter. See update_last_versions command.
+    is_latest = models.BooleanField(default=False, db_index=True)
+    is_latest_approved = models.BooleanField(default=False, db_index=True)
 
     objects = models.Manager()
     lastversion_objects = LastVersionExperimentManager()
 
     class Meta:
+        # the unique index also serves the queries for the versions of an
+        # experiment (nes_id, owner)
         unique_together = ('nes_id', 'owner', 'version')
+        indexes = [
+            models.Index(
+                fields=['status', 'is_latest'],
+                name='experiments_status_latest_idx'
+            ),
+        ]
         permissions = (('change_slug', 'Can change experiment slug'),)
 
+    def __init__(self, *args, **kwargs):
+        super(Experiment, self).__init__(*args, **kwargs)
+        self._versions_state = self._get_versions_state()
+
+    def _get_versions_state(self):
+        # deferred fields are not in __dict__, and are not loaded here
+        return tuple(
+            self.__dict__.get(field)
+            for field in ['owner_id', 'nes_id', 'version', 'status']
+        )
+
     # save slug field if it's first time save
     def save(self, *args, **kwargs):
-        if not self.id:
-            _create_slug(self)
+        with transaction.atomic():
+            if not self.id:
+                _create_slug(self)
+                self._versions_state = None
+
+            super(Experiment, self).save()
+
+            # don't update the flags when saving other fields
+            if self._versions_state != self._get_versions_state():
+                if self._versions_state:
+                    owner_id, nes_id = self._versions_state[:2]
+                    if (owner_id, nes_id) != (self.owner_id, self.nes_id):
+                        Experiment.update_last_version_flags(owner_id, nes_id)
+                Experiment.update_last_version_flags(
+                    self.owner_id, self.nes_id
+                )
+                self.is_latest, self.is_latest_approved = \
+                    Experiment.objects.filter(pk=self.pk).values_list(
+                        'is_latest', 'is_latest_approved'
+                    ).get()
+                self._versions_state = self._get_versions_state()
 
-        super(Experiment, self).save()
+    @staticmethod
+    def update_last_version_flags(owner_id, nes_id):
+        """Set is_latest and is_latest_approved of the versions of the
+        experiment with owner_id and nes_id. The versions are locked until
+        the end of the transaction, so concurrent updates are serialized.
+        Also resets the cached number of experiments to be analysed.
+        """
+        with transaction.atomic():
+            versions = Experiment.objects.filter(
+                owner_id=owner_id, nes_id=nes_id
+            )
+            last_versions, last_approved_versions = get_last_versions(
+                versions.select_for_update().values_list(
+                    'id', 'owner_id', 'nes_id', 'version', 'status'
+                )
+            )
+            flags = {}
+            for flag, ids in [('is_latest', last_versions),
+                              ('is_latest_approved', last_approved_versions)]:
+                flags[flag] = Case(
+                    When(pk__in=ids, then=Value(True)),
+                    default=Value(False), output_field=BooleanField()
+                ) if ids else Value(False)
+            versions.update(**flags)
+        reset_to_be_analysed_count()
 
     def has_setting(self):
         return self.eegsetting_set.all() or self.emgsetting_set.all() or \
@@ -180,6 +277,7 @@ class Experiment(models.Model):  # indexed for search
 @receiver(post_delete, sender=Experiment)
 def experiment_delete(instance, **kwargs):
     instance.ethics_committee_file.delete(save=False)
+    Experiment.update_last_version_flags(instance.owner_id, instance.nes_id)
 
 
 class ClassificationOfDiseases(models.Model):  # indirectly indexed for search
@@ -725,6 +823,13 @@ class Step(models.Model):
     )
     random_position = models.NullBooleanField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['group', 'type'], name='experiments_step_grp_type_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.type
 
@@ -979,3 +1084,106 @@ class AdditionalData(DataCollection, DataFile): # not indexed for search
 @receiver(pre_delete, sender=AdditionalData)
 def additional_data_delete(instance, **kwargs):
     _delete_file_instance(instance)
+
+
+# Cache of the public fragments of the experiment detail page
+# (templates/experiments/detail.html and header_detail.html), keyed by
+# fragment, experiment id and language. Slugs are not used, as they can be
+# changed and then taken by other experiments.
+EXPERIMENT_DETAIL_FRAGMENTS = ['participants', 'tabs', 'downloads', 'charts']
+
+
+def _get_fragment_cache():
+    # same cache used by the {% cache %} template tag
+    try:
+        return caches['template_fragments']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def invalidate_experiment_detail_cache(experiments):
+    """Remove the cached fragments of the detail page of the experiments
+    :param experiments: iterable of experiment ids
+    """
+    keys = [
+        make_template_fragment_key(
+            'experiment_detail', [fragment, experiment_id, language]
+        )
+        for experiment_id in experiments
+        for fragment in EXPERIMENT_DETAIL_FRAGMENTS
+        for language, name in settings.LANGUAGES
+    ]
+    if keys:
+        _get_fragment_cache().delete_many(keys)
+
+
+_paths_to_experiment = {}
+
+
+def _get_path_to_experiment(model):
+    """Return the shortest path of foreign keys from model to Experiment, as
+    a list of field names, or None if model is not related to an experiment.
+    """
+    if model not in _paths_to_experiment:
+        path = None
+        visited = {model}
+        paths = [(model, [])]
+        while paths and path is None:
+            next_paths = []
+            for current, fields in paths:
+                for field in current._meta.get_fields():
+                    related = field.related_model
+                    if not field.many_to_one and not field.one_to_one or \
+                            not field.concrete or field.null or \
+                            related in visited or \
+                            related._meta.app_label != 'experiments':
+                        continue
+                    if related is Experiment:
+                        path = fields + [field.name]
+                        break
+                    visited.add(related)
+                    next_paths.append((related, fields + [field.name]))
+                if path:
+                    break
+            paths = next_paths
+        _paths_to_experiment[model] = path
+
+    return _paths_to_experiment[model]
+
+
+def _get_related_experiments(instance):
+    if isinstance(instance, Experiment):
+        # the detail pages list the other versions of the experiment, and
+        # the instance is not in the database after being deleted
+        return list(Experiment.objects.filter(
+            nes_id=instance.nes_id, owner_id=instance.owner_id
+        ).values_list('pk', flat=True)) + [instance.pk]
+
+    path = _get_path_to_experiment(type(instance))
+    if path is None:
+        return []
+    # the instance may be already deleted, so start from the related object
+    field = type(instance)._meta.get_field(path[0])
+    related_id = getattr(instance, field.attname)
+    if related_id is None:
+        return []
+    if len(path) == 1:
+        return [related_id]
+    lookup = '__'.join(path[1:])
+    return field.related_model.objects.filter(pk=related_id).values_list(
+        lookup + '__pk', flat=True
+    )
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def experiment_detail_cache_invalidate(sender, instance, **kwargs):
+    if sender._meta.app_label == 'experiments':
+        invalidate_experiment_detail_cache(_get_related_experiments(instance))
+
+
+@receiver(m2m_changed)
+def experiment_detail_cache_invalidate_m2m(sender, instance, action, **kwargs):
+    if sender._meta.app_label == 'experiments' and \
+            action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_experiment_detail_cache(_get_related_experiments(instance))
@@ -14,3 +14,23 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
 
         # Write permissions are only allowed to the owner of the snippet.
         return obj.owner == request.user
+
+
+def get_group_names(user):
+    """
+    Return the names of the groups of the user. They are loaded once and kept
+    in the user instance, that lives as long as the request (request.user),
+    so views and templates check the user groups without repeating queries.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, '_group_names'):
+        user._group_names = frozenset(
+            user.groups.values_list('name', flat=True)
+        )
+
+    return user._group_names
+
+
+def is_trustee(user):
+    return 'trustees' in get_group_names(user)
@@ -1,3 +1,8 @@
+import json
+import threading
+from contextlib import contextmanager
+
+from django.core.exceptions import ObjectDoesNotExist
 from haystack import indexes
 
 from experiments.models import Experiment, Study, Group, \
@@ -7,23 +12,192 @@ from experiments.models import Experiment, Study, Group, \
     ContextTree, EEGElectrodeNet, EEGSolution, EEGFilterSetting, \
     EEGElectrodeLocalizationSystem, EMGDigitalFilterSetting, Stimulus, \
     GenericDataCollection, EMGElectrodePlacementSetting, EMGElectrodeSetting, \
-    EEGElectrodePosition, Instruction, ExperimentResearcher
+    EEGElectrodePosition, Instruction, ExperimentResearcher, Participant
+
+
+_experiment_data = threading.local()
+
+
+@contextmanager
+def experiment_data_memo():
+    """Within the context, get_experiment_data queries the data of each
+    experiment only once, for all its indexed objects. Use it around an
+    indexing run, so the data doesn't change while it's kept.
+    """
+    _experiment_data.memo = {}
+    try:
+        yield
+    finally:
+        del _experiment_data.memo
+
+
+def get_experiment_data(experiment):
+    """Return the data of the experiment stored in the documents of its
+    objects, to display the search results
+    :param experiment: Experiment model instance
+    """
+    memo = getattr(_experiment_data, 'memo', None)
+    if memo is not None:
+        if experiment.id not in memo:
+            memo[experiment.id] = _query_experiment_data(experiment)
+        return memo[experiment.id]
+
+    return _query_experiment_data(experiment)
+
+
+def _query_experiment_data(experiment):
+    steps = Step.objects.filter(group__experiment=experiment)
+    return {
+        'experiment_id': experiment.id,
+        'experiment_slug': experiment.slug,
+        'experiment_title': experiment.title,
+        'participants_count': Participant.objects.filter(
+            group__experiment=experiment
+        ).count(),
+        'step_types': sorted(set(steps.values_list('type', flat=True))),
+    }
+
+
+def get_display_data(obj, lookups):
+    """Return the values of the object displayed in its search result, as a
+    dict nested like the lookups, so templates render them from the index
+    (result.display.<lookup>) without fetching the object.
+    :param obj: indexed object
+    :param lookups: attributes of the object, or of its related objects
+    separated by '.', like in templates. Related managers give lists.
+    """
+    data = {}
+    for lookup in lookups:
+        _set_display_value(data, obj, lookup.split('.'))
+    return data
+
+
+def _set_display_value(data, obj, attrs):
+    name = attrs[0]
+    try:
+        value = getattr(obj, name)
+    except ObjectDoesNotExist:
+        value = None
+    if hasattr(value, 'all'):
+        # related manager
+        items = list(value.all().order_by('pk'))
+        if len(attrs) == 1:
+            data[name] = [str(item) for item in items]
+        else:
+            items_data = data.setdefault(name, [{} for item in items])
+            for item, item_data in zip(items, items_data):
+                _set_display_value(item_data, item, attrs[1:])
+        return
+    if callable(value):
+        value = value()
+    if len(attrs) == 1:
+        data[name] = value \
+            if value is None or isinstance(value, (bool, int, float, str)) \
+            else str(value)
+    elif value is None:
+        data[name] = None
+    else:
+        _set_display_value(data.setdefault(name, {}), value, attrs[1:])
+
+
+class DisplayField(indexes.CharField):
+    """Stored, not indexed, field with the data displayed in the search
+    result of the object (see get_display_data), kept as json.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('indexed', False)
+        super(DisplayField, self).__init__(**kwargs)
+
+    def convert(self, value):
+        if value is None:
+            return {}
+        return json.loads(value)
+
+
+class ExperimentRelatedIndex(indexes.SearchIndex):
+    """Index of the objects of the last approved versions of the
+    experiments. The objects of one experiment are selected by
+    experiment_queryset, so they can be indexed without rebuilding the
+    whole index (see tasks.update_experiment_index).
+    The documents store data of the experiment of the objects, and the
+    data displayed in the results (display_lookups), so the search results
+    are grouped by experiment and rendered without fetching the objects.
+    """
+    # Lookup of the experiment from the indexed object, like model_attr.
+    # None for the experiments and for objects shared by experiments.
+    experiment_lookup = 'experiment'
+    experiment_id = indexes.IntegerField(null=True)
+    experiment_slug = indexes.CharField(null=True, indexed=False)
+    experiment_title = indexes.CharField(null=True, indexed=False)
+    participants_count = indexes.IntegerField(null=True, indexed=False)
+    # types of the steps of the experiment groups, to filter the searches
+    # by data collection type (see NepSearchForm.search)
+    step_types = indexes.MultiValueField(null=True)
+    # Attributes of the object displayed in templates/search/<model>.html
+    display_lookups = []
+    display = DisplayField()
+
+    def prepare(self, obj):
+        prepared_data = super(ExperimentRelatedIndex, self).prepare(obj)
+        experiment = self.get_experiment(obj)
+        if experiment:
+            prepared_data.update(get_experiment_data(experiment))
+        return prepared_data
+
+    def prepare_display(self, obj):
+        return json.dumps(get_display_data(obj, self.display_lookups))
+
+    def get_experiment(self, obj):
+        if self.experiment_lookup is None:
+            return None
+        for attr in self.experiment_lookup.split('__'):
+            obj = getattr(obj, attr)
+        return obj
 
+    def index_queryset(self, using=None):
+        return self.get_experiment_objects(
+            Experiment.lastversion_objects.approved()
+        )
 
-class ExperimentIndex(indexes.SearchIndex, indexes.Indexable):
+    def get_experiment_objects(self, experiments):
+        """Return experiment_queryset(experiments), fetching the experiment
+        of each object in the same query
+        """
+        queryset = self.experiment_queryset(experiments)
+        if self.experiment_lookup is not None:
+            queryset = queryset.select_related(self.experiment_lookup)
+        return queryset
+
+    def experiment_queryset(self, experiments):
+        """Return the objects of the experiments to be indexed
+        :param experiments: Experiment queryset
+        """
+        raise NotImplementedError
+
+
+class ExperimentIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = None
+    display_lookups = ['description', 'sent_date']
     text = indexes.CharField(document=True, use_template=True)
     owner = indexes.CharField(model_attr='owner')
 
     def get_model(self):
         return Experiment
 
-    def index_queryset(self, using=None):
-        return self.get_model().lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
+        return experiments
+
+    def get_experiment(self, obj):
+        return obj
 
 
-class StudyIndex(indexes.SearchIndex, indexes.Indexable):
+class StudyIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = [
+        'description', 'end_date', 'keywords', 'researcher', 'start_date',
+        'title'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
     keywords = indexes.CharField(model_attr='keywords__name')
@@ -34,14 +208,12 @@ class StudyIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return Study
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class GroupIndex(indexes.SearchIndex, indexes.Indexable):
+class GroupIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = ['description', 'inclusion_criteria', 'title']
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
     inclusion_criteria = indexes.CharField(model_attr='inclusion_criteria__id')
@@ -49,111 +221,144 @@ class GroupIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return Group
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class PublicationIndex(indexes.SearchIndex, indexes.Indexable):
+class PublicationIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = ['citation', 'title', 'url']
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
 
     def get_model(self):
         return Publication
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class ExperimentResearcherIndex(indexes.SearchIndex, indexes.Indexable):
+class ExperimentResearcherIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = ['email', 'first_name', 'institution', 'last_name']
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
 
     def get_model(self):
         return ExperimentResearcher
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class ExperimentalProtocolIndex(indexes.SearchIndex, indexes.Indexable):
+class ExperimentalProtocolIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = 'group__experiment'
+    display_lookups = ['group.title', 'textual_description']
     text = indexes.CharField(document=True, use_template=True)
     group = indexes.CharField(model_attr='group__id')
 
     def get_model(self):
         return ExperimentalProtocol
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         groups = Group.objects.filter(experiment__in=experiments)
         return self.get_model().objects.filter(group__in=groups)
 
 
-class StepIndex(indexes.SearchIndex, indexes.Indexable):
+class StepIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = 'group__experiment'
+    display_lookups = [
+        'description', 'duration_unit', 'duration_value', 'group.title',
+        'identification', 'interval_between_repetitions_unit',
+        'interval_between_repetitions_value', 'number_of_repetitions',
+        'numeration', 'order', 'random_position', 'type'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     group = indexes.CharField(model_attr='group__id')
 
     def get_model(self):
         return Step
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         groups = Group.objects.filter(experiment__in=experiments)
         return self.get_model().objects.filter(group__in=groups)
 
 
 class GoalkeeperGameIndex(StepIndex):
+    display_lookups = [
+        'context_tree.setting_text', 'description', 'group.title',
+        'identification', 'software_description', 'software_name',
+        'software_version'
+    ]
 
     def get_model(self):
         return GoalkeeperGame
 
 
 class StimulusIndex(StepIndex):
+    display_lookups = [
+        'description', 'group.title', 'identification', 'stimulus_type_name'
+    ]
 
     def get_model(self):
         return Stimulus
 
 
 class InstructionIndex(StepIndex):
+    display_lookups = [
+        'description', 'duration_unit', 'duration_value', 'group.title',
+        'identification', 'interval_between_repetitions_unit',
+        'interval_between_repetitions_value', 'number_of_repetitions',
+        'numeration', 'order', 'random_position', 'text'
+    ]
 
     def get_model(self):
         return Instruction
 
 
 class GenericDataCollectionIndex(StepIndex):
+    display_lookups = [
+        'description', 'group.title', 'identification',
+        'information_type_description', 'information_type_name'
+    ]
 
     def get_model(self):
         return GenericDataCollection
 
 
-class ContextTreeIndex(indexes.SearchIndex, indexes.Indexable):
+class ContextTreeIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = ['description', 'name', 'setting_text']
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
 
     def get_model(self):
         return ContextTree
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class EMGElectrodePlacementSettingIndex(indexes.SearchIndex,
+class EMGElectrodePlacementSettingIndex(ExperimentRelatedIndex,
                                         indexes.Indexable):
+    experiment_lookup = 'emg_electrode_setting__emg_setting__experiment'
+    display_lookups = [
+        'emg_electrode_placement.emgintramuscularplacement.depth_of_insertion',
+        'emg_electrode_placement.emgintramuscularplacement.'
+        'method_of_insertion',
+        'emg_electrode_placement.emgneedleplacement.depth_of_insertion',
+        'emg_electrode_placement.emgsurfaceplacement.clinical_test',
+        'emg_electrode_placement.emgsurfaceplacement.fixation_on_the_skin',
+        'emg_electrode_placement.emgsurfaceplacement.orientation',
+        'emg_electrode_placement.emgsurfaceplacement.reference_electrode',
+        'emg_electrode_placement.emgsurfaceplacement.start_posture',
+        'emg_electrode_placement.location',
+        'emg_electrode_placement.muscle_anatomy_function',
+        'emg_electrode_placement.muscle_anatomy_insertion',
+        'emg_electrode_placement.muscle_anatomy_origin',
+        'emg_electrode_placement.placement_type',
+        'emg_electrode_placement.standardization_system_description',
+        'emg_electrode_placement.standardization_system_name',
+        'emg_electrode_setting.electrode_model.name',
+        'emg_electrode_setting.emg_setting.name', 'muscle_name', 'muscle_side'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     emg_electrode_setting = indexes.CharField(
         model_attr='emg_electrode_setting__id'
@@ -165,10 +370,7 @@ class EMGElectrodePlacementSettingIndex(indexes.SearchIndex,
     def get_model(self):
         return EMGElectrodePlacementSetting
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         emg_settings = EMGSetting.objects.filter(experiment__in=experiments)
         emg_electrode_settings = EMGElectrodeSetting.objects.filter(
             emg_setting__in=emg_settings
@@ -178,7 +380,28 @@ class EMGElectrodePlacementSettingIndex(indexes.SearchIndex,
         )
 
 
-class EEGElectrodePositionIndex(indexes.SearchIndex, indexes.Indexable):
+class EEGElectrodePositionIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = \
+        'eeg_electrode_localization_system__eeg_setting__experiment'
+    display_lookups = [
+        'coordinate_x', 'coordinate_y',
+        'eeg_electrode_localization_system.eeg_setting.name',
+        'eeg_electrode_localization_system.name',
+        'electrode_model.description',
+        'electrode_model.electrode_configuration_name',
+        'electrode_model.electrode_type',
+        'electrode_model.intramuscularelectrode.'
+        'insulation_material_description',
+        'electrode_model.intramuscularelectrode.insulation_material_name',
+        'electrode_model.intramuscularelectrode.strand',
+        'electrode_model.material', 'electrode_model.name',
+        'electrode_model.surfaceelectrode.conduction_type',
+        'electrode_model.surfaceelectrode.electrode_mode',
+        'electrode_model.surfaceelectrode.electrode_shape_measure_unit',
+        'electrode_model.surfaceelectrode.electrode_shape_measure_value',
+        'electrode_model.surfaceelectrode.electrode_shape_name',
+        'electrode_model.usability', 'name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     eeg_electrode_localization_system = indexes.CharField(
         model_attr='eeg_electrode_localization_system__eeg_setting'
@@ -188,10 +411,7 @@ class EEGElectrodePositionIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return EEGElectrodePosition
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         eeg_settings = EEGSetting.objects.filter(experiment__in=experiments)
         eeg_electrode_localization_systems = \
             EEGElectrodeLocalizationSystem.objects.filter(
@@ -203,36 +423,42 @@ class EEGElectrodePositionIndex(indexes.SearchIndex, indexes.Indexable):
         )
 
 
-class TMSSettingIndex(indexes.SearchIndex, indexes.Indexable):
+class TMSSettingIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = [
+        'description', 'name', 'tms_device_setting.pulse_stimulus_type'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
 
     def get_model(self):
         return TMSSetting
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class TMSDeviceSettingIndex(indexes.SearchIndex, indexes.Indexable):
+class TMSDeviceSettingIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = 'tms_setting__experiment'
+    display_lookups = ['get_pulse_stimulus_type_display', 'tms_setting.name']
     text = indexes.CharField(document=True, use_template=True)
     tms_setting = indexes.CharField(model_attr='tms_setting__id')
 
     def get_model(self):
         return TMSDeviceSetting
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         tms_settings = TMSSetting.objects.filter(experiment__in=experiments)
         return self.get_model().objects.filter(tms_setting__in=tms_settings)
 
 
-class TMSDeviceIndex(indexes.SearchIndex, indexes.Indexable):
+class TMSDeviceIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = None
+    display_lookups = [
+        'description', 'equipment_type', 'identification', 'manufacturer_name',
+        'pulse_type', 'tms_device_settings.tms_setting.experiment.slug',
+        'tms_device_settings.tms_setting.experiment.title',
+        'tms_device_settings.tms_setting.name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     tms_device_settings = indexes.CharField(
         model_attr='tms_device_settings__tms_setting'
@@ -241,10 +467,7 @@ class TMSDeviceIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return TMSDevice
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         tms_settings = TMSSetting.objects.filter(experiment__in=experiments)
         tms_device_settings = TMSDeviceSetting.objects.filter(
             tms_setting__in=tms_settings
@@ -254,7 +477,15 @@ class TMSDeviceIndex(indexes.SearchIndex, indexes.Indexable):
         ).distinct()
 
 
-class CoilModelIndex(indexes.SearchIndex, indexes.Indexable):
+class CoilModelIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = None
+    display_lookups = [
+        'coil_design', 'coil_shape_name', 'description',
+        'material_description', 'material_name', 'name',
+        'tms_device_settings.tms_setting.experiment.slug',
+        'tms_device_settings.tms_setting.experiment.title',
+        'tms_device_settings.tms_setting.name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     tms_device_settings = indexes.CharField(
         model_attr='tms_device_settings__tms_setting'
@@ -263,10 +494,7 @@ class CoilModelIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return CoilModel
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         tms_settings = TMSSetting.objects.filter(experiment__in=experiments)
         tms_device_settings = TMSDeviceSetting.objects.filter(
             tms_setting__in=tms_settings
@@ -276,109 +504,123 @@ class CoilModelIndex(indexes.SearchIndex, indexes.Indexable):
         ).distinct()
 
 
-class TMSDataIndex(indexes.SearchIndex, indexes.Indexable):
+class TMSDataIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = 'tms_setting__experiment'
+    display_lookups = [
+        'brain_area_name', 'brain_area_system_description',
+        'brain_area_system_name', 'description', 'hotspot_name',
+        'localization_system_description', 'localization_system_name',
+        'tms_setting.name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     tms_setting = indexes.CharField(model_attr='tms_setting__id')
 
     def get_model(self):
         return TMSData
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         tms_settings = TMSSetting.objects.filter(experiment__in=experiments)
         return self.get_model().objects.filter(
             tms_setting__in=tms_settings
         )
 
 
-class EEGSettingIndex(indexes.SearchIndex, indexes.Indexable):
+class EEGSettingIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = ['description', 'name']
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
 
     def get_model(self):
         return EEGSetting
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class EEGElectrodeNetIndex(indexes.SearchIndex, indexes.Indexable):
+class EEGElectrodeNetIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = 'eeg_setting__experiment'
+    display_lookups = [
+        'description', 'eeg_setting.name', 'identification',
+        'manufacturer_name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     eeg_setting = indexes.CharField(model_attr='eeg_setting__id')
 
     def get_model(self):
         return EEGElectrodeNet
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         eeg_settings = EEGSetting.objects.filter(experiment__in=experiments)
         return self.get_model().objects.filter(eeg_setting__in=eeg_settings)
 
 
 class EEGSolutionIndex(EEGElectrodeNetIndex):
+    display_lookups = [
+        'components', 'eeg_setting.name', 'manufacturer_name', 'name'
+    ]
 
     def get_model(self):
         return EEGSolution
 
 
 class EEGFilterSettingIndex(EEGElectrodeNetIndex):
+    display_lookups = [
+        'eeg_filter_type_description', 'eeg_filter_type_name',
+        'eeg_setting.name'
+    ]
 
     def get_model(self):
         return EEGFilterSetting
 
 
 class EEGElectrodeLocalizationSystemIndex(EEGElectrodeNetIndex):
+    display_lookups = ['description', 'eeg_setting.name', 'name']
 
     def get_model(self):
         return EEGElectrodeLocalizationSystem
 
 
-class EMGSettingIndex(indexes.SearchIndex, indexes.Indexable):
+class EMGSettingIndex(ExperimentRelatedIndex, indexes.Indexable):
+    display_lookups = ['acquisition_software_version', 'description', 'name']
     text = indexes.CharField(document=True, use_template=True)
     experiment = indexes.CharField(model_attr='experiment__id')
 
     def get_model(self):
         return EMGSetting
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         return self.get_model().objects.filter(experiment__in=experiments)
 
 
-class EMGDigitalFilterSettingIndex(indexes.SearchIndex, indexes.Indexable):
+class EMGDigitalFilterSettingIndex(ExperimentRelatedIndex,
+                                   indexes.Indexable):
+    experiment_lookup = 'emg_setting__experiment'
+    display_lookups = [
+        'emg_setting.name', 'filter_type_description', 'filter_type_name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
     emg_setting = indexes.CharField(model_attr='emg_setting__id')
 
     def get_model(self):
         return EMGDigitalFilterSetting
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         emg_settings = EMGSetting.objects.filter(experiment__in=experiments)
         return self.get_model().objects.filter(emg_setting__in=emg_settings)
 
 
-class QuestionnaireLanguageIndex(indexes.SearchIndex, indexes.Indexable):
+class QuestionnaireLanguageIndex(ExperimentRelatedIndex, indexes.Indexable):
+    experiment_lookup = 'questionnaire__group__experiment'
+    display_lookups = [
+        'questionnaire.group.title', 'questionnaire.identification',
+        'survey_metadata', 'survey_name'
+    ]
     text = indexes.CharField(document=True, use_template=True)
 
     def get_model(self):
         return QuestionnaireLanguage
 
-    def index_queryset(self, using=None):
-        experiments = Experiment.lastversion_objects.filter(
-            status=Experiment.APPROVED
-        )
+    def experiment_queryset(self, experiments):
         groups = Group.objects.filter(experiment__in=experiments)
         steps = Step.objects.filter(
             group__in=groups
@@ -0,0 +1,182 @@
+import glob
+import os
+import shutil
+
+import elasticsearch
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+
+from experiments.search_indexes import experiment_data_memo
+
+
+class VersionedIndex:
+    """
+    Versions of the search index of a haystack connection. The connection
+    settings (INDEX_NAME or PATH) refer to the current version, so the
+    index can be rebuilt in a new version while the current one is still
+    searched, and the new version replaces it at once.
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        self.options = settings.HAYSTACK_CONNECTIONS[using]
+        self.name = None
+
+    def new_version(self):
+        return '%s_%s' % (
+            self.name, timezone.now().strftime('%Y%m%d%H%M%S%f')
+        )
+
+    def get_options(self, version):
+        """Return the connection options to build the version of the index
+        """
+        raise NotImplementedError
+
+    def get_versions(self):
+        """Return the names of the versions of the index, oldest first"""
+        raise NotImplementedError
+
+    def get_current_version(self):
+        raise NotImplementedError
+
+    def swap(self, version):
+        """Make version the current version of the index"""
+        raise NotImplementedError
+
+    def delete(self, version):
+        raise NotImplementedError
+
+    def collect_garbage(self, keep=1):
+        """Delete the old versions of the index, but the current one and
+        the last keep versions
+        """
+        current_version = self.get_current_version()
+        old_versions = [
+            version for version in self.get_versions()
+            if version != current_version
+        ]
+        for version in old_versions[:max(len(old_versions) - keep, 0)]:
+            self.delete(version)
+
+
+class ElasticsearchVersionedIndex(VersionedIndex):
+    """Versions are indexes named <INDEX_NAME>_<version>, and INDEX_NAME is
+    an alias to the current one
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        super(ElasticsearchVersionedIndex, self).__init__(using)
+        self.name = self.options['INDEX_NAME']
+        self.conn = elasticsearch.Elasticsearch(
+            self.options['URL'], **self.options.get('KWARGS', {})
+        )
+
+    def get_options(self, version):
+        return dict(self.options, INDEX_NAME=version)
+
+    def get_versions(self):
+        return sorted(self.conn.indices.get(
+            index=self.name + '_*', ignore_unavailable=True
+        ))
+
+    def get_current_version(self):
+        if not self.conn.indices.exists_alias(name=self.name):
+            return None
+        return next(iter(self.conn.indices.get_alias(name=self.name)))
+
+    def swap(self, version):
+        actions = [{'add': {'index': version, 'alias': self.name}}]
+        current_version = self.get_current_version()
+        if current_version:
+            actions.insert(
+                0, {'remove': {'index': current_version, 'alias': self.name}}
+            )
+        elif self.conn.indices.exists(index=self.name):
+            # index of rebuilds made before the versions, that has the alias
+            # name. It's searched until the alias is created.
+            self.conn.indices.delete(index=self.name)
+        self.conn.indices.update_aliases(body={'actions': actions})
+
+    def delete(self, version):
+        self.conn.indices.delete(index=version)
+
+
+class WhooshVersionedIndex(VersionedIndex):
+    """Versions are directories named <PATH>_<version>, and PATH is a
+    symbolic link to the current one
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        super(WhooshVersionedIndex, self).__init__(using)
+        self.name = os.path.normpath(self.options['PATH'])
+
+    def get_options(self, version):
+        return dict(self.options, PATH=version)
+
+    def get_versions(self):
+        return sorted(glob.glob(glob.escape(self.name) + '_*'))
+
+    def get_current_version(self):
+        if not os.path.islink(self.name):
+            return None
+        return os.path.realpath(self.name)
+
+    def swap(self, version):
+        link = self.name + '.swap'
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.abspath(version), link)
+        if os.path.isdir(self.name) and not os.path.islink(self.name):
+            # index of rebuilds made before the versions
+            shutil.rmtree(self.name)
+        # rename is atomic, so the link is replaced at once
+        os.replace(link, self.name)
+
+    def delete(self, version):
+        shutil.rmtree(version)
+
+
+VERSIONED_INDEXES = {
+    'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine':
+        ElasticsearchVersionedIndex,
+    'haystack.backends.whoosh_backend.WhooshEngine': WhooshVersionedIndex,
+}
+
+
+def get_versioned_index(using=DEFAULT_ALIAS):
+    engine = settings.HAYSTACK_CONNECTIONS[using]['ENGINE']
+    if engine not in VERSIONED_INDEXES:
+        raise ImproperlyConfigured(
+            'Search engine %s does not support versioned indexes' % engine
+        )
+
+    return VERSIONED_INDEXES[engine](using)
+
+
+def rebuild_index_blue_green(using=DEFAULT_ALIAS, keep=1, batch_size=1000):
+    """
+    Build the search index in a new version, while the current version
+    keeps being searched and updated, then make the new version the current
+    one and delete the old versions, but the last keep ones.
+    Objects indexed by update_experiment_index while the new version is
+    built may be missing in it.
+    :return: the name of the new version
+    """
+    versioned_index = get_versioned_index(using)
+    version = versioned_index.new_version()
+    backend = connections[using].backend(
+        using, **dict(versioned_index.get_options(version), SILENTLY_FAIL=False)
+    )
+    unified_index = connections[using].get_unified_index()
+    with experiment_data_memo():
+        for index in unified_index.get_indexes().values():
+            queryset = index.build_queryset(using=using).order_by('pk')
+            for start in range(0, queryset.count(), batch_size):
+                backend.update(index, queryset[start:start + batch_size])
+
+    versioned_index.swap(version)
+    versioned_index.collect_garbage(keep)
+
+    return version
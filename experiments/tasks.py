@@ -1,14 +1,182 @@
 from __future__ import absolute_import, unicode_literals
+import threading
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+
 from nep.celery import app
 from django.core.management import call_command
 from downloads import views
+from downloads.models import Export
+from experiments.models import Experiment
+from experiments.search_indexes import experiment_data_memo
+from experiments.search_rebuild import rebuild_index_blue_green
+
+# While a build runs, the updated time of its Export and of the builds
+# queued waiting for it is refreshed at this interval. Builds not refreshed
+# for BUILD_DOWNLOAD_FILE_TIMEOUT are considered lost (worker killed, etc.),
+# and don't prevent a new build.
+BUILD_DOWNLOAD_FILE_HEARTBEAT = timedelta(minutes=1)
+BUILD_DOWNLOAD_FILE_TIMEOUT = timedelta(minutes=10)
 
 
 @app.task()
 def rebuild_haystack_index():
-    call_command('rebuild_index', verbosity=0, interactive=False)
+    try:
+        # searches keep being answered by the current index while the new
+        # one is built
+        rebuild_index_blue_green()
+    except ImproperlyConfigured:
+        with experiment_data_memo():
+            call_command('rebuild_index', verbosity=0, interactive=False)
 
 
 @app.task()
-def build_download_file(experiment_id, template_name):
-    views.download_create(experiment_id, template_name)
+def update_experiment_index(experiment_id):
+    """Index the objects of the last approved version of the experiment,
+    and remove the documents of the objects of its other versions, without
+    rebuilding the whole index. Objects shared with other indexed
+    experiments (TMS devices, coil models) are kept.
+    :param experiment_id: id of the approved experiment
+    """
+    experiment = Experiment.objects.get(pk=experiment_id)
+    versions = Experiment.objects.filter(
+        owner_id=experiment.owner_id, nes_id=experiment.nes_id
+    )
+    last_approved = versions.filter(is_latest_approved=True)
+    other_versions = versions.filter(is_latest_approved=False)
+
+    backend = connections[DEFAULT_ALIAS].get_backend()
+    unified_index = connections[DEFAULT_ALIAS].get_unified_index()
+    with experiment_data_memo():
+        for index in unified_index.get_indexes().values():
+            objects = list(index.get_experiment_objects(last_approved))
+            if objects:
+                backend.update(index, objects)
+            for instance in index.experiment_queryset(
+                    other_versions
+            ).exclude(pk__in=index.index_queryset().values('pk')):
+                index.remove_object(instance)
+
+
+@app.task(bind=True, max_retries=2, default_retry_delay=60)
+def build_download_file(self, experiment_id, template_name, export_id=None):
+    if export_id is None:
+        export_instance = views.create_export_instance(experiment_id)
+    else:
+        export_instance = Export.objects.get(pk=export_id)
+
+    with transaction.atomic():
+        Experiment.objects.select_for_update().get(pk=experiment_id)
+        if _get_builds(experiment_id).filter(status=Export.RUNNING).exclude(
+                pk=export_instance.pk
+        ).exists():
+            # builds of an experiment write the same files, so this one
+            # waits for the running one, that queues it when it's done
+            export_instance.set_progress(0, Export.QUEUED)
+            return ""
+        export_instance.set_progress(0)
+
+    heartbeat = BuildHeartbeat(export_instance)
+    heartbeat.start()
+    try:
+        error_msg = views.download_create(
+            experiment_id, template_name, export_instance
+        )
+    finally:
+        heartbeat.stop()
+    if error_msg != "" and self.request.retries < self.max_retries:
+        export_instance.set_progress(0, Export.QUEUED)
+        raise self.retry(
+            args=(experiment_id, template_name, export_instance.id)
+        )
+    _queue_waiting_build(export_instance)
+
+    return error_msg
+
+
+class BuildHeartbeat(threading.Thread):
+    """Thread that refreshes the updated time of the Export of a running
+    build, and of the builds queued waiting for it, so they are not
+    considered lost however long the stages of the build take.
+    """
+
+    def __init__(self, export_instance):
+        super(BuildHeartbeat, self).__init__(daemon=True)
+        self.export_instance = export_instance
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(
+                    BUILD_DOWNLOAD_FILE_HEARTBEAT.total_seconds()
+            ):
+                Export.objects.filter(
+                    Q(pk=self.export_instance.pk) |
+                    Q(experiment_id=self.export_instance.experiment_id,
+                      status=Export.QUEUED)
+                ).update(updated=timezone.now())
+        finally:
+            # the thread has its own database connection
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _get_builds(experiment_id):
+    """Return the builds of experiment download files queued or running,
+    but the lost ones
+    """
+    return Export.objects.filter(
+        experiment_id=experiment_id,
+        status__in=[Export.QUEUED, Export.RUNNING],
+        updated__gte=timezone.now() - BUILD_DOWNLOAD_FILE_TIMEOUT
+    )
+
+
+def _queue_waiting_build(export_instance):
+    """Queue the build that waits for the one just done (see
+    queue_build_download_file). Builds queued after it was done are already
+    queued.
+    :param export_instance: Export instance of the build done
+    """
+    experiment_id = export_instance.experiment_id
+    with transaction.atomic():
+        Experiment.objects.select_for_update().get(pk=experiment_id)
+        waiting_instance = _get_builds(experiment_id).filter(
+            status=Export.QUEUED, date__lte=export_instance.updated
+        ).exclude(pk=export_instance.pk).first()
+    if waiting_instance:
+        build_download_file.delay(experiment_id, "", waiting_instance.id)
+
+
+def queue_build_download_file(experiment_id):
+    """Queue the build of experiment download files, unless there's a build
+    of them already queued. If a build is running, it was started before
+    the experiment changed, so other build is queued when it's done.
+    :param experiment_id: experiment id
+    :return: Export instance of the build
+    """
+    with transaction.atomic():
+        # lock experiment so concurrent requests don't queue two builds
+        Experiment.objects.select_for_update().get(pk=experiment_id)
+        builds = _get_builds(experiment_id)
+        export_instance = builds.filter(status=Export.QUEUED).first()
+        if export_instance:
+            return export_instance
+        export_instance = views.create_export_instance(experiment_id)
+        if builds.filter(status=Export.RUNNING).exists():
+            # builds of an experiment write the same files, so this one
+            # waits for the running one
+            return export_instance
+
+    build_download_file.delay(experiment_id, "", export_instance.id)
+
+    return export_instance
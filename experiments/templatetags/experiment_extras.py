@@ -1,8 +1,8 @@
 from django import template
-from django.contrib.auth.models import Group
 import json
 
 from experiments.models import Experiment
+from experiments.permissions import get_group_names
 from django.utils.translation import ugettext as _
 
 
@@ -11,8 +11,7 @@ register = template.Library()
 
 @register.filter(name='has_group')
 def has_group(user, group_name):
-    group = Group.objects.get(name=group_name)
-    return True if group in user.groups.all() else False
+    return group_name in get_group_names(user)
 
 
 @register.filter(name='statuses_to_json')
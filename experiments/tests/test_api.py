@@ -2,6 +2,7 @@ import json
 import tempfile
 from datetime import datetime
 from unittest import skip
+from unittest.mock import patch
 
 import os
 
@@ -9,14 +10,18 @@ import shutil
 from django.contrib.auth.models import User
 from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.encoding import smart_str
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from downloads.models import Export
 from experiments import api
 from experiments.api import ExperimentSerializer, \
     ExperimentResearcherSerializer
 from experiments.helpers import generate_image_file
+from experiments.tasks import build_download_file, BuildHeartbeat, \
+    BUILD_DOWNLOAD_FILE_TIMEOUT, _get_builds
 from experiments.models import Experiment, Study, Group, Researcher, \
     ClassificationOfDiseases, Questionnaire, Step, \
     QuestionnaireLanguage, QuestionnaireDefaultLanguage, Publication, \
@@ -265,6 +270,124 @@ class ExperimentAPITest(APITestCase):
 
         shutil.rmtree(TEMP_MEDIA_ROOT)
 
+    @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+    def test_PATCHing_experiment_records_download_file_build_done(self):
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'download'))
+        license_file = os.path.join(TEMP_MEDIA_ROOT, 'download', 'LICENSE.txt')
+        with open(license_file, 'w') as file:
+            file.write('license')
+
+        self.client.login(username=self.owner.username, password=PASSWORD)
+        detail_url = reverse(
+            'api_experiments-detail',
+            kwargs={'experiment_nes_id': self.experiment1.nes_id}
+        )
+        self.client.patch(detail_url, {'status': Experiment.TO_BE_ANALYSED})
+        self.client.logout()
+
+        export = Export.objects.get(experiment=self.experiment1)
+        self.assertEqual(export.status, Export.DONE)
+        self.assertEqual(export.progress, 100)
+
+        shutil.rmtree(TEMP_MEDIA_ROOT)
+
+    def test_PATCHing_experiment_with_build_queued_does_not_queue_other(self):
+        export = Export.objects.create(
+            experiment=self.experiment1, status=Export.QUEUED
+        )
+
+        self.client.login(username=self.owner.username, password=PASSWORD)
+        detail_url = reverse(
+            'api_experiments-detail',
+            kwargs={'experiment_nes_id': self.experiment1.nes_id}
+        )
+        with patch('experiments.tasks.build_download_file.delay') as delay:
+            self.client.patch(
+                detail_url, {'status': Experiment.TO_BE_ANALYSED}
+            )
+        self.client.logout()
+
+        self.assertEqual(
+            [export], list(Export.objects.filter(experiment=self.experiment1))
+        )
+        delay.assert_not_called()
+
+    def test_PATCHing_experiment_with_build_running_queues_other_after_it(self):
+        export = Export.objects.create(
+            experiment=self.experiment1, status=Export.RUNNING
+        )
+
+        self.client.login(username=self.owner.username, password=PASSWORD)
+        detail_url = reverse(
+            'api_experiments-detail',
+            kwargs={'experiment_nes_id': self.experiment1.nes_id}
+        )
+        with patch('experiments.tasks.build_download_file.delay') as delay:
+            self.client.patch(
+                detail_url, {'status': Experiment.TO_BE_ANALYSED}
+            )
+        self.client.logout()
+
+        # the build waits for the running one
+        waiting_export = Export.objects.filter(
+            experiment=self.experiment1
+        ).exclude(pk=export.pk).get()
+        self.assertEqual(waiting_export.status, Export.QUEUED)
+        delay.assert_not_called()
+
+        # and it's queued when the running one is done
+        def download_create(experiment_id, template_name, export_instance):
+            export_instance.set_progress(100, Export.DONE)
+            return ''
+
+        with patch('experiments.tasks.views.download_create',
+                   side_effect=download_create), \
+                patch('experiments.tasks.build_download_file.delay') as delay:
+            build_download_file(self.experiment1.id, '', export.id)
+        delay.assert_called_once_with(
+            self.experiment1.id, '', waiting_export.id
+        )
+
+    def test_build_started_with_other_build_running_waits_for_it(self):
+        Export.objects.create(
+            experiment=self.experiment1, status=Export.RUNNING
+        )
+        export = Export.objects.create(
+            experiment=self.experiment1, status=Export.QUEUED
+        )
+
+        with patch('experiments.tasks.views.download_create') as \
+                download_create:
+            build_download_file(self.experiment1.id, '', export.id)
+
+        download_create.assert_not_called()
+        export.refresh_from_db()
+        self.assertEqual(export.status, Export.QUEUED)
+
+    def test_running_build_keeps_waiting_builds_from_being_lost(self):
+        export = Export.objects.create(
+            experiment=self.experiment1, status=Export.RUNNING
+        )
+        waiting_export = Export.objects.create(
+            experiment=self.experiment1, status=Export.QUEUED
+        )
+        old = timezone.now() - BUILD_DOWNLOAD_FILE_TIMEOUT * 2
+        Export.objects.filter(
+            pk__in=[export.pk, waiting_export.pk]
+        ).update(updated=old)
+
+        heartbeat = BuildHeartbeat(export)
+        # one beat, run in this thread, that sees the test transaction
+        with patch.object(heartbeat.stopped, 'wait',
+                          side_effect=[False, True]), \
+                patch('experiments.tasks.connection'):
+            heartbeat.run()
+
+        self.assertEqual(
+            {export.pk, waiting_export.pk},
+            set(_get_builds(self.experiment1.id).values_list('pk', flat=True))
+        )
+
 
 class StudyAPITest(APITestCase):
 
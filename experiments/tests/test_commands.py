@@ -6,12 +6,12 @@ from random import choice
 import os
 from unittest.mock import patch
 
-from django.core.management import call_command, BaseCommand
+from django.core.management import call_command, BaseCommand, CommandError
 from django.test import TestCase, override_settings
 from django.utils.six import StringIO
 
 from experiments.models import Gender, Study, Group, EEGSetting, \
-    ExperimentalProtocol, EEGData, Experiment, EEG
+    ExperimentalProtocol, EEGData, Experiment, EEG, get_to_be_analysed_count
 from experiments.tests.tests_helper import create_experiment, create_study, \
     create_group, create_participant, create_experimental_protocol, \
     create_eeg_setting, create_eeg_data, \
@@ -364,3 +364,62 @@ class CommandsTest(TestCase):
             'recovered. Are you sure? (Yes/n) ' % experiment.title))
         self.assertTrue(Experiment.objects.exists())
         self.assertIn('Aborted', out.getvalue())
+
+
+class UpdateLastVersionsCommandTest(TestCase):
+
+    def setUp(self):
+        experiment = create_experiment(1, status=Experiment.APPROVED)
+        self.v2 = create_next_version_experiment(experiment)
+        self.v3 = create_next_version_experiment(self.v2)
+        self.v3.status = Experiment.TO_BE_ANALYSED
+        self.v3.save()
+
+    def test_saving_experiments_sets_last_version_flags(self):
+        self.assertEqual(
+            [self.v3], list(Experiment.objects.filter(is_latest=True))
+        )
+        self.assertEqual(
+            [self.v2],
+            list(Experiment.objects.filter(is_latest_approved=True))
+        )
+
+        self.v3.delete()
+
+        self.assertEqual(
+            [self.v2], list(Experiment.objects.filter(is_latest=True))
+        )
+
+    def test_update_last_versions_fixes_wrong_flags(self):
+        Experiment.objects.update(is_latest=True, is_latest_approved=False)
+
+        out = StringIO()
+        call_command('update_last_versions', stdout=out)
+
+        # first and second versions
+        self.assertIn('2 experiment(s) updated', out.getvalue())
+        self.assertEqual(
+            [self.v3], list(Experiment.lastversion_objects.all())
+        )
+        self.assertEqual(
+            [self.v2], list(Experiment.lastversion_objects.approved())
+        )
+
+    def test_update_last_versions_resets_to_be_analysed_count(self):
+        Experiment.objects.update(is_latest=False)
+        self.assertEqual(0, get_to_be_analysed_count())
+
+        call_command('update_last_versions', stdout=StringIO())
+
+        self.assertEqual(1, get_to_be_analysed_count())
+
+    def test_update_last_versions_verify_reports_wrong_flags(self):
+        out = StringIO()
+        call_command('update_last_versions', '--verify', stdout=out)
+        self.assertIn('are right', out.getvalue())
+
+        Experiment.objects.filter(pk=self.v2.pk).update(
+            is_latest_approved=False
+        )
+        with self.assertRaisesRegex(CommandError, str(self.v2.pk)):
+            call_command('update_last_versions', '--verify', stdout=out)
@@ -2,8 +2,12 @@ from unittest import skip
 
 from django.test import TestCase
 
-from experiments.forms import ChangeSlugForm, EMPTY_SLUG_ERROR
-from experiments.tests.tests_helper import create_experiment
+from experiments.forms import ChangeSlugForm, EMPTY_SLUG_ERROR, \
+    NepSearchForm
+from experiments.models import Experiment, Step
+from experiments.search_rebuild import rebuild_index_blue_green
+from experiments.tests.tests_helper import create_experiment, create_group, \
+    create_step, use_whoosh_index
 
 
 class ChangeSlugFormTest(TestCase):
@@ -28,3 +32,58 @@ class ChangeSlugFormTest(TestCase):
         form = ChangeSlugForm(data={'slug': other_experiment.slug})
         self.assertFalse(form.is_valid())
         self.assertEqual(form.errors['slug'], 'Message to display')
+
+
+class NepSearchFormTest(TestCase):
+
+    def setUp(self):
+        use_whoosh_index(self)
+
+        self.eeg_experiment = create_experiment(
+            1, status=Experiment.APPROVED
+        )
+        self.eeg_experiment.title = 'plexus'
+        self.eeg_experiment.save()
+        create_step(1, create_group(1, self.eeg_experiment), Step.EEG)
+        self.eeg_emg_experiment = create_experiment(
+            1, status=Experiment.APPROVED
+        )
+        self.group = create_group(1, self.eeg_emg_experiment)
+        self.group.title = 'plexus'
+        self.group.save()
+        create_step(1, self.group, Step.EEG)
+        create_step(1, self.group, Step.EMG)
+        rebuild_index_blue_green()
+
+    def search(self, data):
+        form = NepSearchForm(data)
+        return {
+            (result.model_name, int(result.pk)) for result in form.search()
+        }
+
+    def search_experiments(self, data):
+        form = NepSearchForm(data)
+        return {result.experiment_id for result in form.search()}
+
+    def test_search_with_filter_returns_objects_with_step_type(self):
+        self.assertEqual(
+            {self.eeg_experiment.id, self.eeg_emg_experiment.id},
+            self.search_experiments({'q': '', 'filter': ['eeg']})
+        )
+
+    def test_search_with_filters_returns_objects_with_all_step_types(self):
+        self.assertEqual(
+            {self.eeg_emg_experiment.id},
+            self.search_experiments({'q': '', 'filter': ['eeg', 'emg']})
+        )
+
+    def test_search_with_term_and_filter_returns_only_matching_objects(self):
+        self.assertEqual(
+            {('experiment', self.eeg_experiment.id),
+             ('group', self.group.id)},
+            self.search({'q': 'plexus', 'filter': ['eeg']})
+        )
+        self.assertEqual(
+            {('group', self.group.id)},
+            self.search({'q': 'plexus', 'filter': ['emg']})
+        )
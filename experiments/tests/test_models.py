@@ -3,15 +3,18 @@ import os
 import shutil
 
 from django.template.defaultfilters import slugify
+from django.db import connection
 from django.test import TestCase, override_settings
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from datetime import datetime
+from unittest.mock import patch
 from random import choice
 
 from experiments.models import Experiment, Study, Group, Researcher, \
     RejectJustification, Publication, ExperimentalProtocol, Step, \
-    StepAdditionalFile, Gender, File, Participant, ExperimentResearcher
+    StepAdditionalFile, Gender, File, Participant, ExperimentResearcher, \
+    EEGData, QuestionnaireResponse
 from experiments.tests.tests_helper import create_experiment, create_group, \
     create_binary_file, create_eeg_setting, \
     create_eeg_electrode_localization_system, create_context_tree, \
@@ -235,6 +238,57 @@ class ExperimentModelTest(TestCase):
         e7 = create_experiment(1, owner2, title='This is one more slug')
         self.assertEqual(slugify(e7.title), e7.slug)
 
+    def test_lastversion_objects_returns_last_version_of_each_experiment(self):
+        e1 = create_experiment(1, self.owner, Experiment.APPROVED)
+        e1_v2 = create_next_version_experiment(e1)
+        e1_v3 = create_next_version_experiment(e1_v2)
+        e1_v3.status = Experiment.TO_BE_ANALYSED
+        e1_v3.save()
+        e2 = create_experiment(1, create_owner('lab2'), Experiment.RECEIVING)
+
+        self.assertEqual(
+            {e1_v3, e2}, set(Experiment.lastversion_objects.all())
+        )
+        self.assertEqual(
+            [e1_v2], list(Experiment.lastversion_objects.approved())
+        )
+
+    def test_lastversion_objects_sql_does_not_grow_with_experiments(self):
+        create_experiment(1, self.owner, Experiment.APPROVED)
+        all_sql = str(Experiment.lastversion_objects.all().query)
+        approved_sql = str(Experiment.lastversion_objects.approved().query)
+
+        for experiment in create_experiment(
+                10, self.owner, Experiment.APPROVED
+        ):
+            create_next_version_experiment(experiment)
+
+        self.assertEqual(
+            all_sql, str(Experiment.lastversion_objects.all().query)
+        )
+        self.assertEqual(
+            approved_sql, str(Experiment.lastversion_objects.approved().query)
+        )
+
+    def test_saving_experiment_invalidates_detail_pages_of_its_versions(self):
+        e1 = create_experiment(1, self.owner)
+        e1_v2 = create_next_version_experiment(e1)
+        # same nes_id, other owner
+        e2 = create_experiment(1, create_owner('lab2'))
+        e2.nes_id = e1.nes_id
+        e2.save()
+
+        with patch(
+                'experiments.models.invalidate_experiment_detail_cache'
+        ) as invalidate:
+            e1_v2.save()
+
+        self.assertEqual(
+            {e1.pk, e1_v2.pk},
+            {experiment for args, kwargs in invalidate.call_args_list
+             for experiment in args[0]}
+        )
+
     def test_delete_instance_deletes_its_files(self):
         experiment = create_experiment(1)
 
@@ -745,3 +799,80 @@ class StimulusModel(TestCase):
                 self.TEMP_MEDIA_ROOT, file_instance.name
             ))
         )
+
+
+class QueryPlanTest(TestCase):
+    """Check that the most frequent queries of the portal use indexes, so
+    that they keep scaling when the tables grow. Fails if a migration drops
+    or changes one of the indexes.
+    """
+
+    def setUp(self):
+        create_genders()
+        owner = create_owner()
+        experiments = create_experiment(
+            5, owner, Experiment.APPROVED
+        ) + create_experiment(5, owner, Experiment.TO_BE_ANALYSED)
+        for experiment in experiments:
+            for group in create_group(2, experiment):
+                create_step(2, group, Step.EEG)
+                create_step(2, group, Step.QUESTIONNAIRE)
+                create_participant(
+                    3, group, Gender.objects.get(name='male')
+                )
+        self.experiment = experiments[0]
+        self.group = self.experiment.groups.first()
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # tables of the test database are too small for the planner
+                # to prefer an index scan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assertIndexScan(self, queryset, index=None):
+        plan = self.explain(queryset)
+        table = queryset.model._meta.db_table
+        self.assertNotRegex(
+            plan, r'(Seq Scan on|SCAN( TABLE)?) %s\b(?! USING)' % table
+        )
+        if index:
+            self.assertIn(index, plan)
+
+    def test_last_versions_by_status_use_index(self):
+        self.assertIndexScan(
+            Experiment.lastversion_objects.all().filter(
+                status=Experiment.TO_BE_ANALYSED
+            )
+        )
+        self.assertIndexScan(
+            Experiment.objects.filter(status=Experiment.TO_BE_ANALYSED),
+            'experiments_status_latest_idx'
+        )
+
+    def test_experiment_versions_use_unique_index(self):
+        self.assertIndexScan(Experiment.objects.filter(
+            nes_id=self.experiment.nes_id, owner=self.experiment.owner
+        ))
+        self.assertIndexScan(Experiment.objects.filter(
+            nes_id=self.experiment.nes_id, owner=self.experiment.owner,
+            version=self.experiment.version
+        ))
+
+    def test_steps_of_group_by_type_use_index(self):
+        self.assertIndexScan(
+            Step.objects.filter(group=self.group, type=Step.EEG),
+            'experiments_step_grp_type_idx'
+        )
+
+    def test_data_collections_of_participant_and_step_use_index(self):
+        participant = self.group.participants.first()
+        step = self.group.steps.first()
+        for model in [EEGData, QuestionnaireResponse]:
+            self.assertIndexScan(model.objects.filter(participant=participant))
+            self.assertIndexScan(model.objects.filter(step=step))
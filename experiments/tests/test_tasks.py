@@ -0,0 +1,136 @@
+import os
+from unittest.mock import patch
+
+import haystack
+from django.test import TestCase
+from haystack.query import SearchQuerySet
+
+from experiments import search_indexes
+from experiments.models import Experiment, Group, Gender, Step
+from experiments.search_rebuild import rebuild_index_blue_green
+from experiments.tasks import update_experiment_index
+from experiments.tests.tests_helper import create_experiment, create_group, \
+    create_next_version_experiment, create_genders, create_participant, \
+    create_step, use_whoosh_index
+
+
+def indexed_pks(model):
+    return {int(result.pk) for result in SearchQuerySet().models(model)}
+
+
+class UpdateExperimentIndexTest(TestCase):
+
+    def setUp(self):
+        use_whoosh_index(self)
+
+        self.experiment = create_experiment(1, status=Experiment.APPROVED)
+        self.group = create_group(1, self.experiment)
+
+    def test_update_experiment_index_indexes_experiment_objects(self):
+        update_experiment_index(self.experiment.id)
+
+        self.assertEqual({self.experiment.id}, indexed_pks(Experiment))
+        self.assertEqual({self.group.id}, indexed_pks(Group))
+
+    def test_update_experiment_index_stores_experiment_data(self):
+        create_genders()
+        create_participant(2, self.group, Gender.objects.first())
+        create_step(1, self.group, Step.EMG)
+        create_step(1, self.group, Step.EEG)
+        update_experiment_index(self.experiment.id)
+
+        # experiment, group and steps
+        self.assertEqual(4, SearchQuerySet().count())
+        for result in SearchQuerySet().all():
+            self.assertEqual(self.experiment.id, result.experiment_id)
+            self.assertEqual(self.experiment.slug, result.experiment_slug)
+            self.assertEqual(self.experiment.title, result.experiment_title)
+            self.assertEqual(2, result.participants_count)
+            self.assertEqual([Step.EEG, Step.EMG], result.step_types)
+
+    def test_update_experiment_index_queries_experiment_data_once(self):
+        create_step(3, self.group, Step.EMG)
+        create_step(1, create_group(1, self.experiment), Step.EEG)
+
+        with patch(
+                'experiments.search_indexes._query_experiment_data',
+                wraps=search_indexes._query_experiment_data
+        ) as query_experiment_data:
+            update_experiment_index(self.experiment.id)
+
+        query_experiment_data.assert_called_once_with(self.experiment)
+
+    def test_update_experiment_index_removes_previous_version(self):
+        other_experiment = create_experiment(1, status=Experiment.APPROVED)
+        update_experiment_index(self.experiment.id)
+        update_experiment_index(other_experiment.id)
+
+        new_version = create_next_version_experiment(self.experiment)
+        new_group = create_group(1, new_version)
+        update_experiment_index(new_version.id)
+
+        self.assertEqual(
+            {new_version.id, other_experiment.id},
+            indexed_pks(Experiment)
+        )
+        self.assertEqual({new_group.id}, indexed_pks(Group))
+
+    def test_update_experiment_index_does_not_index_not_approved_version(self):
+        update_experiment_index(self.experiment.id)
+
+        new_version = create_next_version_experiment(self.experiment)
+        new_version.status = Experiment.UNDER_ANALYSIS
+        new_version.save()
+        update_experiment_index(new_version.id)
+
+        self.assertEqual({self.experiment.id}, indexed_pks(Experiment))
+
+
+class RebuildIndexBlueGreenTest(TestCase):
+
+    def setUp(self):
+        self.path = use_whoosh_index(self)
+
+        self.experiment = create_experiment(1, status=Experiment.APPROVED)
+
+    def test_rebuild_index_blue_green_points_index_path_to_new_version(self):
+        version = rebuild_index_blue_green()
+
+        self.assertTrue(os.path.islink(self.path))
+        self.assertEqual(version, os.path.realpath(self.path))
+        self.assertEqual({self.experiment.id}, indexed_pks(Experiment))
+
+    def test_rebuild_index_blue_green_keeps_current_index_while_building(self):
+        rebuild_index_blue_green()
+        current_version = os.path.realpath(self.path)
+        other_experiment = create_experiment(1, status=Experiment.APPROVED)
+
+        def update(backend, index, iterable, commit=True):
+            # current version is still searched during the build
+            self.assertEqual(current_version, os.path.realpath(self.path))
+            self.assertEqual({self.experiment.id}, indexed_pks(Experiment))
+            return original_update(backend, index, iterable, commit)
+
+        backend_class = haystack.connections['default'].backend
+        original_update = backend_class.update
+        with patch.object(backend_class, 'update', update):
+            rebuild_index_blue_green()
+
+        self.assertEqual(
+            {self.experiment.id, other_experiment.id},
+            indexed_pks(Experiment)
+        )
+
+    def test_rebuild_index_blue_green_replaces_index_of_previous_rebuild(self):
+        os.makedirs(self.path)
+        rebuild_index_blue_green()
+
+        self.assertTrue(os.path.islink(self.path))
+        self.assertEqual({self.experiment.id}, indexed_pks(Experiment))
+
+    def test_rebuild_index_blue_green_deletes_old_versions(self):
+        versions = [rebuild_index_blue_green(keep=1) for i in range(3)]
+
+        self.assertFalse(os.path.exists(versions[0]))
+        self.assertTrue(os.path.exists(versions[1]))
+        self.assertEqual(versions[2], os.path.realpath(self.path))
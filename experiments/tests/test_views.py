@@ -4,7 +4,9 @@ import random
 import re
 import sys
 import tempfile
+from itertools import groupby
 from unittest import skip
+from unittest.mock import patch
 
 import haystack
 import shutil
@@ -12,12 +14,15 @@ from django.contrib import auth
 from django.contrib.auth.models import User, Permission
 from django.core import mail
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
 from django.utils.text import slugify
 from haystack.query import SearchQuerySet
 
 from experiments import views
+from experiments.appclasses import group_by_experiment
 from experiments.forms import ChangeSlugForm
 from experiments.models import Experiment, Step, \
     QuestionnaireDefaultLanguage, QuestionnaireLanguage, Group, ContextTree, \
@@ -33,7 +38,8 @@ from experiments.tests.tests_helper import create_experiment_related_objects, \
     create_questionnaire_language, create_valid_questionnaires, \
     create_publication, create_experiment_researcher, create_study, \
     create_researcher, PASSWORD, create_genders, create_emg_setting, \
-    create_emg_step
+    create_emg_step, create_participant, use_whoosh_index
+from experiments.search_rebuild import rebuild_index_blue_green
 from experiments.views import change_slug
 from functional_tests import test_search
 from nep import settings
@@ -70,6 +76,21 @@ class HomePageTest(TestCase):
 
         self.assertIn(self.experiment, response.context['experiments'])
 
+    def test_experiments_list_has_number_of_participants_and_groups(self):
+        self.experiment.status = Experiment.APPROVED
+        self.experiment.save()
+        create_genders()
+        for qtty in [2, 3]:
+            group = create_group(1, self.experiment)
+            create_participant(qtty, group, Gender.objects.first())
+
+        response = self.client.get('/')
+
+        experiment = response.context['experiments'].get()
+        self.assertEqual(experiment.total_participants, 5)
+        self.assertEqual(experiment.groups_count, 2)
+        self.assertContains(response, '5 in&nbsp;2')
+
     def test_trustee_can_change_experiment_status_with_a_POST_request(self):
         study = create_study(1, self.experiment)
         create_researcher(study)
@@ -560,12 +581,141 @@ class ExperimentDetailTest(TestCase):
                 'survey_metadata'], 'invalid_questionnaire'
         )
 
+    def test_questionnaire_metadata_is_built_again_only_when_it_changes(self):
+        group = create_group(1, self.experiment)
+        q = create_questionnaire(1, 'q1', group)
+        q_language = create_questionnaire_language(
+            q, settings.BASE_DIR + '/experiments/tests/questionnaire1_pt-br.csv',
+            'en'
+        )
+
+        with patch(
+                'experiments.views._build_questionnaire_metadata',
+                wraps=views._build_questionnaire_metadata
+        ) as build_metadata:
+            for i in range(2):
+                response = self.client.get(
+                    '/experiments/' + self.experiment.slug + '/'
+                )
+            self.assertLessEqual(build_metadata.call_count, 1)
+
+            q_language.survey_metadata = q_language.survey_metadata.replace(
+                'Fez alguma cirurgia de nervo?', 'Fez cirurgia de nervo?'
+            )
+            q_language.save()
+            build_metadata.reset_mock()
+            response = self.client.get(
+                '/experiments/' + self.experiment.slug + '/'
+            )
+            self.assertEqual(build_metadata.call_count, 1)
+
+        self.assertIn('Fez cirurgia de nervo?', response.content.decode())
+
+    def test_experiment_detail_public_parts_are_cached(self):
+        group = create_group(1, self.experiment)
+        create_participant(2, group, Gender.objects.get(name='male'))
+        create_experiment(1, status=Experiment.TO_BE_ANALYSED)
+        trustee = create_trustee_user()
+
+        with patch(
+                'experiments.views._get_questionnaires',
+                wraps=views._get_questionnaires
+        ) as get_questionnaires, patch(
+            'experiments.views._get_gender_grouping',
+            wraps=views._get_gender_grouping
+        ) as get_gender_grouping:
+            response = self.client.get(
+                '/experiments/' + self.experiment.slug + '/'
+            )
+            self.assertIn("{'male': 2}", response.content.decode())
+            self.assertIn(
+                'let to_be_analysed_count = None', response.content.decode()
+            )
+
+            # trustee bits are rendered per request
+            self.client.login(username=trustee.username, password=PASSWORD)
+            response = self.client.get(
+                '/experiments/' + self.experiment.slug + '/'
+            )
+            self.assertEqual(1, get_questionnaires.call_count)
+            self.assertEqual(1, get_gender_grouping.call_count)
+        self.assertIn("{'male': 2}", response.content.decode())
+        self.assertIn('let to_be_analysed_count = 1', response.content.decode())
+        self.assertIn('change_url_modal', response.content.decode())
+
+    def test_experiment_detail_loads_trustee_groups_once(self):
+        trustee = create_trustee_user()
+        self.client.login(username=trustee.username, password=PASSWORD)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                '/experiments/' + self.experiment.slug + '/'
+            )
+
+        self.assertContains(response, 'change_url_modal')
+        self.assertEqual(1, len([
+            query for query in context.captured_queries
+            if 'auth_user_groups' in query['sql']
+        ]))
+
+    def test_experiment_detail_cache_is_invalidated_when_related_objects_change(self):
+        group = create_group(1, self.experiment)
+        create_participant(2, group, Gender.objects.get(name='male'))
+        response = self.client.get(
+            '/experiments/' + self.experiment.slug + '/'
+        )
+        self.assertIn("{'male': 2}", response.content.decode())
+
+        create_participant(1, group, Gender.objects.get(name='female'))
+        response = self.client.get(
+            '/experiments/' + self.experiment.slug + '/'
+        )
+        self.assertIn(
+            "{'female': 1, 'male': 2}", response.content.decode()
+        )
+
+        group.delete()
+        response = self.client.get(
+            '/experiments/' + self.experiment.slug + '/'
+        )
+        self.assertIn('django_data = {};', response.content.decode())
+
+        # other versions of the experiment are listed in the page
+        new_version = create_next_version_experiment(self.experiment)
+        response = self.client.get(
+            '/experiments/' + self.experiment.slug + '/'
+        )
+        self.assertIn(
+            '/experiments/' + new_version.slug + '/', response.content.decode()
+        )
+
     def test_experiment_detail_page_has_change_slug_form(self):
         experiment = create_experiment(1)
 
         response = self.client.get('/experiments/' + experiment.slug + '/')
         self.assertIsInstance(response.context['form'], ChangeSlugForm)
 
+    def test_access_experiment_detail_returns_participants_statistics(self):
+        group = create_group(1, self.experiment)
+        male = Gender.objects.get(name='male')
+        female = Gender.objects.get(name='female')
+        participants = create_participant(3, group, male) + [
+            create_participant(1, create_group(1, self.experiment), female)
+        ]
+        for participant, age in zip(participants, [20.3, 20.7, None, 31]):
+            participant.age = age
+            participant.save()
+
+        response = self.client.get(
+            '/experiments/' + self.experiment.slug + '/'
+        )
+
+        self.assertEqual(response.context['total_participants'], 4)
+        self.assertEqual(
+            response.context['gender_grouping'], {'female': 1, 'male': 3}
+        )
+        self.assertEqual(response.context['age_grouping'], {20: 2, 31: 1})
+
     def test_access_experiment_wo_other_experiment_versions_returns_no_other(self):
         response = self.client.get('/experiments/' + self.experiment.slug + '/')
 
@@ -757,6 +907,57 @@ class ChangeExperimentSlugTest(TestCase):
         self.assertFalse(response.context['messages'])
 
 
+class ToBeAnalysedCountTest(TestCase):
+
+    def setUp(self):
+        self.experiment = create_experiment(1)
+        study = create_study(1, self.experiment)
+        create_researcher(study)
+        # older versions are not counted
+        create_next_version_experiment(create_experiment(1))
+        self.trustee = create_trustee_user()
+        self.url = reverse('ajax-to_be_analysed')
+
+    def test_ajax_to_be_analysed_returns_count_of_last_versions(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(b'2', response.content)
+        self.assertEqual('"2"', response['ETag'])
+
+    def test_ajax_to_be_analysed_is_answered_from_cache(self):
+        self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+            self.assertEqual(b'2', response.content)
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"2"')
+            self.assertEqual(304, response.status_code)
+
+    def test_ajax_to_be_analysed_reads_count_once(self):
+        with patch(
+                'experiments.views.get_to_be_analysed_count', return_value=2
+        ) as get_count:
+            response = self.client.get(self.url)
+
+        self.assertEqual(b'2', response.content)
+        get_count.assert_called_once_with()
+
+    def test_count_is_updated_when_trustee_changes_status(self):
+        self.client.login(username=self.trustee.username, password=PASSWORD)
+        response = self.client.get('/')
+        self.assertEqual(2, response.context['to_be_analysed_count'])
+
+        self.client.post(
+            '/experiments/' + str(self.experiment.id) + '/change_status/',
+            {'status': Experiment.UNDER_ANALYSIS}
+        )
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"2"')
+        self.assertEqual(b'1', response.content)
+        response = self.client.get('/')
+        self.assertEqual(1, response.context['to_be_analysed_count'])
+
+
 @override_settings(HAYSTACK_CONNECTIONS=TEST_HAYSTACK_CONNECTIONS)
 class SearchTest(TestCase):
 
@@ -1145,6 +1346,106 @@ class SearchTest(TestCase):
         self.assertContains(response, '<tr', 1)
 
 
+class SearchPaginationTest(TestCase):
+
+    def setUp(self):
+        use_whoosh_index(self)
+
+    def create_matching_experiments(self, qtty):
+        for i in range(qtty):
+            experiment = create_experiment(1, status=Experiment.APPROVED)
+            experiment.title = 'plexus'
+            experiment.description = 'brachial'
+            experiment.save()
+            group = create_group(1, experiment)
+            group.title = 'plexus'
+            group.save()
+        rebuild_index_blue_green()
+
+    def search(self, page=1, query='plexus'):
+        return self.client.get('/search/', {'q': query, 'page': page})
+
+    @patch.object(views.NepSearchView, 'paginate_by', 4)
+    def test_search_paginates_results_by_experiment(self):
+        # each experiment has two results: the experiment and its group
+        self.create_matching_experiments(5)
+
+        response = self.search()
+        self.assertEqual(5, response.context['paginator'].count)
+        self.assertEqual(8, len(response.context['page_obj'].object_list))
+        self.assertContains(response, 'page=2')
+        response = self.search(2)
+        self.assertEqual(2, len(response.context['page_obj'].object_list))
+
+    @patch.object(views.NepSearchView, 'paginate_by', 1)
+    def test_search_keeps_results_of_experiment_in_same_page(self):
+        self.create_matching_experiments(2)
+
+        for page in [1, 2]:
+            response = self.search(page)
+            experiment_ids = {
+                result.experiment_id
+                for result in response.context['page_obj'].object_list
+            }
+            self.assertEqual(1, len(experiment_ids))
+            self.assertEqual(
+                2, len(response.context['page_obj'].object_list)
+            )
+
+    @patch.object(views.NepSearchView, 'paginate_by', 4)
+    def test_search_runs_same_number_of_queries_for_any_number_of_results(
+            self):
+        # only experiments match, so pages have the same kind of results
+        self.create_matching_experiments(5)
+        with CaptureQueriesContext(connection) as context:
+            self.search(query='brachial')
+        queries_small = len(context.captured_queries)
+
+        self.create_matching_experiments(5)
+        with CaptureQueriesContext(connection) as context:
+            response = self.search(query='brachial')
+        self.assertEqual(10, response.context['paginator'].count)
+        self.assertEqual(queries_small, len(context.captured_queries))
+
+    def test_search_results_page_is_rendered_without_database_queries(self):
+        self.create_matching_experiments(3)
+        experiment = Experiment.objects.first()
+
+        with self.assertNumQueries(0):
+            response = self.search()
+
+        # the description is read from the data stored in the index
+        self.assertContains(response, 'brachial')
+        self.assertContains(response, experiment.slug)
+
+    def test_search_groups_results_by_experiment(self):
+        self.create_matching_experiments(3)
+
+        response = self.search()
+        experiment_ids = [
+            result.experiment_id
+            for result in response.context['page_obj'].object_list
+        ]
+        # results of each experiment are together
+        self.assertEqual(
+            len(set(experiment_ids)), len(list(groupby(experiment_ids)))
+        )
+
+    def test_group_by_experiment_keeps_order_of_best_hits(self):
+        hits = [
+            (2, 'experiments.group.1'),
+            (None, 'experiments.tmsdevice.1'),
+            (1, 'experiments.experiment.1'),
+            (2, 'experiments.experiment.2'),
+            (None, 'experiments.coilmodel.1'),
+        ]
+
+        self.assertEqual(
+            [[hits[0], hits[3]], [hits[1]], [hits[2]], [hits[4]]],
+            group_by_experiment(hits)
+        )
+
+
 class DownloadExperimentTest(TestCase):
 
     TEMP_MEDIA_ROOT = os.path.join(tempfile.mkdtemp())
@@ -1,127 +1,132 @@
 import csv
-import math
-import pandas
-import tempfile
+import hashlib
+import io
+from collections import OrderedDict
 
-import shutil
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.views import LoginView, PasswordResetView, \
     PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
 from django.db.models import Count
 from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.shortcuts import render
 from django.template.loader import render_to_string
+from django.views.decorators.http import condition
+from django.utils.functional import SimpleLazyObject
 from django.utils.text import slugify
 from django.utils.translation import activate, LANGUAGE_SESSION_KEY, \
     ugettext as _
 
 from haystack.generic_views import SearchView
 
-from downloads.export import ExportExecution
+from downloads.export import ExportExecution, CSV_NA_VALUES
+from experiments.appclasses import ExperimentPaginator
 from experiments.forms import NepSearchForm, ChangeSlugForm
 from experiments.models import Experiment, RejectJustification, Step, \
-    Questionnaire, QuestionnaireDefaultLanguage, QuestionnaireLanguage
-from experiments.tasks import rebuild_haystack_index
+    Questionnaire, QuestionnaireDefaultLanguage, QuestionnaireLanguage, \
+    Participant, get_to_be_analysed_count
+from experiments.permissions import is_trustee
+from experiments.tasks import update_experiment_index
 
 
-def _get_nested_rec(key, group):
-    rec = dict()
-    rec['question_order'] = key[0]
-    rec['question_code'] = key[1]
-    rec['question_limesurvey_type'] = key[2]
-    rec['question_description'] = key[3]
-
-    for field in ['subquestion_description', 'option_description']:
-        if isinstance(group[field].unique()[0], float) and \
-                math.isnan(group[field].unique()[0]):
-            rec[field] = None
-        else:
-            rec[field] = list(group[field].unique())
-
-    return rec
-
-
-def _isvalid(source_path):
-    # tests for number of columns
-    with open(source_path, 'r') as source:
-        reader = csv.reader(source, skipinitialspace=True)
-        for row in reader:
-            # the number of columns in csv file must be 15
-            if len(row) != 15:
-                return False
-
-    # tests for column titles
-    with open(source_path, 'r') as source:
-        reader = csv.reader(source, skipinitialspace=True)
-        # headers = next(reader)  # TODO: better way
-        for row in reader:
-            if row[0] != 'questionnaire_code' or \
-                    row[1] != 'questionnaire_title' or \
-                    row[2] != 'question_group' or \
-                    row[3] != 'question_order' or \
-                    row[4] != 'question_type' or \
-                    row[5] != 'question_type_description' or \
-                    row[6] != 'question_index' or \
-                    row[7] != 'question_code' or \
-                    row[8] != 'question_description' or \
-                    row[9] != 'subquestion_code' or \
-                    row[10] != 'subquestion_description' or \
-                    row[11] != 'question_scale' or \
-                    row[12] != 'question_scale_label' or \
-                    row[13] != 'option_code' or \
-                    row[14] != 'option_description':
-                return False
-            break
-
-    return True
+QUESTIONNAIRE_METADATA_HEADER = [
+    'questionnaire_code', 'questionnaire_title', 'question_group',
+    'question_order', 'question_type', 'question_type_description',
+    'question_index', 'question_code', 'question_description',
+    'subquestion_code', 'subquestion_description', 'question_scale',
+    'question_scale_label', 'option_code', 'option_description'
+]
 
 
-def _get_questionnaire_metadata(metadata):
-    # put the questionnaire data into a temporary csv file
-    temp_dir = tempfile.mkdtemp()
-    file = open(temp_dir + '/questionnaire.csv', 'w')
-    file.write(metadata)
-    file.close()
-
-    if not _isvalid(temp_dir + '/questionnaire.csv'):
+def _question_order_key(question_order):
+    try:
+        return 0, float(question_order), question_order
+    except ValueError:
+        return 1, 0, question_order
+
+
+def _build_questionnaire_metadata(metadata):
+    """Build the question groups displayed by
+    experiments/questionnaires/questionnaire_language.html in one pass over
+    the metadata csv rows: {question_group: {'data': [question, ...]}}, the
+    groups ordered by name and the questions of each one by question_order.
+    Each question is a dict with question_order, question_code,
+    question_limesurvey_type, question_description and the lists of distinct
+    subquestion_description and option_description (None if there is none).
+    """
+    reader = csv.reader(io.StringIO(metadata), skipinitialspace=True)
+    # the csv file must have the 15 columns of the header, in all rows
+    if next(reader, None) != QUESTIONNAIRE_METADATA_HEADER:
         return 'invalid_questionnaire'
 
-    # remove the columns that won't be used and save in another temporary file
-    with open(temp_dir + '/questionnaire.csv', 'r') as source:
-        reader = csv.reader(source, skipinitialspace=True)
-        with open(temp_dir + '/questionnaire_cleaned.csv', 'w') as result:
-            writer = csv.writer(result)
-            for r in reader:
-                writer.writerow((r[2], r[3], r[4], r[7], r[8], r[10], r[14]))
-
-    q_cleaned = pandas.read_csv(temp_dir + '/questionnaire_cleaned.csv')
-
-    records = []
-
-    # first, group questions by question_code
-    for key, grp in q_cleaned.groupby(['question_order',
-                                       'question_code',
-                                       'question_type',
-                                       'question_description']):
-        rec = _get_nested_rec(key, grp)
-        records.append(rec)
-
-    # now, build one level above, the question groups level
-    q_groups = dict()
-    for key, grp in q_cleaned.groupby(['question_group']):
-        q_groups[key] = []
-        q_unique = grp['question_code'].unique()
-        for record in records:
-            if record['question_code'] in q_unique:
-                q_groups[key].append(record)
+    questions = OrderedDict()
+    question_code_groups = {}
+    for row in reader:
+        if len(row) != len(QUESTIONNAIRE_METADATA_HEADER):
+            return 'invalid_questionnaire'
+        row = [value if value not in CSV_NA_VALUES else None for value in row]
+        question_group, question_order, question_type = row[2:5]
+        question_code, question_description = row[7:9]
+        subquestion_description, option_description = row[10], row[14]
+
+        if question_group is not None:
+            question_code_groups.setdefault(
+                question_code, OrderedDict()
+            )[question_group] = None
+
+        key = (question_order, question_code, question_type,
+               question_description)
+        if None in key:
+            continue
+        if key not in questions:
+            questions[key] = {
+                'question_order': question_order,
+                'question_code': question_code,
+                'question_limesurvey_type': question_type,
+                'question_description': question_description,
+                'subquestion_description': OrderedDict(),
+                'option_description': OrderedDict(),
+            }
+        question = questions[key]
+        question['subquestion_description'][subquestion_description] = None
+        question['option_description'][option_description] = None
+
+    q_groups = {}
+    for key in sorted(
+            questions,
+            key=lambda key: (_question_order_key(key[0]),) + key[1:]
+    ):
+        question = questions[key]
+        # distinct values, or None when the first value is missing
+        for field in ['subquestion_description', 'option_description']:
+            values = list(question[field])
+            question[field] = \
+                [value for value in values if value is not None] \
+                if values[0] is not None else None
+        for question_group in question_code_groups.get(key[1], []):
+            q_groups.setdefault(question_group, []).append(question)
 
     # make dictionnaire to ease diplaying in template
-    for q_group in q_groups:
-        q_groups[q_group] = dict(data=q_groups[q_group])
+    return {
+        question_group: dict(data=q_groups[question_group])
+        for question_group in sorted(q_groups)
+    }
 
-    shutil.rmtree(temp_dir)
+
+def _get_questionnaire_metadata(metadata):
+    """Return the question groups built from questionnaire metadata. They
+    are cached by the hash of the metadata, so they are built again only when
+    the survey_metadata of the questionnaire language changes.
+    """
+    key = 'questionnaire_metadata_' + \
+        hashlib.sha1(str(metadata).encode('utf-8')).hexdigest()
+    q_groups = cache.get(key)
+    if q_groups is None:
+        q_groups = _build_questionnaire_metadata(metadata)
+        cache.set(key, q_groups, None)
 
     return q_groups
 
@@ -169,11 +174,20 @@ def _order_researchers(experiment):
     return researchers_order
 
 
+def _get_to_be_analysed_count(request):
+    """Return the number of experiments to be analysed displayed in the
+    badge in page top, or None if the user is not a trustee
+    """
+    if is_trustee(request.user):
+        return get_to_be_analysed_count()
+
+    return None
+
+
 def home_page(request):
     # will be None if home contains the list of normal user
-    to_be_analysed_count = None
-    if request.user.is_authenticated and \
-            request.user.groups.filter(name='trustees').exists():
+    to_be_analysed_count = _get_to_be_analysed_count(request)
+    if to_be_analysed_count is not None:
         all_experiments = \
             Experiment.lastversion_objects.all()
         # Put experiments in following order:
@@ -185,14 +199,13 @@ def home_page(request):
         not_approved = all_experiments.filter(status=Experiment.NOT_APPROVED)
         approved = all_experiments.filter(status=Experiment.APPROVED)
         experiments = to_be_analysed | under_analysis | not_approved | approved
-        to_be_analysed_count = to_be_analysed.count()
     else:
         experiments = Experiment.lastversion_objects.approved()
 
-    for experiment in experiments:
-        experiment.total_participants = \
-            sum([len(group.participants.all())
-                 for group in experiment.groups.all()])
+    experiments = experiments.annotate(
+        total_participants=Count('groups__participants', distinct=True),
+        groups_count=Count('groups', distinct=True)
+    )
 
     return render(
         request, 'experiments/home.html',
@@ -205,38 +218,29 @@ def home_page(request):
     )
 
 
-def experiment_detail(request, slug):
-    # will be None if home contains the list for user not logged in
-    to_be_analysed_count = None
-    if request.user.is_authenticated and \
-            request.user.groups.filter(name='trustees').exists():
-        all_experiments = Experiment.lastversion_objects.all()
-        to_be_analysed_count = all_experiments.filter(
-            status=Experiment.TO_BE_ANALYSED).count()
+def _get_gender_grouping(experiment):
+    # gender_id is the gender name
+    return dict(Participant.objects.filter(
+        group__experiment=experiment
+    ).values_list('gender').annotate(count=Count('id')).order_by('gender'))
 
-    try:
-        experiment = Experiment.objects.get(slug=slug)
-    except Experiment.DoesNotExist:
-        raise Http404('404 - Not Found')
 
-    gender_grouping = {}
+def _get_age_grouping(experiment):
     age_grouping = {}
-    total_participants = 0
-    for group in experiment.groups.all():
-        for participant in group.participants.all():
-            # gender
-            if participant.gender.name not in gender_grouping:
-                gender_grouping[participant.gender.name] = 0
-            gender_grouping[participant.gender.name] += 1
-            # age
-            if participant.age:
-                if int(participant.age) not in age_grouping:
-                    age_grouping[int(participant.age)] = 0
-                age_grouping[int(participant.age)] += 1
-        # total participants
-        total_participants += group.participants.count()
-
-    # get default (language) questionnaires (or first) for all groups
+    for age, count in Participant.objects.filter(
+            group__experiment=experiment, age__isnull=False
+    ).values_list('age').annotate(count=Count('id')).order_by('age'):
+        if age:
+            if int(age) not in age_grouping:
+                age_grouping[int(age)] = 0
+            age_grouping[int(age)] += count
+
+    return age_grouping
+
+
+def _get_questionnaires(experiment):
+    """Return default (language) questionnaires (or first) for all groups
+    """
     questionnaires = {}
     for group in experiment.groups.all():
         if group.steps.filter(type=Step.QUESTIONNAIRE).count() > 0:
@@ -259,8 +263,21 @@ def experiment_detail(request, slug):
                 questionnaires[group.title][q.id]['language_codes'] = \
                     _get_available_languages(q)
 
-    researchers_ordered = _order_researchers(experiment)
+    return questionnaires
+
+
+def experiment_detail(request, slug):
+    try:
+        experiment = Experiment.objects.get(slug=slug)
+    except Experiment.DoesNotExist:
+        raise Http404('404 - Not Found')
 
+    # The public parts of the page are cached in template fragments (see
+    # EXPERIMENT_DETAIL_FRAGMENTS in models), so the values used only by
+    # them are evaluated when the fragments are not in cache.
+    gender_grouping = SimpleLazyObject(
+        lambda: _get_gender_grouping(experiment)
+    )
     other_versions = Experiment.objects.filter(
         nes_id=experiment.nes_id,
         status=Experiment.APPROVED,
@@ -270,14 +287,24 @@ def experiment_detail(request, slug):
         request, 'experiments/detail.html', {
             'experiment': experiment,
             'gender_grouping': gender_grouping,
-            'age_grouping': age_grouping,
-            'total_participants': total_participants,
-            'to_be_analysed_count': to_be_analysed_count,
-            'questionnaires': questionnaires,
+            'age_grouping': SimpleLazyObject(
+                lambda: _get_age_grouping(experiment)
+            ),
+            'total_participants': SimpleLazyObject(
+                lambda: sum(gender_grouping.values())
+            ),
+            # will be None if user is not a trustee
+            'to_be_analysed_count': _get_to_be_analysed_count(request),
+            'questionnaires': SimpleLazyObject(
+                lambda: _get_questionnaires(experiment)
+            ),
             'form': ChangeSlugForm(),
-            'has_setting': experiment.has_setting(),
-            'researchers_order': researchers_ordered,
-            'other_versions': other_versions
+            'has_setting': SimpleLazyObject(experiment.has_setting),
+            'researchers_order': SimpleLazyObject(
+                lambda: _order_researchers(experiment)
+            ),
+            'other_versions': other_versions,
+            'detail_cache_timeout': settings.EXPERIMENT_DETAIL_CACHE_TIMEOUT
         }
     )
 
@@ -365,9 +392,10 @@ def change_status(request, experiment_id):
             _(' warning that the experiment changed status to Approved.')
         )
 
-        # After experiment has been approved reindex data base including
-        # this new experiment.
-        rebuild_haystack_index.delay()
+        # After experiment has been approved index it, and remove its
+        # previous version from the index. The full rebuild of the index
+        # (rebuild_haystack_index) is left to maintenance.
+        update_experiment_index.delay(experiment.id)
 
     if status == Experiment.UNDER_ANALYSIS:
         experiment.status = status
@@ -467,12 +495,19 @@ def change_slug(request, experiment_id):
     return HttpResponseRedirect('/experiments/' + experiment.slug + '/')
 
 
-def ajax_to_be_analysed(request):
-    to_be_analysed = Experiment.objects.filter(
-        status=Experiment.TO_BE_ANALYSED
-    ).count()
+def _to_be_analysed_etag(request):
+    # read once per request, the view answers the same count
+    request.to_be_analysed_count = get_to_be_analysed_count()
+    return str(request.to_be_analysed_count)
 
-    return HttpResponse(to_be_analysed, content_type='application/json')
+
+# Polled by the pages of the trustees. Answered from the cached count, so
+# without database queries, and with 304 Not Modified if it didn't change.
+@condition(etag_func=_to_be_analysed_etag)
+def ajax_to_be_analysed(request):
+    return HttpResponse(
+        request.to_be_analysed_count, content_type='application/json'
+    )
 
 
 def ajax_questionnaire_languages(request, questionnaire_id, lang_code):
@@ -504,6 +539,11 @@ def language_change(request, language_code):
 class NepSearchView(SearchView):
     form_class = NepSearchForm
     form_name = 'search_form'
+    # results are rendered from the data stored in the index (see
+    # ExperimentRelatedIndex), without fetching their objects
+    load_all = False
+    # pages have the results of paginate_by experiments
+    paginator_class = ExperimentPaginator
 
     def get(self, request, *args, **kwargs):
         if not self.request.GET.get('q') and \
@@ -519,19 +559,11 @@ class NepSearchView(SearchView):
     def get_context_data(self, *args, **kwargs):
         context = super(NepSearchView, self).get_context_data(**kwargs)
 
-        if 'filter' in self.request.GET:
-            self.filter(context, self.request.GET.getlist('filter'))
-
         # Related to the badge with number of experiments to be analysed in
         # page top. It's displayed only if a trustee is logged.
-        to_be_analysed_count = None
-        if self.request.user.is_authenticated and \
-                self.request.user.groups.filter(name='trustees').exists():
-            to_be_analysed = Experiment.lastversion_objects.filter(
-                status=Experiment.TO_BE_ANALYSED)
-            to_be_analysed_count = to_be_analysed.count()
-
-        context['to_be_analysed_count'] = to_be_analysed_count
+        context['to_be_analysed_count'] = _get_to_be_analysed_count(
+            self.request
+        )
 
         # We exclude search modifiers: OR, AND, NOT to query element from
         # context dict. That's for avoid highlight this words in search
@@ -542,32 +574,13 @@ class NepSearchView(SearchView):
 
         context['query'] = words_wo_modifiers
 
-        return context
+        # Search parameters for the pagination links, keeping the search
+        # modifiers and the filters
+        search_params = self.request.GET.copy()
+        search_params.pop('page', None)
+        context['search_params'] = search_params.urlencode()
 
-    def filter(self, context, search_filters):
-        """
-        Filters search results by step type in experiment.
-        :param context: object_list returned by haystack search
-        :param search_filters: the filters chosen by the user
-        """
-        old_object_list = context['page_obj'].object_list
-        indexes_to_remove = []
-        for i in range(0, len(old_object_list)):
-            if old_object_list[i].model_name == 'experiment':
-                count = 0
-                for search_filter in search_filters:
-                    for group in old_object_list[i].object.groups.all():
-                        if group.steps.filter(type=search_filter).count() > 0:
-                            count += 1
-                            break
-                if count < len(search_filters):
-                    indexes_to_remove.append(i)
-            else:
-                indexes_to_remove.append(i)
-
-        context['page_obj'].object_list = \
-            [v for i, v in enumerate(old_object_list)
-             if i not in indexes_to_remove]
+        return context
 
 
 # inherit from LoginView to include search form besides login form
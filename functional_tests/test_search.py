@@ -533,24 +533,14 @@ class SearchTest(FunctionalTest):
         # As there are 2 experiments with 'Brachial Plexus' in title,
         # it's expected that Joselina sees only one Experiment search
         # result, given that she chosen to filter experiments that has EMG
-        # Setting. Nevertheless, there are a group and a step with
-        # 'Brachial Plexus'
-        # in some text field, but she doesn't see that matching lines because
-        # when user searches with filters the terms searched only are searched
-        # in experiment model instance.
+        # Setting. She also sees the group and the step with
+        # 'Brachial Plexus' in some text field, as they are from that
+        # experiment.
         # The page refreshes displaying the results.
         ##
         self.verify_n_objects_in_table_rows(1, 'experiment-matches')
-        # TODO: refactors this form of test by verifying if that is only one
-        #  row in the table, like in tests that has:
-        #  num_table_rows = \
-        #      len(
-        #          self.browser.find_element_by_id(
-        #              'search_table').find_elements_by_tag_name('tr')
-        #      )
-        #  self.assertEqual(num_table_rows, 1)
-        self.verify_n_objects_in_table_rows(0, 'group-matches')
-        self.verify_n_objects_in_table_rows(0, 'step-matches')
+        self.verify_n_objects_in_table_rows(1, 'group-matches')
+        self.verify_n_objects_in_table_rows(1, 'step-matches')
 
     def test_search_with_two_filters_returns_correct_objects(self):
         ##
@@ -601,15 +591,16 @@ class SearchTest(FunctionalTest):
         # step, besides "Plexus Brachial" in group description.
         # On the other hand, there's a group that has "Brachial Plexus" in
         # despcription, an EEG step but not an EMG step. So she will see only
-        # one of the two groups.
+        # one of the two groups, and its experiment.
         ##
         self.verify_n_objects_in_table_rows(1, 'experiment-matches')
+        self.verify_n_objects_in_table_rows(1, 'group-matches')
         num_table_rows = \
             len(
                 self.browser.find_element_by_id(
                     'search_table').find_elements_by_tag_name('tr')
             )
-        self.assertEqual(num_table_rows, 1)
+        self.assertEqual(num_table_rows, 2)
 
     def test_search_with_AND_modifier_returns_correct_objects(self):
         ##
@@ -35,3 +35,18 @@ EMAIL_HOST_USER = ''
 EMAIL_HOST_PASSWORD = ''
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
+
+# Cache
+# When the portal runs in more than one process (web server workers, Celery
+# workers), the cache must be shared by all of them: the cached fragments of
+# the experiment detail pages and the number of experiments to be analysed
+# are removed, when the experiments change, only from the cache of the
+# process that changed them. Use a memory backed cache server, e.g.
+# memcached (requires python-memcached):
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
+# The default local-memory cache is only right with a single process.
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -72,9 +73,9 @@ HAYSTACK_CONNECTIONS = {
 }
 HAYSTACK_DEFAULT_OPERATOR = 'OR'
 HAYSTACK_CUSTOM_HIGHLIGHTER = 'experiments.appclasses.NepHighlighter'
-# TODO: this is for doesn't paginate the SearchQueryset from NepSearchForm
-# TODO: this has to be solved after first Portal release. It's just a jerry-rig
-HAYSTACK_SEARCH_RESULTS_PER_PAGE = 500
+# Search results are paginated by experiment: a page has the results of this
+# number of experiments (see experiments.appclasses.ExperimentPaginator)
+HAYSTACK_SEARCH_RESULTS_PER_PAGE = 20
 
 # <host>:<port> for testing tha uses haystack/elasticsearch
 # This is used when substituting HAYSTACK_CONNECTIONS for another, separated
@@ -153,8 +154,25 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Disk budget, in bytes, for the partial download files (built from the
+# items selected by the users) kept in MEDIA_ROOT/download/<experiment_id>/.
+# Least recently used files are removed when the budget is exceeded.
+PARTIAL_DOWNLOAD_CACHE_SIZE = 1024 * 1024 * 1024
+
+# Seconds the public fragments of the experiment detail page are kept in
+# cache. They are removed when the experiment or its related objects change,
+# the timeout only cleans up fragments of experiments that were deleted.
+EXPERIMENT_DETAIL_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Number of threads that build the experiment download files. Tests run
+# with one thread as data created inside test transactions is not seen by
+# the database connections of other threads.
+EXPORT_WORKERS = 1 if 'test' in sys.argv else (os.cpu_count() or 1)
+
 # Celery
 CELERY_RESULT_BACKEND = 'django-db'
+# Tests run tasks locally, without a broker
+CELERY_TASK_ALWAYS_EAGER = 'test' in sys.argv
 
 # Import local settings
 try:
@@ -44,6 +44,8 @@ urlpatterns = [
 
     url(r'^$', views.home_page, name='home'),
 
+    url(r'^experiments/to_be_analysed/count/$', views.ajax_to_be_analysed,
+        name='ajax-to_be_analysed'),
     url(r'^experiments/(?P<slug>[\w-]+)/$',
         views.experiment_detail, name='experiment-detail'),
     url(r'^experiments/(?P<experiment_id>[0-9]+)/change_status',